@@ -14,15 +14,24 @@
 
 import os
 import readline
+import shlex
 import signal
 import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 from validate_email import validate_email
 from prettytable import PrettyTable
 
-from gitcher import model_layer, dictionary
+from gitcher import model_layer, completions, harvest, history_audit, \
+    gpg_keyring, mailmap, metrics, output, prof_index, reattribute, \
+    repo_index, switch_journal, watcher
+from gitcher.dictionary import Dictionary
 from gitcher.completer import TabCompleter
+from gitcher.git_command_error import GitCommandError
 from gitcher.prof import Prof
+from gitcher.prof_store import StoreFormatError
 from gitcher.not_found_prof_error import NotFoundProfError
 
 # Prompt styles
@@ -42,24 +51,15 @@ MSG_ERROR = "[" + COLOR_RED + "ERROR" + COLOR_RST + "]"
 MSG_WARNING = "[" + COLOR_YELLOW + "WARNING" + COLOR_RST + "]"
 
 
-# ===============================================
-# =             Initial validations             =
-# ===============================================
-# First, check if git is installed
-if not model_layer.check_git_installed():
-    print(
-        MSG_ERROR + " git is not installed in this machine. Impossible to "
-                    "continue.")
-    sys.exit(1)
-
-# Next, check if CHERFILE exists. If not, create it
-if not model_layer.check_cherfile():
-    model_layer.create_cherfile()
-    print(MSG_OK + " Gitcher config dotfile created. Go on...")
+# Unique global instance for the execution gitcher dictionary, built by main
+dictionary = None
 
+# Time to wait for the profiles list before the interactive prompt, in
+# 	seconds. Later, it is printed before the next prompt, if it is ready
+PREFETCH_DEADLINE = 0.25
 
-# Unique global instance for the execution gitcher dictionary
-dictionary = dictionary.Dictionary()
+# Profiles list load which was not ready before the interactive prompt
+late_prof_list = None
 
 
 # ===============================================
@@ -76,8 +76,15 @@ def quit_gracefully(signum, frame) -> None:
     sys.exit(0)
 
 
-# Register previous function, linking it with Ctrl.+C
-signal.signal(signal.SIGINT, quit_gracefully)
+# noinspection PyShadowingNames
+def print_warning(message, category, filename, lineno, file=None,
+                  line=None) -> None:
+    """Function that prints a warning, as 'warnings.showwarning' does, with
+    the gitcher style.
+
+    :return: None, print function
+    """
+    print(MSG_WARNING + " " + str(message) + ".", file=sys.stderr)
 
 
 # noinspection PyShadowingNames
@@ -111,13 +118,50 @@ def raise_order_format_error(arg: str = None) -> None:
     sys.exit(1)
 
 
-def print_prof_list() -> None:
+def print_late_prof_list() -> None:
+    """Function that prints the gitcher profile list loaded after the
+    interactive prompt, once, if it is ready. It runs on the main thread
+    before each prompt, so it never writes while the user is typing.
+
+    :return: None, print function
+    """
+    global late_prof_list
+    if late_prof_list is None or not late_prof_list.done():
+        return
+    prof_list, late_prof_list = late_prof_list, None
+    if prof_list.exception() is not None:
+        return
+    print("gitcher profiles list:")
+    print_prof_list(*prof_list.result())
+    print()
+
+
+def load_prof_list() -> ([Prof], Prof):
+    """Function that loads the saved profiles and, at the same time in
+    another thread, the current profile, to print the gitcher profile list.
+
+    :return: The saved profiles and the current profile, or None if it can
+        not be read
+    :rtype: ([Prof], Prof)
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        cprof = pool.submit(current_git_prof)
+        profs = model_layer.recuperate_profs()
+        return profs, cprof.result()
+
+
+def print_prof_list(profs: [Prof] = None, cprof: Prof = None) -> None:
     """Function that prints the gitcher profile list.
 
+    :param profs: Saved profiles, as returned by 'load_prof_list'. None to
+        load them
+    :type profs: [Prof]
+    :param cprof: Current profile, to highlight it
+    :type cprof: Prof
     :return: None, print function
     """
-    cprof = model_layer.recuperate_git_current_prof()  # Current profile
-    profs = model_layer.recuperate_profs()
+    if profs is None:
+        profs, cprof = load_prof_list()
     if profs:  # If profs is not empty
         _, terminal_width = os.popen('stty size', 'r').read().split()
         terminal_width = int(terminal_width)
@@ -186,6 +230,7 @@ def listen(question: str = None, autocompletion_context: [str] = None) -> str:
         completer = TabCompleter(autocompletion_context)
         readline.set_completer(completer.service)
 
+    print_late_prof_list()
     if question:
         reply = input(question).strip()
     else:
@@ -224,8 +269,8 @@ def yes_or_no(question: str) -> bool:
 
 
 def check_syntax(arg: str) -> None:
-    """Check strings syntax. Gitcher does not avoid to use commas ','
-    in string values.
+    """Check strings syntax. Gitcher does not allow control characters
+    (e.g.: tabs or line breaks) in string values.
 
     :param arg: Argument to check syntax
     :type arg: str
@@ -233,9 +278,84 @@ def check_syntax(arg: str) -> None:
     :rtype: bool
     :raise SyntaxError: If arg is illegal
     """
-    if ',' in arg:  # The comma (',') is an illegal char
-        print(MSG_ERROR + " Do not use commas (','), is an illegal char here.")
-        raise SyntaxError("Do not use commas (',')")
+    if any(ord(char) < 32 for char in arg):  # Control chars are illegal
+        print(MSG_ERROR + " Do not use control characters (e.g.: tabs), are "
+                          "illegal chars here.")
+        raise SyntaxError("Do not use control characters")
+
+
+def pop_flag(cmd: [str], flag: str) -> bool:
+    """Function that removes a long flag from the command line order, if it
+    is present, so the rest of the order can be checked positionally.
+
+    :param cmd: Command line order by the user
+    :type cmd: [str]
+    :param flag: Flag to look for (e.g.: '--include')
+    :type flag: str
+    :return: Confirmation about the presence of the flag
+    :rtype: bool
+    """
+    if flag in cmd[2:]:
+        cmd.remove(flag)
+        return True
+    return False
+
+
+def pop_option(cmd: [str], option: str) -> str:
+    """Function that removes a long option and its value from the command
+    line order, if it is present.
+
+    :param cmd: Command line order by the user
+    :type cmd: [str]
+    :param option: Option to look for (e.g.: '--since')
+    :type option: str
+    :return: The option value, or None if the option is not present
+    :rtype: str
+    """
+    if option in cmd[2:]:
+        i = cmd.index(option, 2)
+        if i + 1 >= len(cmd):
+            raise_order_format_error(option)
+        value = cmd[i + 1]
+        del cmd[i:i + 2]
+        return value
+    return None
+
+
+def pop_format(cmd: [str]) -> str:
+    """Function that removes the machine output format option from the
+    command line order, as '--format=FMT' or '--format FMT', if it is
+    present.
+
+    :param cmd: Command line order by the user
+    :type cmd: [str]
+    :return: The output format, or None to print for humans
+    :rtype: str
+    """
+    fmt = None
+    for arg in cmd[2:]:
+        if arg.startswith('--format='):
+            cmd.remove(arg)
+            fmt = arg[len('--format='):]
+            break
+    else:
+        fmt = pop_option(cmd, '--format')
+    if fmt is not None and fmt not in output.FORMATS:
+        raise_order_format_error(fmt)
+    return fmt
+
+
+def current_git_prof() -> Prof:
+    """Function that returns the profile of the current git configuration,
+    or None if it can not be read.
+
+    :return: Current profile
+    :rtype: Prof
+    """
+    try:
+        return model_layer.recuperate_git_current_prof()
+    except GitCommandError:
+        return None
 
 
 # noinspection PyShadowingNames
@@ -284,6 +404,7 @@ def check_opt(opt_input: str,
             opts_stock.extend(dictionary.cmds_interactive_mode)
         if fast_mode:
             opts_stock.extend(dictionary.cmds_fast_mode)
+            opts_stock.extend(dictionary.cmds_fast_mode_long)
 
     # Try to match
     if any(opt_input == opt_pattern for opt_pattern in opts_stock):
@@ -332,11 +453,21 @@ def recover_prof(profname: str) -> Prof:
 # =                Main launchers               =
 # ===============================================
 
-def list_profs() -> None:
+def list_profs(fmt: str = None) -> None:
     """Function that prints a list with saved profiles.
 
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
     :return: None, print function
     """
+    if fmt is not None:  # Streamed in storage order
+        cprof = current_git_prof()
+        with output.RecordWriter(fmt, output.PROF_FIELDS) as writer:
+            for prof in model_layer.iter_profs():
+                writer.write(output.prof_record(prof, prof == cprof))
+        return
+
     profs = model_layer.recuperate_profs()
     if profs:  # If profs is not empty
         for prof in profs:
@@ -345,12 +476,58 @@ def list_profs() -> None:
         print("No gitcher profiles saved yet. Use 'a' option to add one.")
 
 
-def show_current_on_prof() -> None:
+def find_profs(query: str, fmt: str = None) -> None:
+    """Function that prints the saved profiles which match a search query,
+    as they are found.
+
+    :param query: Search query, as described in 'prof_index'
+    :type query: str
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
+    :return: None, print function
+    """
+    index = prof_index.load_index()
+    try:
+        found = index.search(query)
+        if fmt is not None:
+            cprof = current_git_prof()
+            with output.RecordWriter(fmt, output.PROF_FIELDS) as writer:
+                for prof in found:
+                    writer.write(output.prof_record(prof, prof == cprof))
+            return
+        any_found = False
+        for prof in found:
+            print("Profile " + prof.profname + ": " + prof.simple_str())
+            any_found = True
+    except ValueError as e:
+        print(MSG_ERROR + " " + str(e) + ".")
+        sys.exit(1)
+    finally:
+        index.close()
+    if not any_found:
+        print("No gitcher profiles match the query.")
+
+
+def show_current_on_prof(fmt: str = None) -> None:
     """Function that shows the current in use ON profile information.
 
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
     :return: None, print function
     """
     cprof = model_layer.recuperate_git_current_prof()  # Current profile
+    if fmt is not None:
+        match = None
+        for prof in model_layer.iter_profs():
+            if cprof == prof:
+                match = prof
+                break
+        with output.RecordWriter(fmt, output.PROF_FIELDS) as writer:
+            writer.write(output.prof_record(match or cprof, True,
+                                            match is not None))
+        return
 
     # Now, cprof is compared against saved profiles list. cprof is an
     # extract of the git user configuration, that is independent of the
@@ -366,8 +543,35 @@ def show_current_on_prof() -> None:
     print(MSG_OK + " Unsaved profile: " + cprof.simple_str())
 
 
+def print_switch_changes(profname: str, changes: [(str, str)],
+                         dry_run: bool = False) -> None:
+    """Function that prints the git configuration changes of a profile
+    switch.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param changes: Changes, as returned by 'model_layer.switch_prof'
+    :type changes: [(str, str)]
+    :param dry_run: The changes were only planned
+    :type dry_run: bool
+    :return: None, print function
+    """
+    if not changes:
+        print(MSG_OK + " Already on {0} profile.".format(profname))
+        return
+
+    if dry_run:
+        print("Planned changes to switch to {0} profile:".format(profname))
+        for key, value in changes:
+            if value is None:
+                print("- unset " + key)
+            else:
+                print("- set {0} = {1}".format(key, value))
+
+
 # noinspection PyShadowingNames
-def set_prof(profname: str) -> None:
+def set_prof(profname: str, include: bool = False,
+             dry_run: bool = False) -> None:
     """Function that sets the selected profile locally.
 
     It is imperative that it be called from a directory with a git
@@ -375,17 +579,122 @@ def set_prof(profname: str) -> None:
 
     :param profname: Name of the gitcher profile to operate with
     :type profname: str
+    :param include: Switch through the profile 'include.path' fragment
+    :type include: bool
+    :param dry_run: Only print the planned changes
+    :type dry_run: bool
     :return: None
     """
     if model_layer.check_git_context():
-        model_layer.switch_prof(profname)
+        try:
+            if include:
+                model_layer.include_prof(profname)
+            else:
+                changes = model_layer.switch_prof(profname, dry_run=dry_run)
+                if not dry_run:
+                    repo_index.record_prof([os.getcwd()], profname)
+                if dry_run or not changes:
+                    print_switch_changes(profname, changes, dry_run)
+                    return
+        except GitCommandError as e:
+            print(MSG_ERROR + " " + str(e))
+            sys.exit(1)
+        if include:
+            repo_index.record_prof([os.getcwd()], profname)
         print(MSG_OK + " Switched to {0} profile.".format(profname))
     else:
         print(MSG_ERROR + " Current directory not contains a git repository.")
 
 
 # noinspection PyShadowingNames
-def set_prof_global(profname: str) -> None:
+def set_prof_recursive(profname: str, dry_run: bool = False) -> None:
+    """Function that sets the selected profile into the repository of the
+    current working directory, its submodules and its worktrees, and prints
+    the result of each one.
+
+    Profile name must be checked before.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param dry_run: Only print the planned changes
+    :type dry_run: bool
+    :return: None
+    """
+    if not model_layer.check_git_context():
+        print(MSG_ERROR + " Current directory not contains a git repository.")
+        sys.exit(1)
+
+    failed = False
+    for label, result in model_layer.switch_prof_recursive(profname,
+                                                           dry_run=dry_run):
+        if isinstance(result, GitCommandError):
+            failed = True
+            print(MSG_ERROR + " {0}: {1}".format(label, result))
+        elif dry_run:
+            print("{0}: {1}".format(label, ', '.join(
+                'unset ' + key if value is None else
+                '{0} = {1}'.format(key, value) for key, value in result)
+                or 'no changes'))
+        else:
+            print(MSG_OK + " {0}: {1}".format(
+                label, 'switched' if result else 'already on profile'))
+    if failed:
+        sys.exit(1)
+
+
+# noinspection PyShadowingNames
+def set_prof_repos(profname: str, paths: [str]) -> None:
+    """Function that sets the selected profile on several repositories as a
+    single transaction: if some repository fails, every one is restored.
+    The previous configurations are kept in a journal, to roll the switch
+    back later.
+
+    Profile name must be checked before.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param paths: Repository paths
+    :type paths: [str]
+    :return: None
+    """
+    journal_path = switch_journal.new_journal_path(profname)
+    paths = list(dict.fromkeys(os.path.abspath(path) for path in paths))
+    errors = switch_journal.switch_repos(model_layer.recuperate_prof(profname),
+                                         paths, journal_path)
+    if errors:
+        for path, e in errors:
+            print(MSG_ERROR + " {0}: {1}".format(path, e))
+        print(MSG_ERROR + " Switch aborted, repositories restored.")
+        sys.exit(1)
+    repo_index.record_prof(paths, profname)
+    print(MSG_OK + " Switched {0} repositories to {1} profile.".format(
+        len(paths), profname))
+    print("Journal: {0}".format(journal_path))
+
+
+def rollback(journal_path: str) -> None:
+    """Function that restores the repositories of a switch journal to
+    their previous configuration.
+
+    :param journal_path: Journal path
+    :type journal_path: str
+    :return: None
+    """
+    try:
+        errors = switch_journal.rollback(journal_path)
+    except (OSError, ValueError) as e:
+        print(MSG_ERROR + " " + str(e))
+        sys.exit(1)
+    if errors:
+        for path, e in errors:
+            print(MSG_ERROR + " {0}: {1}".format(path, e))
+        sys.exit(1)
+    print(MSG_OK + " Switch rolled back.")
+
+
+# noinspection PyShadowingNames
+def set_prof_global(profname: str, include: bool = False,
+                    dry_run: bool = False) -> None:
     """Function that sets the selected profile globally.
 
     It is not necessary to be called from a directory with a git repository.
@@ -393,9 +702,24 @@ def set_prof_global(profname: str) -> None:
 
     :param profname: Name of the gitcher profile to operate with
     :type profname: str
+    :param include: Switch through the profile 'include.path' fragment
+    :type include: bool
+    :param dry_run: Only print the planned changes
+    :type dry_run: bool
     :return: None
     """
-    model_layer.switch_prof(profname, flag='--global')
+    try:
+        if include:
+            model_layer.include_prof(profname, flag='--global')
+        else:
+            changes = model_layer.switch_prof(profname, flag='--global',
+                                              dry_run=dry_run)
+            if dry_run or not changes:
+                print_switch_changes(profname, changes, dry_run)
+                return
+    except GitCommandError as e:
+        print(MSG_ERROR + " " + str(e))
+        sys.exit(1)
     print(MSG_OK + " Set {0} as git default profile.".format(profname))
 
 
@@ -503,11 +827,9 @@ def update_prof() -> None:
         signkey = prof.signkey
         signpref = prof.signpref
 
-    # Remove the old profile
-    model_layer.delete_profile(old_profname)
-    # And save the new...
+    # Replace the old profile by the new...
     prof = model_layer.Prof(profname, name, email, signkey, signpref)
-    model_layer.save_profile(prof)
+    model_layer.update_profile(old_profname, prof)
     print(MSG_OK + " Profile {0} updated.".format(profname))
 
 
@@ -556,6 +878,521 @@ def delete_prof(profname: str) -> None:
     print(MSG_OK + " Profile {0} deleted.".format(profname))
 
 
+def check_history(paths: [str], since: str = None, fmt: str = None) -> None:
+    """Function that audits the commits authorship of some repositories
+    against the saved profiles, and prints the commits which do not match.
+
+    Exits with error status if some commit does not match.
+
+    :param paths: Repository paths
+    :type paths: [str]
+    :param since: Only check commits after this revision. None to check the
+        whole history
+    :type since: str
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
+    :return: None, print function
+    """
+    if fmt is not None:
+        with output.RecordWriter(fmt, output.HISTORY_FIELDS) as writer:
+            clean = write_history_records(
+                writer, history_audit.audit_repos(paths, since))
+        if not clean:
+            sys.exit(1)
+        return
+
+    clean = True
+    for report in history_audit.audit_repos(paths, since):
+        counts = report['counts']
+        if report['error'] is not None:
+            clean = False
+            print(MSG_ERROR + " {0}: {1}".format(report['path'],
+                                                 report['error']))
+            continue
+        if not report['findings']:
+            print(MSG_OK + " {0}: {1} commits match saved profiles.".format(
+                report['path'], counts[history_audit.MATCH]))
+            continue
+
+        clean = False
+        print(MSG_WARNING + " {0}: {1} match, {2} wrong profile, {3} "
+                            "unknown.".format(report['path'],
+                                              counts[history_audit.MATCH],
+                                              counts[history_audit.WRONG],
+                                              counts[history_audit.UNKNOWN]))
+        for (status, name, email, profnames), n in \
+                sorted(report['findings'].items()):
+            if status == history_audit.WRONG:
+                print("- {0} <{1}>: {2} commits of profile {3}.".format(
+                    name, email, n, profnames))
+            else:
+                print("- {0} <{1}>: {2} commits of unknown profile.".format(
+                    name, email, n))
+
+    if not clean:
+        sys.exit(1)
+
+
+def write_history_records(writer: output.RecordWriter, reports) -> bool:
+    """Function that writes the history audit reports as machine output
+    records: a 'match' record per repository with the matching commits
+    count, a record per finding and an 'error' record per failed
+    repository.
+
+    :param writer: Machine output writer, with 'output.HISTORY_FIELDS'
+    :type writer: output.RecordWriter
+    :param reports: Audit reports, as yielded by 'history_audit.audit_repos'
+    :type reports: Iterable[dict]
+    :return: Confirmation about every commit matching
+    :rtype: bool
+    """
+    clean = True
+    for report in reports:
+        record = dict.fromkeys(output.HISTORY_FIELDS)
+        record['path'] = report['path']
+        if report['error'] is not None:
+            clean = False
+            record.update(status='error', error=str(report['error']))
+            writer.write(record)
+            continue
+        record.update(status=history_audit.MATCH,
+                      commits=report['counts'][history_audit.MATCH])
+        writer.write(record)
+        for (status, name, email, profnames), n in \
+                sorted(report['findings'].items()):
+            clean = False
+            record.update(status=status, name=name, email=email, commits=n,
+                          profnames=profnames.split(',') if profnames else [])
+            writer.write(record)
+    return clean
+
+
+def doctor(fmt: str = None) -> None:
+    """Function that validates the sign keys of every saved profile against
+    the GPG keyring, and prints the problems found.
+
+    Exits with error status if some key is not valid.
+
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
+    :return: None, print function
+    """
+    if not gpg_keyring.check_gpg_installed():
+        print(MSG_ERROR + " gpg is not installed in this machine. Impossible "
+                          "to check the sign keys.")
+        sys.exit(1)
+
+    descriptions = {
+        gpg_keyring.MISSING: "key {0} is not in the secret keyring",
+        gpg_keyring.EXPIRED: "key {0} is expired",
+        gpg_keyring.REVOKED: "key {0} is revoked",
+        gpg_keyring.NO_SIGN: "key {0} can not sign",
+        gpg_keyring.UID_MISMATCH: "key {0} has no user ID with email {1}"}
+    try:
+        index = gpg_keyring.load_index()
+    except gpg_keyring.KeyringError as e:
+        print(MSG_ERROR + " Impossible to check the sign keys. " + str(e))
+        sys.exit(1)
+
+    clean = True
+    if fmt is not None:
+        with output.RecordWriter(fmt, output.DOCTOR_FIELDS) as writer:
+            for prof, problems in gpg_keyring.check_profs_keys(
+                    model_layer.recuperate_profs(), index=index):
+                clean = clean and not problems
+                writer.write({'profname': prof.profname,
+                              'signkey': prof.signkey,
+                              'problems': list(problems)})
+        if not clean:
+            sys.exit(1)
+        return
+
+    for prof, problems in gpg_keyring.check_profs_keys(
+            model_layer.recuperate_profs(), index=index):
+        for problem in problems:
+            clean = False
+            print(MSG_WARNING + " Profile {0}: ".format(prof.profname) +
+                  descriptions[problem].format(prof.signkey, prof.email) +
+                  ".")
+
+    if clean:
+        print(MSG_OK + " Every profile sign key is valid.")
+    else:
+        sys.exit(1)
+
+
+def watch(roots: [str], poll: float = None) -> None:
+    """Function that watches directory trees and applies to each new
+    repository the profile chosen by the watch rules. It runs until the
+    user stops it.
+
+    :param roots: Directories to watch
+    :type roots: [str]
+    :param poll: Use polling with this interval, in seconds. None to use
+        inotify when available
+    :type poll: float
+    :return: None, print function
+    """
+    try:
+        rules = watcher.load_rules()
+    except ValueError as e:
+        print(MSG_ERROR + " " + str(e) + ".")
+        sys.exit(1)
+    if not rules:
+        print(MSG_ERROR + " No watch rules in {0}.".format(watcher.RULES))
+        sys.exit(1)
+
+    def apply(repo_path: str) -> None:
+        try:
+            profname = watcher.apply_rules(repo_path, rules)
+        except NotFoundProfError:
+            print(MSG_ERROR + " {0}: rule profile not exists.".format(
+                repo_path))
+        except GitCommandError as e:
+            print(MSG_ERROR + " {0}: {1}".format(repo_path, e))
+        else:
+            if profname is not None:
+                repo_index.record_prof([repo_path], profname)
+                print(MSG_OK + " {0}: switched to {1} profile.".format(
+                    repo_path, profname))
+
+    w = watcher.create_watcher(roots, poll)
+    print(MSG_OK + " Watching {0} for new repositories...".format(
+        ', '.join(roots)))
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for repo_path in w.events():
+                pool.submit(apply, repo_path)
+    finally:
+        w.close()
+
+
+def list_repos(roots: [str], max_depth: int = None,
+               fmt: str = None) -> None:
+    """Function that updates the repositories index and prints the indexed
+    repositories, with their last applied profile.
+
+    :param roots: Root directories to index. Empty to rescan the current
+        index, or to index the home directory if there is no index
+    :type roots: [str]
+    :param max_depth: Maximum depth to walk below the roots. None to keep
+        the index one
+    :type max_depth: int
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
+    :return: None, print function
+    """
+    index = repo_index.RepoIndex.load()
+    roots = [os.path.abspath(root) for root in roots]
+    if index is None or (roots and roots != index.roots) or \
+            (max_depth is not None and max_depth != index.max_depth):
+        profs = index.profs if index is not None else {}
+        index = repo_index.RepoIndex(
+            roots or (index.roots if index is not None else
+                      [model_layer.HOME]),
+            max_depth=repo_index.MAX_DEPTH if max_depth is None else
+            max_depth)
+        index.profs = profs  # Kept for the repositories found again
+    index.scan()
+    index.save()
+
+    repos = index.repos()
+    if fmt is not None:
+        with output.RecordWriter(fmt, output.REPO_FIELDS) as writer:
+            for repo_path in repos:
+                writer.write({'path': repo_path,
+                              'profname': index.profs.get(repo_path)})
+        return
+    for repo_path in repos:
+        profname = index.profs.get(repo_path)
+        print(repo_path + ("" if profname is None else
+                           " [{0}]".format(profname)))
+    print("{0} repositories indexed below {1}.".format(
+        len(repos), ', '.join(index.roots)))
+
+
+def stats(fmt: str = None) -> None:
+    """Function that prints the summary of the metrics ledger: the wall
+    time percentiles of each command, its mean of spawned subprocesses and
+    its latency trend.
+
+    :param fmt: Machine output format, see 'output'. None to print for
+        humans
+    :type fmt: str
+    :return: None, print function
+    """
+    summary = metrics.summarize(metrics.read_records(os.path.join(
+        model_layer.CACHE_DIR, metrics.LEDGER_NAME)))
+    if fmt is not None:  # Times in milliseconds, trend as a ratio
+        with output.RecordWriter(fmt, output.STATS_FIELDS) as writer:
+            for cmd in sorted(summary):
+                record = dict(summary[cmd])
+                record['cmd'] = cmd
+                writer.write(record)
+        return
+    if not summary:
+        print("No metrics recorded yet. Set {0} environment variable to "
+              "record them.".format(metrics.ENV_VAR))
+        return
+
+    stats_table = PrettyTable(['Command', 'Runs', 'p50 (ms)', 'p95 (ms)',
+                               'p99 (ms)', 'Spawns', 'Trend'])
+    for cmd in sorted(summary):
+        row = summary[cmd]
+        trend = '-' if row['trend'] is None else \
+            '{0:+.0%}'.format(row['trend'])
+        stats_table.add_row([cmd, row['count'],
+                             '{0:.1f}'.format(row['p50']),
+                             '{0:.1f}'.format(row['p95']),
+                             '{0:.1f}'.format(row['p99']),
+                             '{0:.1f}'.format(row['spawns']), trend])
+    print(stats_table)
+    print("Trend: p50 change of the newer half of the runs.")
+
+
+def dedupe(dry_run: bool = False) -> None:
+    """Function that merges the saved profiles with the same identity, and
+    prints the merged groups.
+
+    :param dry_run: Only print the groups, with no write
+    :type dry_run: bool
+    :return: None, print function
+    """
+    groups = model_layer.dedupe_profiles(dry_run)
+    for group in groups:
+        print("Profiles {0}: {1}. {2} {3}.".format(
+            ', '.join(prof.profname for prof in group),
+            group[0].simple_str(), "Would keep" if dry_run else "Kept",
+            group[0].profname))
+
+    merged = sum(len(group) - 1 for group in groups)
+    if dry_run:
+        print("{0} duplicated profiles would be merged.".format(merged))
+    else:
+        print(MSG_OK + " {0} duplicated profiles merged.".format(merged))
+
+
+def harvest_profiles(roots: [str], max_depth: int = None,
+                     dry_run: bool = False) -> None:
+    """Function that creates a gitcher profile for every identity which is
+    configured on the repositories below some roots, and is not yet saved,
+    and prints them.
+
+    :param roots: Root directories to walk
+    :type roots: [str]
+    :param max_depth: Maximum depth to walk below the roots. None to use
+        the default
+    :type max_depth: int
+    :param dry_run: Only print the profiles to create, with no write
+    :type dry_run: bool
+    :return: None, print function
+    """
+    plan = harvest.harvest(roots, repo_index.MAX_DEPTH if max_depth is None
+                           else max_depth, dry_run)
+    for prof, repo_paths in plan:
+        print("Profile {0}: {1}. From {2} repositories.".format(
+            prof.profname, prof.simple_str(), len(repo_paths)))
+
+    if dry_run:
+        print("{0} profiles would be created.".format(len(plan)))
+    else:
+        print(MSG_OK + " {0} profiles created.".format(len(plan)))
+
+
+def reattribute_commits(from_profname: str, to_profname: str,
+                        rev_range: str = None, dry_run: bool = False) -> None:
+    """Function that rewrites the commits of the current repository made
+    with a profile to the identity of another one, and prints the result.
+
+    :param from_profname: Name of the gitcher profile whose commits are
+        reattributed
+    :type from_profname: str
+    :param to_profname: Name of the gitcher profile to reattribute them to
+    :type to_profname: str
+    :param rev_range: Revisions range. None to use the current branch
+    :type rev_range: str
+    :param dry_run: Only print what would be rewritten
+    :type dry_run: bool
+    :return: None, print function
+    """
+    repo_path = model_layer.find_repo_root()
+    if repo_path is None:
+        print(MSG_ERROR + " Current directory not contains a git repository.")
+        sys.exit(1)
+    profs = []
+    for profname in [from_profname, to_profname]:
+        try:
+            profs.append(model_layer.recuperate_prof(profname))
+        except NotFoundProfError:
+            print_prof_error(profname)
+            sys.exit(1)
+
+    try:
+        plan = reattribute.reattribute(repo_path, profs[0], profs[1],
+                                       rev_range, dry_run)
+    except GitCommandError as e:
+        print(MSG_ERROR + " " + str(e))
+        sys.exit(1)
+    if not plan['matched']:
+        print("No commits of profile {0} to reattribute.".format(
+            from_profname))
+        return
+
+    if plan['signed']:
+        print(MSG_WARNING + " {0} signed commits {1} rewritten without their "
+                            "signature: {2}.".format(
+                                len(plan['signed']),
+                                "would be" if dry_run else "were",
+                                ', '.join(sha[:12] for sha in
+                                          plan['signed'])))
+    if dry_run:
+        print("{0} commits of profile {1} would be reattributed to {2}, "
+              "rewriting {3} commits.".format(plan['matched'], from_profname,
+                                              to_profname,
+                                              plan['rewritten']))
+    else:
+        print(MSG_OK + " {0} commits of profile {1} reattributed to {2}, "
+                       "rewriting {3} commits.".format(
+                           plan['matched'], from_profname, to_profname,
+                           plan['rewritten']))
+        for ref, sha in sorted(plan['refs'].items()):
+            print("- {0}: previous tip {1} saved as {2}.".format(
+                ref, sha[:12], reattribute.ORIGINAL_REFS + ref))
+
+
+def write_mailmap(profnames: [str] = None) -> None:
+    """Function that merges the saved profiles into the '.mailmap' file of
+    the current repository.
+
+    :param profnames: Names of the gitcher profiles to map. None to map
+        every saved profile
+    :type profnames: [str]
+    :return: None, print function
+    """
+    repo_path = model_layer.find_repo_root()
+    if repo_path is None:
+        print(MSG_ERROR + " Current directory not contains a git repository.")
+        sys.exit(1)
+    if profnames is None:
+        profs = model_layer.recuperate_profs()
+    else:
+        profs = []
+        for profname in profnames:
+            try:
+                profs.append(model_layer.recuperate_prof(profname))
+            except NotFoundProfError:
+                print_prof_error(profname)
+                sys.exit(1)
+
+    path = os.path.join(repo_path, mailmap.MAILMAP_NAME)
+    changed = mailmap.merge_mailmap(path, mailmap.prof_entries(profs))
+    print(MSG_OK + " {0} entries added or updated on {1}.".format(changed,
+                                                                 path))
+
+
+def exec_prof(profname: str, child_cmd: [str]) -> None:
+    """Function that runs a command with a gitcher profile applied through
+    its environment, with no git configuration write. The command replaces
+    the gitcher process, so its exit status is the order one.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param child_cmd: Command to run, with its arguments
+    :type child_cmd: [str]
+    :return: None
+    """
+    try:
+        prof = model_layer.recuperate_prof(profname)
+    except NotFoundProfError:
+        print_prof_error(profname)
+        sys.exit(1)
+
+    env = dict(os.environ)
+    env.update(model_layer.prof_env(prof))
+    sys.stdout.flush()
+    try:
+        os.execvpe(child_cmd[0], child_cmd, env)
+    except OSError as e:
+        print(MSG_ERROR + " {0}: {1}.".format(child_cmd[0], e.strerror))
+        sys.exit(127)
+
+
+def print_prof_env(profname: str) -> None:
+    """Function that prints the shell exports of the environment which
+    applies a gitcher profile, to load them with
+    'eval "$(gitcher --env PROFNAME)"'.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :return: None, print function
+    """
+    try:
+        prof = model_layer.recuperate_prof(profname)
+    except NotFoundProfError:
+        print(MSG_ERROR + " Profile {0} not exists. Try again...".format(
+            profname), file=sys.stderr)
+        sys.exit(1)
+
+    for key, value in sorted(model_layer.prof_env(prof).items()):
+        print("export {0}={1}".format(key, shlex.quote(value)))
+
+
+def print_completions(shell: str) -> None:
+    """Function that prints the completion script of a shell, refreshing
+    the profile names cache which it reads.
+
+    :param shell: Shell, one of 'completions.SHELLS'
+    :type shell: str
+    :return: None, print function
+    """
+    model_layer.save_profnames_cache()
+    print(completions.render(shell, dictionary.cmds_fast_mode,
+                             dictionary.cmds_fast_mode_long,
+                             model_layer.profnames_cache_path()), end='')
+
+
+def record_metrics(cmd: [str], start: float) -> None:
+    """Function that appends the invocation record to the metrics ledger,
+    if it is enabled. Metrics errors never break the order.
+
+    :param cmd: Command line order by the user
+    :type cmd: [str]
+    :param start: Invocation start, as returned by 'time.perf_counter'
+    :type start: float
+    :return: None
+    """
+    if not metrics.enabled():
+        return
+    opt = cmd[1].lstrip('-')
+    if not check_opt(opt, fast_mode=True):
+        opt = 'invalid'
+    try:
+        store_size = os.path.getsize(model_layer.get_store().path)
+    except OSError:
+        store_size = 0
+    try:
+        metrics.record(os.path.join(model_layer.CACHE_DIR,
+                                    metrics.LEDGER_NAME),
+                       opt, time.perf_counter() - start, store_size)
+    except OSError:
+        pass
+
+
+def migrate_store(backend: str) -> None:
+    """Function that moves the saved profiles to the selected store backend.
+
+    :param backend: Target backend, 'sqlite', 'shards' or 'cherfile'
+    :type backend: str
+    :return: None, print function
+    """
+    n = model_layer.migrate_store(backend)
+    print(MSG_OK + " {0} profiles migrated to the {1} store.".format(n,
+                                                                      backend))
+
+
 # ===============================================
 # =                     MAIN                    =
 # ===============================================
@@ -566,12 +1403,18 @@ def interactive_main() -> None:
 
     :return: None
     """
+    global late_prof_list
+
+    # The profiles list is loaded while the menu is printed, so slow git
+    # 	calls do not delay it
+    pool = ThreadPoolExecutor(max_workers=1)
+    prof_list = pool.submit(load_prof_list)
+    pool.shutdown(wait=False)
+
     print(COLOR_BRI_BLUE + "**** gitcher: the git profile switcher ****" +
           COLOR_RST)
 
-    print("gitcher profiles list:")
-    print_prof_list()
-    print("\nOptions:")
+    print("Options:")
     print(COLOR_BRI_CYAN + "s" + COLOR_RST + "    set a profile to current "
                                              "directory repository.")
     print(COLOR_BRI_CYAN + "g" + COLOR_RST + "    set a profile as global "
@@ -584,6 +1427,14 @@ def interactive_main() -> None:
     print(COLOR_BRI_CYAN + "q" + COLOR_RST + "    quit. Also can use " +
           COLOR_BRI_CYAN + "Ctrl.+C" + COLOR_RST + " everywhere.\n")
 
+    try:
+        print("gitcher profiles list:")
+        print_prof_list(*prof_list.result(timeout=PREFETCH_DEADLINE))
+        print()
+    except TimeoutError:
+        print("Loading...\n")
+        late_prof_list = prof_list
+
     opt = listen("Option: ", dictionary.get_union_cmds_set())
     while not check_opt(opt, interactive_mode=True):
         print(MSG_ERROR + " Invalid opt! Use " +
@@ -628,6 +1479,12 @@ def fast_main(cmd: [str]) -> None:
     :type cmd: [str]
     :return: None
     """
+    # The command after '--' is not a gitcher one, so it is not checked
+    child_cmd = None
+    if '--' in cmd:
+        child_cmd = cmd[cmd.index('--') + 1:]
+        cmd = cmd[:cmd.index('--')]
+
     # First, check param syntax
     for param in cmd:
         try:
@@ -636,20 +1493,120 @@ def fast_main(cmd: [str]) -> None:
             sys.exit("Syntax error")
 
     # If syntax is ok, go on and check selected option
-    opt = cmd[1].replace('-', '')
+    opt = cmd[1].lstrip('-')
     if not check_opt(opt, fast_mode=True):
         print(MSG_ERROR + " Invalid option! Use -[" +
-              '|'.join(dictionary.cmds_fast_mode) + "]")
+              '|'.join(dictionary.cmds_fast_mode) + "] or --[" +
+              '|'.join(dictionary.cmds_fast_mode_long) + "]")
         sys.exit(1)
     else:
-        if opt == 'o':
+        # Machine output, only for the read orders
+        fmt = pop_format(cmd)
+        if fmt is not None and opt not in dictionary.cmds_machine_output:
+            raise_order_format_error('--format')
+        if child_cmd is not None and opt != 'exec':
+            raise_order_format_error('--')
+
+        if opt == 'check-history':  # 'gitcher <--check-history> [REPOS...]
+            # [--since REV]'
+            since = pop_option(cmd, '--since')
+            if pop_flag(cmd, '--all'):  # Every indexed repository
+                if len(cmd) != 2:
+                    raise_order_format_error()
+                check_history(repo_index.indexed_repos(), since, fmt)
+            else:
+                check_history(cmd[2:] or [os.getcwd()], since, fmt)
+        elif opt == 'watch':  # 'gitcher <--watch> <ROOT...> [--poll SECS]'
+            poll = pop_option(cmd, '--poll')
+            if len(cmd) < 3:
+                raise_order_format_error()
+            try:
+                poll = None if poll is None else float(poll)
+            except ValueError:
+                raise_order_format_error(poll)
+            watch(cmd[2:], poll)
+        elif opt == 'rollback':  # 'gitcher <--rollback> <JOURNAL>'
+            if len(cmd) != 3:
+                raise_order_format_error()
+            rollback(cmd[2])
+        elif opt == 'repos':  # 'gitcher <--repos> [ROOT...] [--max-depth N]'
+            max_depth = pop_option(cmd, '--max-depth')
+            try:
+                max_depth = None if max_depth is None else int(max_depth)
+            except ValueError:
+                raise_order_format_error(max_depth)
+            list_repos(cmd[2:], max_depth, fmt)
+        elif opt == 'stats':
+            if len(cmd) == 2:  # cmd have to be only 'gitcher <--stats>'
+                stats(fmt)
+            else:
+                raise_order_format_error()
+        elif opt == 'doctor':
+            if len(cmd) == 2:  # cmd have to be only 'gitcher <--doctor>'
+                doctor(fmt)
+            else:
+                raise_order_format_error()
+        elif opt == 'reattribute':  # 'gitcher <--reattribute> <FROM> <TO>
+            # [RANGE] [--dry-run]'
+            dry_run = pop_flag(cmd, '--dry-run')
+            if len(cmd) not in [4, 5]:
+                raise_order_format_error()
+            reattribute_commits(cmd[2], cmd[3],
+                                cmd[4] if len(cmd) == 5 else None, dry_run)
+        elif opt == 'mailmap':  # 'gitcher <--mailmap> [--profiles PROF...]'
+            if len(cmd) == 2:
+                write_mailmap()
+            elif len(cmd) > 3 and cmd[2] == '--profiles':
+                write_mailmap(cmd[3:])
+            else:
+                raise_order_format_error()
+        elif opt == 'dedupe':  # 'gitcher <--dedupe> [--dry-run]'
+            dry_run = pop_flag(cmd, '--dry-run')
+            if len(cmd) != 2:
+                raise_order_format_error()
+            dedupe(dry_run)
+        elif opt == 'harvest':  # 'gitcher <--harvest> <ROOT...>
+            # [--max-depth N] [--dry-run]'
+            max_depth = pop_option(cmd, '--max-depth')
+            try:
+                max_depth = None if max_depth is None else int(max_depth)
+            except ValueError:
+                raise_order_format_error(max_depth)
+            dry_run = pop_flag(cmd, '--dry-run')
+            if len(cmd) < 3:
+                raise_order_format_error()
+            harvest_profiles(cmd[2:], max_depth, dry_run)
+        elif opt == 'exec':  # 'gitcher <--exec> <profname> -- <CMD...>'
+            if len(cmd) != 3 or not child_cmd:
+                raise_order_format_error()
+            exec_prof(cmd[2], child_cmd)
+        elif opt == 'env':  # 'gitcher <--env> <profname>'
+            if len(cmd) != 3:
+                raise_order_format_error()
+            print_prof_env(cmd[2])
+        elif opt == 'completions':  # 'gitcher <--completions> <SHELL>'
+            if len(cmd) != 3 or cmd[2] not in completions.SHELLS:
+                raise_order_format_error()
+            print_completions(cmd[2])
+        elif opt == 'migrate':  # 'gitcher <--migrate>
+            # <sqlite|shards|cherfile>'
+            if len(cmd) != 3 or cmd[2] not in ['sqlite', 'shards',
+                                               'cherfile']:
+                raise_order_format_error()
+            migrate_store(cmd[2])
+        elif opt == 'o':
             if len(cmd) == 2:  # cmd have to be only 'gitcher <-o>'
-                show_current_on_prof()
+                show_current_on_prof(fmt)
             else:
                 raise_order_format_error()
         elif opt == 'l':
             if len(cmd) == 2:  # cmd have to be only 'gitcher <-l>'
-                list_profs()
+                list_profs(fmt)
+            else:
+                raise_order_format_error()
+        elif opt == 'f':
+            if len(cmd) >= 3:  # cmd have to be 'gitcher <-f> <query...>'
+                find_profs(' '.join(cmd[2:]), fmt)
             else:
                 raise_order_format_error()
         elif len(cmd) >= 3:  # cmd have to be 'gitcher <-opt> <profname> [...]'
@@ -678,15 +1635,40 @@ def fast_main(cmd: [str]) -> None:
 
                 add_prof_fast(profname, name, email, signkey, signpref)
             else:  # Else it is always necessary to check the profile
-                if len(cmd) == 3:  # Security check
+                include = False
+                dry_run = False
+                recursive = False
+                if opt in ['s', 'g']:
+                    include = pop_flag(cmd, '--include')
+                    dry_run = pop_flag(cmd, '--dry-run')
+                    if include and dry_run:
+                        raise_order_format_error('--dry-run')
+                if opt == 's':
+                    recursive = pop_flag(cmd, '--recursive')
+                    if recursive and include:
+                        raise_order_format_error('--recursive')
+                if recursive:  # 'gitcher <-s> <profname> --recursive'
+                    if len(cmd) != 3:
+                        raise_order_format_error()
+                    if not check_profile(profname):
+                        print_prof_error(profname)
+                        sys.exit(1)
+                    set_prof_recursive(profname, dry_run)
+                elif opt == 's' and len(cmd) > 3 and not include and \
+                        not dry_run:  # 'gitcher <-s> <profname> <REPOS...>'
+                    if not check_profile(profname):
+                        print_prof_error(profname)
+                        sys.exit(1)
+                    set_prof_repos(profname, cmd[3:])
+                elif len(cmd) == 3:  # Security check
                     if not check_profile(profname):
                         print_prof_error(profname)
                         sys.exit(1)
                     # Else, if the profile exists, continue...
                     if opt == 's':
-                        set_prof(profname)
+                        set_prof(profname, include, dry_run)
                     elif opt == 'g':
-                        set_prof_global(profname)
+                        set_prof_global(profname, include, dry_run)
                     elif opt == 'd':
                         delete_prof(profname)
                 else:
@@ -696,11 +1678,42 @@ def fast_main(cmd: [str]) -> None:
 
 
 def main():
-    if (len(sys.argv)) == 1:  # Interactive mode, closure execution in a loop
-        while True:  # The user inputs the exit order during the session
-            interactive_main()
-    elif (len(sys.argv)) > 1:  # Fast mode
-        fast_main(sys.argv)
+    start = time.perf_counter()
+
+    # Register the exit function, linking it with Ctrl.+C
+    signal.signal(signal.SIGINT, quit_gracefully)
+
+    # Warnings, as the skipped malformed CHERFILE lines, with gitcher style
+    warnings.showwarning = print_warning
+
+    # First, check if git is installed
+    if not model_layer.check_git_installed():
+        print(
+            MSG_ERROR + " git is not installed in this machine. Impossible to "
+                        "continue.")
+        sys.exit(1)
+
+    # Next, check if CHERFILE exists. If not, create it
+    if not model_layer.check_cherfile():
+        model_layer.create_cherfile()
+        print(MSG_OK + " Gitcher config dotfile created. Go on...")
+
+    global dictionary
+    dictionary = Dictionary()
+
+    try:
+        # Interactive mode, closure execution in a loop
+        if (len(sys.argv)) == 1:
+            while True:  # The user inputs the exit order during the session
+                interactive_main()
+        elif (len(sys.argv)) > 1:  # Fast mode
+            try:
+                fast_main(sys.argv)
+            finally:
+                record_metrics(sys.argv, start)
+    except StoreFormatError as e:
+        print(MSG_ERROR + " " + str(e) + ". Impossible to continue.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
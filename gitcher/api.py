@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's public API module
+
+This module offers gitcher to other Python programs. Importing it has no
+side effects: nothing is checked, created or registered until a 'Gitcher'
+object is used.
+
+E.g.:
+
+    from gitcher.api import Gitcher
+
+    gitcher = Gitcher()
+    gitcher.switch('work', path='/path/to/repo')
+"""
+
+import os
+import threading
+
+from gitcher import model_layer
+from gitcher.git_backend import GitBackend
+from gitcher.not_found_prof_error import NotFoundProfError
+from gitcher.prof import Prof
+from gitcher.prof_store import CherfileStore, SqliteStore, ShardedStore
+
+
+class Gitcher(object):
+    """Class that represents an embedded gitcher instance.
+
+    The parsed profiles are kept between calls, and they are only parsed
+    again if the store changes on disk. Every method is thread safe."""
+
+    def __init__(self, cherfile_path: str = None,
+                 git_backend: GitBackend = None):
+        """Gitcher instance constructor.
+
+        :param cherfile_path: Path of the profiles store. Paths ended in
+            '.db' are SQLite stores, and directories sharded stores. None to
+            use the default store
+        :type cherfile_path: str
+        :param git_backend: Git backend to operate with. None to use the
+            default
+        :type git_backend: GitBackend
+        """
+        if cherfile_path is None:
+            self.store = model_layer.get_store()
+        elif cherfile_path.endswith('.db'):
+            self.store = SqliteStore(cherfile_path)
+        elif os.path.isdir(cherfile_path):
+            self.store = ShardedStore(cherfile_path)
+        else:
+            self.store = CherfileStore(cherfile_path)
+        self.git_backend = git_backend or model_layer.GIT_BACKEND
+        self._lock = threading.RLock()
+        self._profs = None  # Profname to profile, loaded on demand
+        self._stamp = None  # Store state when the profiles were loaded
+
+    def _load(self) -> dict:
+        """Function that returns the cached profiles, parsing them again
+        only if the store has changed."""
+        stamp = self.store.stamp()
+        if self._profs is None or stamp != self._stamp:
+            if self.store.exists():
+                profs = self.store.recuperate_profs()
+            else:
+                profs = []
+            self._profs = {prof.profname: prof for prof in profs}
+            self._stamp = stamp
+        return self._profs
+
+    def _ensure_store(self) -> None:
+        """Function that creates the store if it does not exist."""
+        if not self.store.exists():
+            self.store.create()
+
+    def list(self) -> [Prof]:
+        """Function that returns every saved profile, sorted by profname.
+
+        :return: A sort list with all gitcher profiles saved
+        :rtype: [Prof]
+        """
+        with self._lock:
+            profs = self._load()
+            return [profs[profname] for profname in sorted(profs)]
+
+    def lookup(self, profname: str) -> Prof:
+        """Function that returns the required gitcher profile.
+
+        :param profname: Name of the gitcher profile to operate with
+        :type profname: str
+        :return: The required profile
+        :rtype: Prof
+        :raise: NotFoundProfError
+        """
+        with self._lock:
+            try:
+                return self._load()[profname]
+            except KeyError:
+                raise NotFoundProfError
+
+    def add(self, prof: Prof) -> None:
+        """Function that saves a new gitcher profile.
+
+        :param prof: Gitcher profile to save
+        :type prof: Prof
+        :return: None
+        :raise ValueError: If the profile name yet exists
+        """
+        with self._lock:
+            if prof.profname in self._load():
+                raise ValueError("Profile {0} yet exists".format(
+                    prof.profname))
+            self._ensure_store()
+            model_layer.save_profile(prof, self.store)
+            self._profs = None
+
+    def update(self, profname: str, prof: Prof) -> None:
+        """Function that replaces a saved gitcher profile by a new version
+        of it, which can have another profile name.
+
+        :param profname: Name of the gitcher profile to replace
+        :type profname: str
+        :param prof: New version of the gitcher profile
+        :type prof: Prof
+        :return: None
+        :raise: NotFoundProfError
+        """
+        with self._lock:
+            self.lookup(profname)
+            model_layer.update_profile(profname, prof, self.store)
+            self._profs = None
+
+    def delete(self, profname: str) -> None:
+        """Function that deletes a gitcher profile.
+
+        :param profname: Name of the gitcher profile to operate with
+        :type profname: str
+        :return: None
+        :raise: NotFoundProfError
+        """
+        with self._lock:
+            self.lookup(profname)
+            model_layer.delete_profile(profname, self.store)
+            self._profs = None
+
+    def switch(self, profname: str, path: str = None,
+               global_switch: bool = False, include: bool = False,
+               dry_run: bool = False) -> [(str, str)]:
+        """Function that switches a repository, or the global git
+        configuration, to a gitcher profile.
+
+        :param profname: Name of the gitcher profile to operate with
+        :type profname: str
+        :param path: Repository path. None to use the current working
+            directory
+        :type path: str
+        :param global_switch: Switch the global git configuration
+        :type global_switch: bool
+        :param include: Switch through the profile 'include.path' fragment
+        :type include: bool
+        :param dry_run: Only compute the changes, without applying them.
+            Not valid with include
+        :type dry_run: bool
+        :return: The planned changes, as returned by
+            'model_layer.plan_switch'. Empty with include
+        :rtype: [(str, str)]
+        :raise: NotFoundProfError
+        :raise GitCommandError: If the git configuration can not be written
+        """
+        prof = self.lookup(profname)
+        flag = '--global' if global_switch else ''
+        if include:
+            with self._lock:  # Fragments are shared files
+                model_layer.apply_prof_include(prof, path, flag, self.store,
+                                               self.git_backend)
+            return []
+        return model_layer.apply_prof(prof, path, flag, dry_run,
+                                      self.git_backend, self.store)
+
+    def current(self, path: str = None) -> Prof:
+        """Function that returns the profile in use by a repository. If
+        the git configuration matches a saved profile, it is returned;
+        otherwise, the configuration is returned as a profile named 'tmp'.
+
+        :param path: Repository path. None to use the current working
+            directory
+        :type path: str
+        :return: The profile in use
+        :rtype: Prof
+        """
+        cprof = model_layer.recuperate_git_current_prof(
+            path, backend=self.git_backend)
+        for prof in self.list():
+            if prof == cprof:
+                return prof
+        return cprof
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's asynchronous git layer module
+
+This module runs git orders as asyncio subprocesses, directly from argument
+lists and without a shell, bounding how many of them run at the same time.
+It offers coroutine versions of the model layer git operations, so
+operations over several repositories can overlap their git calls.
+"""
+
+import asyncio
+import os
+import re
+from collections import namedtuple
+
+from gitcher import metrics, model_layer
+from gitcher.git_backend import PROF_GIT_KEYS_REGEX, SCOPE_KEYS_REGEX, \
+    parse_git_config, parse_git_scope
+from gitcher.git_command_error import GitCommandError
+from gitcher.prof import Prof
+
+# Default limits
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 10  # Seconds per git call
+
+GitResult = namedtuple('GitResult', ['argv', 'returncode', 'stdout',
+                                     'stderr'])
+
+
+class AsyncGitExecutor(object):
+    """Class that represents an asynchronous git orders executor, with a
+    concurrency limit and a timeout for each call."""
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = None  # Created lazily inside the running loop
+        self._loop = None
+
+    async def run(self, args: [str], path: str = None,
+                  check: bool = False) -> GitResult:
+        """Coroutine that runs a git order and captures its output.
+
+        :param args: Git arguments, without the leading 'git'
+        :type args: [str]
+        :param path: Repository path to run from, via 'git -C'. None to not
+            select any
+        :type path: str
+        :param check: Raise an error if the order exits with non zero status
+        :type check: bool
+        :return: The order result
+        :rtype: GitResult
+        :raise GitCommandError: If the order times out, or if it fails and
+            check is set
+        """
+        argv = ['git']
+        if path is not None:
+            argv += ['-C', path]
+        argv += args
+
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:  # A semaphore is bound to its loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        async with self._semaphore:
+            metrics.count_spawn()
+            p = await asyncio.create_subprocess_exec(
+                *argv, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            try:
+                output, errors = await asyncio.wait_for(p.communicate(),
+                                                        self.timeout)
+            except asyncio.TimeoutError:
+                p.kill()
+                await p.wait()
+                raise GitCommandError(argv)
+
+        result = GitResult(argv, p.returncode, output.decode('utf-8'),
+                           errors.decode('utf-8'))
+        if check and result.returncode != 0:
+            raise GitCommandError(argv, result.returncode, result.stderr)
+        return result
+
+
+# Shared executor for the module level coroutines
+executor = AsyncGitExecutor()
+
+
+# noinspection PyShadowingNames
+async def switch_prof(profname: str, path: str = None, flag: str = '',
+                      executor: AsyncGitExecutor = executor
+                      ) -> [(str, str)]:
+    """Coroutine version of 'model_layer.switch_prof'.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param path: The optional specified repository path
+    :type path: str
+    :param flag: With '--global' flag switch profile globally
+    :type flag: str
+    :param executor: Executor to run the git orders
+    :type executor: AsyncGitExecutor
+    :return: The applied changes, as returned by 'model_layer.plan_switch'
+    :rtype: [(str, str)]
+    :raise GitCommandError: If some git order fails
+    """
+    if not path:
+        path = os.getcwd()  # Current working directory path
+    return await _apply_prof(model_layer.recuperate_prof(profname), path,
+                             flag, executor)
+
+
+async def _apply_prof(prof: Prof, path: str, flag: str,
+                      executor: AsyncGitExecutor) -> [(str, str)]:
+    """Coroutine that writes the changed keys of a gitcher profile into a
+    git configuration."""
+    scope = [flag] if flag else []
+    if flag == '--global':
+        path = None
+
+    # Same scope reading and planning as 'model_layer.apply_prof', so both
+    # 	paths write the same configuration
+    config, includes = await read_git_scope(path, flag or '--local',
+                                            executor)
+    regex = model_layer.fragments_regex()
+    changes = model_layer.plan_switch(
+        prof, config, any(re.search(regex, include) for include in includes))
+
+    # Writes on the same config file are serialized, because git locks it
+    # 	while writing. Different repositories are the ones that overlap
+    for key, value in changes:
+        if value is None:
+            # Exit status 5 means that the key was not set, what is fine
+            result = await executor.run(
+                ['config'] + scope + ['--unset-all', key] +
+                ([regex] if key == 'include.path' else []), path)
+            if result.returncode not in (0, 5):
+                raise GitCommandError(result.argv, result.returncode,
+                                      result.stderr)
+        else:
+            await executor.run(['config'] + scope + [key, value], path,
+                               check=True)
+    return changes
+
+
+# noinspection PyShadowingNames
+async def switch_prof_repos(profname: str, paths: [str],
+                            executor: AsyncGitExecutor = executor) -> list:
+    """Coroutine that switches several repositories to a gitcher profile
+    at the same time.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param paths: Repository paths
+    :type paths: [str]
+    :param executor: Executor to run the git orders
+    :type executor: AsyncGitExecutor
+    :return: For each path, the applied changes or the raised error
+    :rtype: list
+    """
+    prof = model_layer.recuperate_prof(profname)
+    return await asyncio.gather(*(_apply_prof(prof, path, '', executor)
+                                  for path in paths),
+                                return_exceptions=True)
+
+
+async def recuperate_git_current_prof(path: str = None,
+                                      executor: AsyncGitExecutor = executor
+                                      ) -> Prof:
+    """Coroutine version of 'model_layer.recuperate_git_current_prof'.
+
+    :param path: Path to recuperates git user configuration
+    :type path: str
+    :param executor: Executor to run the git orders
+    :type executor: AsyncGitExecutor
+    :return: Rebuilt git profile as gitcher Prof object
+    :rtype: Prof
+    """
+    return model_layer.prof_from_git_config(
+        await read_git_config(path, '', executor))
+
+
+async def read_git_config(path: str = None, flag: str = '',
+                          executor: AsyncGitExecutor = executor) -> dict:
+    """Coroutine version of 'model_layer.read_git_config'.
+
+    :param path: Path to read git configuration from. None to use the
+        current working directory
+    :type path: str
+    :param flag: Scope of the configuration to read (e.g.: '--local' or
+        '--global'). Empty to read the applicable configuration
+    :type flag: str
+    :param executor: Executor to run the git orders
+    :type executor: AsyncGitExecutor
+    :return: Set keys, as 'git_backend.PROF_GIT_KEYS', with their values
+    :rtype: dict
+    """
+    if path is None:
+        path = os.getcwd()
+    scope = [flag] if flag else []
+    result = await executor.run(['config'] + scope +
+                                ['-z', '--get-regexp',
+                                 PROF_GIT_KEYS_REGEX], path)
+    return parse_git_config(result.stdout)
+
+
+async def read_git_scope(path: str, flag: str,
+                         executor: AsyncGitExecutor = executor
+                         ) -> (dict, [str]):
+    """Coroutine version of 'GitBackend.read_scope'.
+
+    :param path: Repository path. None to use the current working directory
+    :type path: str
+    :param flag: Scope of the configuration to read (e.g.: '--local')
+    :type flag: str
+    :param executor: Executor to run the git orders
+    :type executor: AsyncGitExecutor
+    :return: Set keys, as 'git_backend.PROF_GIT_KEYS', with their values,
+        and the 'include.path' values of the scope
+    :rtype: (dict, [str])
+    """
+    if path is None:
+        path = os.getcwd()
+    # A single scope, so includes are not followed
+    result = await executor.run(['config', flag, '-z', '--get-regexp',
+                                 SCOPE_KEYS_REGEX], path)
+    return parse_git_scope(result.stdout)
+
+
+def run(coroutine):
+    """Function that runs a coroutine of this module until it completes,
+    from synchronous code.
+
+    :param coroutine: Coroutine to run
+    :return: The coroutine result
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's shell completions module
+
+This module renders the shell completion scripts of gitcher. The scripts
+complete the options and, after the options which take a profile, the
+profile names, read from the plain text cache which gitcher updates each
+time the saved profiles change (see 'model_layer.update_profnames_cache').
+So a completion never starts the Python interpreter, whatever the number
+of saved profiles is.
+"""
+
+import shlex
+
+SHELLS = ['bash', 'zsh', 'fish']
+
+# Options followed by a profile name
+PROF_OPTS = ['s', 'g', 'd']
+PROF_LONG_OPTS = ['exec', 'env']
+
+BASH_SCRIPT = """\
+# gitcher bash completion. Generated by 'gitcher --completions bash'.
+_gitcher() {{
+    local cur=${{COMP_WORDS[COMP_CWORD]}}
+    if [ "$COMP_CWORD" -eq 1 ]; then
+        COMPREPLY=($(compgen -W "{opts}" -- "$cur"))
+    elif [ "$COMP_CWORD" -eq 2 ]; then
+        case ${{COMP_WORDS[1]}} in
+            {prof_opts})
+                local IFS=$'\\n'
+                [ -r {cache} ] && \\
+                    COMPREPLY=($(compgen -W "$(< {cache})" -- "$cur"))
+                ;;
+        esac
+    fi
+}}
+complete -o default -F _gitcher gitcher
+"""
+
+ZSH_SCRIPT = """\
+#compdef gitcher
+# gitcher zsh completion. Generated by 'gitcher --completions zsh'.
+_gitcher() {{
+    if (( CURRENT == 2 )); then
+        compadd -- {opts}
+    elif (( CURRENT == 3 )); then
+        case $words[2] in
+            {prof_opts})
+                [[ -r {cache} ]] && compadd -- ${{(f)"$(< {cache})"}}
+                ;;
+            *)
+                _files
+                ;;
+        esac
+    else
+        _files
+    fi
+}}
+compdef _gitcher gitcher
+"""
+
+FISH_SCRIPT = """\
+# gitcher fish completion. Generated by 'gitcher --completions fish'.
+{opts}
+"""
+
+
+def render(shell: str, opts: [str], long_opts: [str], cache_path: str) -> str:
+    """Function that renders the completion script of a shell.
+
+    :param shell: Shell, one of SHELLS
+    :type shell: str
+    :param opts: Short options, without dash (e.g.: 's')
+    :type opts: [str]
+    :param long_opts: Long options, without dashes (e.g.: 'doctor')
+    :type long_opts: [str]
+    :param cache_path: Profile names cache path
+    :type cache_path: str
+    :return: Completion script
+    :rtype: str
+    :raise ValueError: If the shell is not supported
+    """
+    words = ['-' + opt for opt in opts] + ['--' + opt for opt in long_opts]
+    cache = shlex.quote(cache_path)
+    prof_words = ['-' + opt for opt in PROF_OPTS] + \
+        ['--' + opt for opt in PROF_LONG_OPTS]
+    if shell == 'bash':
+        return BASH_SCRIPT.format(
+            opts=' '.join(words), cache=cache,
+            prof_opts='|'.join(prof_words))
+    elif shell == 'zsh':
+        return ZSH_SCRIPT.format(
+            opts=' '.join(words), cache=cache,
+            prof_opts='|'.join(prof_words))
+    elif shell == 'fish':
+        profnames = " -x -a '(cat {0} 2>/dev/null)'".format(
+            cache.replace("'", "\\'"))
+        lines = ["complete -c gitcher -s " + opt +
+                 (profnames if opt in PROF_OPTS else '') for opt in opts]
+        lines += ["complete -c gitcher -l " + opt +
+                  (profnames if opt in PROF_LONG_OPTS else '')
+                  for opt in long_opts]
+        return FISH_SCRIPT.format(opts='\n'.join(lines))
+    raise ValueError("Unknown shell: " + str(shell))
@@ -21,20 +21,46 @@ from gitcher import model_layer
 
 class Dictionary(object):
     """This class presents the gitcher dictionary container, with all the
-    options keys and also with a collection of the user data obtained with
-    the start of the program execution."""
+    options keys and also with a collection of the user data, which is
+    loaded the first time it is required (i.e.: only on interactive mode),
+    so the fast mode orders do not read every saved profile."""
 
     # noinspection PyShadowingNames
     def __init__(self):
         self.cmds_interactive_mode = ['s', 'g', 'a', 'd', 'u', 'm', 'q']
-        self.cmds_fast_mode = ['l', 's', 'g', 'a', 'd', 'o']
+        self.cmds_fast_mode = ['l', 's', 'g', 'a', 'd', 'o', 'f']
+        self.cmds_fast_mode_long = ['check-history', 'migrate', 'doctor',
+                                    'watch', 'stats', 'rollback', 'repos',
+                                    'completions', 'exec', 'env', 'dedupe',
+                                    'reattribute', 'mailmap', 'harvest']
+        self.cmds_machine_output = ['l', 'o', 'f', 'check-history',
+                                    'doctor', 'stats', 'repos']
 
-        profs = model_layer.recuperate_profs()
-        self.profs_profnames = [prof.profname for prof in profs]
-        self.profs_names = [prof.name for prof in profs]
-        self.profs_emails = [prof.email for prof in profs]
+        self._profs = None  # Saved profiles, loaded on demand
+
+    def _get_profs(self) -> list:
+        """Function that returns the saved profiles, loading them the first
+        time."""
+        if self._profs is None:
+            self._profs = model_layer.recuperate_profs()
+        return self._profs
+
+    @property
+    def profs_profnames(self) -> [str]:
+        return [prof.profname for prof in self._get_profs()]
+
+    @property
+    def profs_names(self) -> [str]:
+        return [prof.name for prof in self._get_profs()]
+
+    @property
+    def profs_emails(self) -> [str]:
+        return [prof.email for prof in self._get_profs()]
+
+    @property
+    def profs_signkeys(self) -> [str]:
         # Next force string cast because signkey could be None
-        self.profs_signkeys = [str(prof.signkey) for prof in profs]
+        return [str(prof.signkey) for prof in self._get_profs()]
 
     def get_union_all(self) -> [str]:
         """This function returns a list with the union of all the dictionary
@@ -0,0 +1,627 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's git backends module
+
+This module contains the backends which read and write the git
+configuration on behalf of the model layer: the git command one, the
+default; an in-process one which edits the git config files directly, with
+no process spawns; and an in-memory fake, isolated from every file, for
+fast tests and benchmarks.
+
+Every operation receives the repository path and a scope flag, as the git
+config command does: empty to read the applicable configuration (or to
+write the repository one), '--local', '--global', '--worktree' or
+'--file=<path>'.
+"""
+
+import os
+import re
+import subprocess
+import threading
+
+from gitcher import metrics, repo_resolver
+from gitcher.git_command_error import GitCommandError
+
+# Git config keys of a gitcher profile
+PROF_GIT_KEYS = ['user.name', 'user.email', 'user.signingkey',
+                 'commit.gpgsign']
+PROF_GIT_KEYS_REGEX = r'^(user\.(name|email|signingkey)|commit\.gpgsign)$'
+SCOPE_KEYS_REGEX = r'^(user\.(name|email|signingkey)|commit\.gpgsign|' \
+    r'include\.path)$'
+
+
+def parse_git_config(output: str) -> dict:
+    """Function that parses the output of a 'git config -z --get-regexp'
+    order.
+
+    :param output: Order output
+    :type output: str
+    :return: Set keys with their values
+    :rtype: dict
+    """
+    config = dict()
+    for entry in filter(None, output.split('\0')):
+        key, _, value = entry.partition('\n')
+        config[key] = value  # Last value wins, as for git
+    return config
+
+
+def parse_git_scope(output: str) -> (dict, [str]):
+    """Function that parses the output of a 'git config -z --get-regexp'
+    order over 'SCOPE_KEYS_REGEX', splitting the 'include.path' values
+    from the rest of the keys.
+
+    :param output: Order output
+    :type output: str
+    :return: Set keys with their values, and the 'include.path' values
+    :rtype: (dict, [str])
+    """
+    includes = [entry.partition('\n')[2]
+                for entry in filter(None, output.split('\0'))
+                if entry.partition('\n')[0] == 'include.path']
+    config = parse_git_config(output)
+    config.pop('include.path', None)
+    return config, includes
+
+
+class GitBackend(object):
+    """Class that represents a git configuration backend. It is the
+    interface that every backend implements."""
+
+    def read_config(self, path: str, flag: str = '') -> dict:
+        """Function that reads the gitcher profile keys of a git
+        configuration.
+
+        :param path: Repository path
+        :type path: str
+        :param flag: Scope of the configuration to read
+        :type flag: str
+        :return: Set keys, as 'PROF_GIT_KEYS', with their values
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def read_scope(self, path: str, flag: str) -> (dict, [str]):
+        """Function that reads the gitcher profile keys of a git
+        configuration scope and its 'include.path' values, with no include
+        followed, at once.
+
+        :param path: Repository path
+        :type path: str
+        :param flag: Scope of the configuration to read (e.g.: '--local')
+        :type flag: str
+        :return: Set keys, as 'PROF_GIT_KEYS', with their values, and the
+            included paths
+        :rtype: (dict, [str])
+        """
+        raise NotImplementedError
+
+    def set_config(self, path: str, flag: str, key: str,
+                   value: str) -> None:
+        """Function that sets a git configuration key.
+
+        :param path: Repository path
+        :type path: str
+        :param flag: Scope of the configuration to write
+        :type flag: str
+        :param key: Configuration key
+        :type key: str
+        :param value: New value
+        :type value: str
+        :return: None
+        :raise GitCommandError: If the configuration can not be written
+        """
+        raise NotImplementedError
+
+    def unset_config(self, path: str, flag: str, key: str,
+                     value_regex: str = None) -> None:
+        """Function that unsets a git configuration key, if it is set.
+
+        :param path: Repository path
+        :type path: str
+        :param flag: Scope of the configuration to write
+        :type flag: str
+        :param key: Configuration key
+        :type key: str
+        :param value_regex: Extended regular expression of the values to
+            unset. None to unset every value
+        :type value_regex: str
+        :return: None
+        :raise GitCommandError: If the configuration can not be written
+        """
+        raise NotImplementedError
+
+    def replace_all(self, path: str, flag: str, key: str, value: str,
+                    value_regex: str) -> None:
+        """Function that replaces every value of a multivalued git
+        configuration key that matches a regular expression by a single
+        new value, as 'git config --replace-all' does.
+
+        :param path: Repository path
+        :type path: str
+        :param flag: Scope of the configuration to write
+        :type flag: str
+        :param key: Configuration key
+        :type key: str
+        :param value: New value
+        :type value: str
+        :param value_regex: Extended regular expression of the values to
+            replace
+        :type value_regex: str
+        :return: None
+        :raise GitCommandError: If the configuration can not be written
+        """
+        raise NotImplementedError
+
+
+class SubprocessGitBackend(GitBackend):
+    """Class that represents the git backend which runs the git command,
+    directly from argument lists and without a shell."""
+
+    @staticmethod
+    def _config_cmd(path: str, flag: str) -> [str]:
+        """Function that returns the start of a git config order."""
+        cmd = ['git']
+        if flag != '--global':
+            cmd += ['-C', path or os.getcwd()]
+        cmd.append('config')
+        if flag:
+            cmd.append(flag)
+        return cmd
+
+    @staticmethod
+    def _run(cmd: [str], ok_codes: [int] = (0,)) -> str:
+        """Function that runs a git order and returns its output.
+
+        :raise GitCommandError: If the order exits with other status
+        """
+        metrics.count_spawn()
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE) as p:
+            output, errors = p.communicate()
+        if p.returncode not in ok_codes:
+            raise GitCommandError(cmd, p.returncode, errors.decode('utf-8'))
+        return output.decode('utf-8')
+
+    def read_config(self, path: str, flag: str = '') -> dict:
+        # Exit status 1 means that no key is set
+        return parse_git_config(self._run(
+            self._config_cmd(path, flag) +
+            ['-z', '--get-regexp', PROF_GIT_KEYS_REGEX], ok_codes=(0, 1)))
+
+    def read_scope(self, path: str, flag: str) -> (dict, [str]):
+        # A single scope, so includes are not followed
+        return parse_git_scope(self._run(
+            self._config_cmd(path, flag) +
+            ['-z', '--get-regexp', SCOPE_KEYS_REGEX], ok_codes=(0, 1)))
+
+    def set_config(self, path: str, flag: str, key: str,
+                   value: str) -> None:
+        self._run(self._config_cmd(path, flag) + [key, value])
+
+    def unset_config(self, path: str, flag: str, key: str,
+                     value_regex: str = None) -> None:
+        # Exit status 5 means that the key was not set, what is fine
+        self._run(self._config_cmd(path, flag) + ['--unset-all', key] +
+                  ([value_regex] if value_regex is not None else []),
+                  ok_codes=(0, 5))
+
+    def replace_all(self, path: str, flag: str, key: str, value: str,
+                    value_regex: str) -> None:
+        self._run(self._config_cmd(path, flag) +
+                  ['--replace-all', key, value, value_regex])
+
+
+class ConfigFileGitBackend(GitBackend):
+    """Class that represents the git backend which reads and writes the git
+    config files in process, locking them as git does.
+
+    The applicable configuration is the global one, followed by the
+    repository one and, if 'extensions.worktreeConfig' is enabled, the
+    worktree one. 'include.path' keys are followed on reads, but system
+    configuration and conditional includes are not."""
+
+    ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+    MAX_INCLUDE_DEPTH = 10
+
+    def __init__(self, global_path: str = None):
+        """Config files git backend constructor.
+
+        :param global_path: Path of the global configuration. None to use
+            '~/.gitconfig'
+        :type global_path: str
+        """
+        self.global_path = global_path
+
+    def _global_paths(self) -> [str]:
+        """Function that returns the global config files, in read order.
+        The last one is the written one."""
+        if self.global_path is not None:
+            return [self.global_path]
+        home = os.path.expanduser('~')
+        xdg = os.environ.get('XDG_CONFIG_HOME') or \
+            os.path.join(home, '.config')
+        return [os.path.join(xdg, 'git', 'config'),
+                os.path.join(home, '.gitconfig')]
+
+    @staticmethod
+    def git_dirs(path: str) -> (str, str):
+        """Function that finds the git directory of the repository which
+        contains a path, as git does.
+
+        :param path: Repository path, or a path inside it
+        :type path: str
+        :return: The git directory and the common directory, which differ
+            on linked worktrees
+        :rtype: (str, str)
+        :raise GitCommandError: If the path is not inside a repository
+        """
+        location = repo_resolver.resolve(path)
+        if location is None:
+            raise GitCommandError(['config'], 128,
+                                  "not a git repository: " + str(path))
+        return location.git_dir, location.common_dir
+
+    def worktree_config_path(self, path: str) -> str:
+        """Function that returns the worktree config file of a repository.
+
+        :param path: Repository path, or a path inside it
+        :type path: str
+        :return: The worktree config file path, or None if the worktree
+            configuration is not enabled
+        :rtype: str
+        :raise GitCommandError: If the path is not inside a repository
+        """
+        git_dir, common_dir = self.git_dirs(path)
+        config = dict(self._entries(os.path.join(common_dir, 'config')))
+        if config.get('extensions.worktreeconfig', 'false').lower() in \
+                ['true', 'yes', 'on', '1', '']:
+            return os.path.join(git_dir, 'config.worktree')
+        return None
+
+    def _read_paths(self, path: str, flag: str) -> [str]:
+        """Function that returns the config files to read, in order."""
+        if flag == '--global':
+            return self._global_paths()
+        if flag.startswith('--file='):
+            return [flag[len('--file='):]]
+        local = os.path.join(self.git_dirs(path)[1], 'config')
+        if flag == '--local':
+            return [local]
+        worktree = self.worktree_config_path(path)
+        if flag == '--worktree':
+            return [worktree or local]
+        return self._global_paths() + [local] + \
+            ([worktree] if worktree else [])
+
+    def _write_path(self, path: str, flag: str) -> str:
+        """Function that returns the config file to write."""
+        if flag == '--global':
+            return self._global_paths()[-1]
+        if flag.startswith('--file='):
+            return flag[len('--file='):]
+        if flag == '--worktree':
+            worktree = self.worktree_config_path(path)
+            if worktree:
+                return worktree
+        return os.path.join(self.git_dirs(path)[1], 'config')
+
+    @classmethod
+    def parse_value(cls, raw: str) -> str:
+        """Function that parses a raw config value, removing its quotes,
+        escapes, comments and surrounding spaces."""
+        value = []
+        spaces = ''  # Pending, they are dropped at the end of the value
+        quoted = False
+        i = 0
+        raw = raw.lstrip()
+        while i < len(raw):
+            c = raw[i]
+            if c == '\\' and i + 1 < len(raw):
+                value.append(spaces + cls.ESCAPES.get(raw[i + 1],
+                                                      raw[i + 1]))
+                spaces = ''
+                i += 1
+            elif c == '"':
+                quoted = not quoted
+            elif not quoted and c in '#;':
+                break
+            elif not quoted and c in ' \t':
+                spaces += c
+            else:
+                value.append(spaces + c)
+                spaces = ''
+            i += 1
+        return ''.join(value)
+
+    @staticmethod
+    def quote_value(value: str) -> str:
+        """Function that formats a value to be written in a config file."""
+        quoted = value.replace('\\', '\\\\').replace('"', '\\"') \
+            .replace('\n', '\\n').replace('\t', '\\t')
+        if value != value.strip() or '#' in value or ';' in value:
+            quoted = '"' + quoted + '"'
+        return quoted
+
+    @staticmethod
+    def split_key(key: str) -> (str, str, str):
+        """Function that splits a config key in its section, subsection (or
+        None) and name, lowering the case-insensitive parts."""
+        section, _, rest = key.partition('.')
+        subsection, _, name = rest.rpartition('.')
+        return section.lower(), subsection or None, name.lower()
+
+    @classmethod
+    def parse_lines(cls, lines: [str]) -> ([tuple], [tuple]):
+        """Function that parses the lines of a config file.
+
+        :param lines: Config file lines
+        :type lines: [str]
+        :return: The section headers, as (line index, section, subsection)
+            tuples, and the entries, as (line index, section, subsection,
+            name, value) tuples
+        :rtype: ([tuple], [tuple])
+        """
+        headers = []
+        entries = []
+        section = subsection = None
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped or stripped[0] in '#;':
+                continue
+            if stripped.startswith('['):
+                header = stripped[1:stripped.find(']')].strip()
+                if '"' in header:
+                    section, _, subsection = header.partition(' ')
+                    subsection = re.sub(r'\\(.)', r'\1',
+                                        subsection.strip()[1:-1])
+                elif '.' in header:  # Deprecated '[section.subsection]'
+                    section, _, subsection = header.partition('.')
+                    subsection = subsection.lower()
+                else:
+                    section, subsection = header, None
+                section = section.lower()
+                headers.append((i, section, subsection))
+            elif section is not None:
+                name, equals, raw = stripped.partition('=')
+                value = cls.parse_value(raw) if equals else ''
+                entries.append((i, section, subsection, name.strip().lower(),
+                                value))
+        return headers, entries
+
+    def _entries(self, config_path: str, depth: int = 0):
+        """Generator that yields the (key, value) pairs of a config file, in
+        order and following its 'include.path' keys."""
+        try:
+            with open(config_path, 'r') as f:
+                lines = f.readlines()
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for _, section, subsection, name, value in \
+                self.parse_lines(lines)[1]:
+            key = '.'.join(filter(None, [section, subsection, name]))
+            yield key, value
+            if key == 'include.path' and depth < self.MAX_INCLUDE_DEPTH:
+                include = os.path.join(os.path.dirname(config_path),
+                                       os.path.expanduser(value))
+                for entry in self._entries(include, depth + 1):
+                    yield entry
+
+    def read_config(self, path: str, flag: str = '') -> dict:
+        config = dict()
+        for config_path in self._read_paths(path, flag):
+            for key, value in self._entries(config_path):
+                if re.match(PROF_GIT_KEYS_REGEX, key):
+                    config[key] = value  # Last value wins, as for git
+        return config
+
+    def read_scope(self, path: str, flag: str) -> (dict, [str]):
+        config = dict()
+        includes = []
+        for config_path in self._read_paths(path, flag):
+            try:
+                with open(config_path, 'r') as f:
+                    lines = f.readlines()
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for _, section, subsection, name, value in \
+                    self.parse_lines(lines)[1]:
+                key = '.'.join(filter(None, [section, subsection, name]))
+                if key == 'include.path':
+                    includes.append(value)
+                elif re.match(PROF_GIT_KEYS_REGEX, key):
+                    config[key] = value  # Last value wins, as for git
+        return config, includes
+
+    @staticmethod
+    def _edit(config_path: str, edit) -> None:
+        """Function that edits a config file under its lock file, as git
+        does, and replaces it atomically.
+
+        :param config_path: Config file path
+        :type config_path: str
+        :param edit: Function which receives the file lines and returns the
+            new ones
+        :type edit: function
+        :raise GitCommandError: If the config file is locked
+        """
+        lock_path = config_path + '.lock'
+        try:
+            fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o644)
+        except FileExistsError:
+            raise GitCommandError(['config'], 255,
+                                  "could not lock config file " +
+                                  config_path)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                try:
+                    with open(config_path, 'r') as config:
+                        lines = config.readlines()
+                except FileNotFoundError:
+                    lines = []
+                if lines and not lines[-1].endswith('\n'):
+                    lines[-1] += '\n'
+                f.writelines(edit(lines))
+            os.replace(lock_path, config_path)
+        except BaseException:
+            os.remove(lock_path)
+            raise
+
+    def _key_entries(self, lines: [str], key: str) -> [(int, str)]:
+        """Function that returns the line indexes and values of the entries
+        of a key."""
+        section, subsection, name = self.split_key(key)
+        return [(i, value) for i, s, sub, n, value in
+                self.parse_lines(lines)[1]
+                if (s, sub, n) == (section, subsection, name)]
+
+    def _entry_line(self, key: str, value: str) -> str:
+        return '\t{0} = {1}\n'.format(self.split_key(key)[2],
+                                      self.quote_value(value))
+
+    def _add_entry(self, lines: [str], key: str, value: str) -> [str]:
+        """Function that adds an entry after the last one of the last
+        section of a key, creating the section if it does not exist."""
+        section, subsection, _ = self.split_key(key)
+        headers, entries = self.parse_lines(lines)
+        starts = [i for i, s, sub in headers if (s, sub) == (section,
+                                                             subsection)]
+        if not starts:
+            if subsection is None:
+                header = '[{0}]\n'.format(section)
+            else:
+                header = '[{0} "{1}"]\n'.format(
+                    section, subsection.replace('\\', '\\\\')
+                    .replace('"', '\\"'))
+            return lines + [header, self._entry_line(key, value)]
+        start = starts[-1]
+        end = min([i for i, _, _ in headers if i > start] + [len(lines)])
+        last = max([entry[0] for entry in entries if start < entry[0] < end]
+                   + [start])
+        return lines[:last + 1] + [self._entry_line(key, value)] + \
+            lines[last + 1:]
+
+    def set_config(self, path: str, flag: str, key: str,
+                   value: str) -> None:
+        def edit(lines):
+            entries = self._key_entries(lines, key)
+            if len(entries) > 1:
+                raise GitCommandError(['config', key], 5,
+                                      "cannot overwrite multiple values")
+            if entries:
+                i = entries[0][0]
+                return lines[:i] + [self._entry_line(key, value)] + \
+                    lines[i + 1:]
+            return self._add_entry(lines, key, value)
+
+        self._edit(self._write_path(path, flag), edit)
+
+    def unset_config(self, path: str, flag: str, key: str,
+                     value_regex: str = None) -> None:
+        config_path = self._write_path(path, flag)
+        if not os.path.exists(config_path):
+            return  # Nothing to unset, as for git
+
+        def edit(lines):
+            removed = {i for i, value in self._key_entries(lines, key)
+                       if value_regex is None or re.search(value_regex,
+                                                           value)}
+            return [line for i, line in enumerate(lines) if i not in removed]
+
+        self._edit(config_path, edit)
+
+    def replace_all(self, path: str, flag: str, key: str, value: str,
+                    value_regex: str) -> None:
+        def edit(lines):
+            removed = {i for i, old_value in self._key_entries(lines, key)
+                       if re.search(value_regex, old_value)}
+            return self._add_entry([line for i, line in enumerate(lines)
+                                    if i not in removed], key, value)
+
+        self._edit(self._write_path(path, flag), edit)
+
+
+class MemoryGitBackend(GitBackend):
+    """Class that represents an in-memory fake git backend, for tests and
+    benchmarks. It never touches files nor runs processes, so it is
+    isolated from the user configuration.
+
+    Every path is taken as a repository. The applicable configuration is
+    the global one, followed by the repository and the worktree ones, and
+    'include.path' keys are not followed. It is thread safe."""
+
+    def __init__(self):
+        self.configs = dict()  # Scope to key to list of values
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(path: str, flag: str) -> tuple:
+        """Function that returns the key of a configuration scope."""
+        if flag == '--global':
+            return 'global',
+        if flag.startswith('--file='):
+            return 'file', flag[len('--file='):]
+        return ('worktree' if flag == '--worktree' else 'local',
+                os.path.abspath(path or os.getcwd()))
+
+    def read_config(self, path: str, flag: str = '') -> dict:
+        if flag:
+            scopes = [self._scope(path, flag)]
+        else:
+            scopes = [self._scope(path, '--global'),
+                      self._scope(path, '--local'),
+                      self._scope(path, '--worktree')]
+        config = dict()
+        with self._lock:
+            for scope in scopes:
+                for key, values in self.configs.get(scope, {}).items():
+                    if values and re.match(PROF_GIT_KEYS_REGEX, key):
+                        config[key] = values[-1]
+        return config
+
+    def read_scope(self, path: str, flag: str) -> (dict, [str]):
+        with self._lock:
+            scope = self.configs.get(self._scope(path, flag), {})
+            config = {key: values[-1] for key, values in scope.items()
+                      if values and re.match(PROF_GIT_KEYS_REGEX, key)}
+            return config, list(scope.get('include.path', []))
+
+    def set_config(self, path: str, flag: str, key: str,
+                   value: str) -> None:
+        with self._lock:
+            values = self.configs.setdefault(self._scope(path, flag), {}) \
+                .setdefault(key.lower(), [])
+            if len(values) > 1:
+                raise GitCommandError(['config', key], 5,
+                                      "cannot overwrite multiple values")
+            values[:] = [value]
+
+    def unset_config(self, path: str, flag: str, key: str,
+                     value_regex: str = None) -> None:
+        with self._lock:
+            config = self.configs.get(self._scope(path, flag), {})
+            if value_regex is None:
+                config.pop(key.lower(), None)
+            elif key.lower() in config:
+                config[key.lower()] = [value for value in config[key.lower()]
+                                       if not re.search(value_regex, value)]
+
+    def replace_all(self, path: str, flag: str, key: str, value: str,
+                    value_regex: str) -> None:
+        with self._lock:
+            config = self.configs.setdefault(self._scope(path, flag), {})
+            config[key.lower()] = [old_value for old_value in
+                                   config.get(key.lower(), [])
+                                   if not re.search(value_regex, old_value)] \
+                + [value]
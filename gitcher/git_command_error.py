@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's 'git_command_error' class module
+
+This module contains the class that represents a gitcher failed git command
+exception.
+"""
+
+
+class GitCommandError(Exception):
+    """Class that represents a gitcher failed git command exception. It
+    keeps the failed order and its captured error output.
+
+    Its arguments are kept as they are passed, so it is rebuilt with the
+    same fields when it is pickled (e.g.: across a process pool)."""
+
+    def __init__(self, argv: [str], returncode: int = None,
+                 stderr: str = ''):
+        self.argv = argv
+        self.returncode = returncode
+        self.stderr = stderr
+        super().__init__(argv, returncode, stderr)
+
+    def __str__(self) -> str:
+        if self.returncode is None:
+            return "'{0}' timed out".format(' '.join(self.argv))
+        return "'{0}' exited with {1}: {2}".format(' '.join(self.argv),
+                                                  self.returncode,
+                                                  self.stderr.strip())
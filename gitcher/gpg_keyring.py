@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's GPG keyring module
+
+This module validates the sign keys of the gitcher profiles against the
+user GPG keyring. The secret keys are listed with a single gpg call, and
+indexed by fingerprint, long ID and short ID, so every profile is checked
+in one pass. The index is cached until the keyring changes.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+from shutil import which
+
+from gitcher import metrics, model_layer
+
+# Profile key problems
+MISSING = 'missing'
+EXPIRED = 'expired'
+REVOKED = 'revoked'
+NO_SIGN = 'no-sign'
+UID_MISMATCH = 'uid-mismatch'
+
+# Keyring files whose changes invalidate the cached index
+KEYRING_FILES = ['pubring.kbx', 'pubring.gpg', 'secring.gpg',
+                 'private-keys-v1.d', 'trustdb.gpg']
+
+
+class KeyringError(Exception):
+    """Class that represents a failed listing of the keyring secret keys.
+    It keeps the gpg exit status and its captured error output."""
+
+    def __init__(self, returncode: int, stderr: str = ''):
+        self.returncode = returncode
+        self.stderr = stderr
+        super().__init__("gpg exited with {0} listing the secret keys: "
+                         "{1}".format(returncode, stderr.strip()))
+
+
+def check_gpg_installed() -> bool:
+    """Function that checks if gpg command is installed and reachable.
+
+    :return: Confirmation about the reachability of gpg command installation
+    :rtype: bool
+    """
+    return which("gpg") is not None
+
+
+def gnupg_home() -> str:
+    """Function that returns the GPG home directory in use.
+
+    :return: GPG home directory path
+    :rtype: str
+    """
+    return os.environ.get('GNUPGHOME',
+                          os.path.join(model_layer.HOME, '.gnupg'))
+
+
+def keyring_mtime(home: str) -> int:
+    """Function that returns the last modification time of the keyring.
+
+    :param home: GPG home directory path
+    :type home: str
+    :return: Last modification time, in nanoseconds. 0 if there is no
+        keyring
+    :rtype: int
+    """
+    mtimes = [0]
+    for name in KEYRING_FILES:
+        try:
+            mtimes.append(os.stat(os.path.join(home, name)).st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+    return max(mtimes)
+
+
+def parse_secret_keys(output: str) -> [dict]:
+    """Function that parses a 'gpg --list-secret-keys --with-colons' output.
+
+    :param output: Order output
+    :type output: str
+    :return: One dict per primary key or subkey, with its 'fingerprint',
+        'keyid', 'validity', 'expires' (epoch seconds or None),
+        'capabilities' and the 'uids' of its primary key
+    :rtype: [dict]
+    """
+    keys = []
+    uids = []  # Of the current primary key, shared with its subkeys
+    for line in output.splitlines():
+        fields = line.split(':')
+        record = fields[0]
+        if record in ['sec', 'ssb']:
+            if record == 'sec':
+                uids = []
+            keys.append({'fingerprint': None,
+                         'keyid': fields[4].upper(),
+                         'validity': fields[1],
+                         'expires': int(fields[6]) if fields[6] else None,
+                         'capabilities': fields[11],
+                         'uids': uids})
+        elif record == 'fpr' and keys and keys[-1]['fingerprint'] is None:
+            keys[-1]['fingerprint'] = fields[9].upper()
+        elif record == 'uid':
+            # Colons and other special chars come escaped as '\xNN'
+            uids.append(fields[9].encode('latin-1', 'backslashreplace')
+                        .decode('unicode_escape'))
+    return keys
+
+
+def build_index(keys: [dict]) -> dict:
+    """Function that indexes keys by fingerprint, long ID and short ID.
+
+    :param keys: Keys, as returned by 'parse_secret_keys'
+    :type keys: [dict]
+    :return: Upper case ID to list of keys
+    :rtype: dict
+    """
+    index = dict()
+    for key in keys:
+        ids = {key['keyid'], key['keyid'][-8:]}
+        if key['fingerprint']:
+            ids.add(key['fingerprint'])
+        for key_id in ids:
+            index.setdefault(key_id, []).append(key)
+    return index
+
+
+def load_index(cache: bool = True) -> dict:
+    """Function that returns the index of the secret keys of the keyring in
+    use. It runs gpg only if the cached index is older than the keyring,
+    and a failed listing is never cached.
+
+    :param cache: Use and refresh the cached index
+    :type cache: bool
+    :return: Index, as returned by 'build_index'
+    :rtype: dict
+    :raise KeyringError: If gpg fails to list the secret keys
+    """
+    home = gnupg_home()
+    mtime = keyring_mtime(home)
+    cache_path = os.path.join(model_layer.CACHE_DIR, 'gpg-{0}.json'.format(
+        hashlib.sha1(home.encode('utf-8')).hexdigest()[:16]))
+
+    if cache:
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached['mtime'] == mtime:
+                return build_index(cached['keys'])
+        except (OSError, ValueError, KeyError):
+            pass  # Missing or unreadable cache
+
+    metrics.count_spawn()
+    with subprocess.Popen(['gpg', '--batch', '--with-colons',
+                           '--fixed-list-mode', '--list-secret-keys'],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE) as p:
+        output, errors = p.communicate()
+    if p.returncode != 0:
+        raise KeyringError(p.returncode, errors.decode('utf-8', 'replace'))
+    keys = parse_secret_keys(output.decode('utf-8', 'replace'))
+
+    if cache:
+        tmp_path = None
+        try:
+            os.makedirs(model_layer.CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=model_layer.CACHE_DIR,
+                                            prefix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'mtime': mtime, 'keys': keys}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Not writable cache, so the keyring is listed the next time
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return build_index(keys)
+
+
+def normalize_key_id(signkey: str) -> str:
+    """Function that normalizes a key ID as written in git configuration
+    (e.g.: '0xabcd1234!') to the index format."""
+    key_id = signkey.strip().replace(' ', '').rstrip('!').upper()
+    if key_id.startswith('0X'):
+        key_id = key_id[2:]
+    return key_id
+
+
+def check_prof_key(prof, index: dict, now: float = None) -> [str]:
+    """Function that validates the sign key of a gitcher profile.
+
+    :param prof: Gitcher profile to validate. Profiles without key are
+        always valid
+    :type prof: Prof
+    :param index: Index, as returned by 'build_index'
+    :type index: dict
+    :param now: Reference epoch time to check expiration. None to use the
+        current time
+    :type now: float
+    :return: The key problems: 'missing', 'expired', 'revoked', 'no-sign'
+        or 'uid-mismatch'. Empty if the key is valid
+    :rtype: [str]
+    """
+    if prof.signkey is None:
+        return []
+    keys = index.get(normalize_key_id(prof.signkey))
+    if not keys:
+        return [MISSING]
+
+    now = time.time() if now is None else now
+    problems = []
+    if all(key['validity'] == 'r' for key in keys):
+        problems.append(REVOKED)
+    elif all(key['validity'] == 'e' or
+             (key['expires'] is not None and key['expires'] <= now)
+             for key in keys):
+        problems.append(EXPIRED)
+    # Upper case letters of a primary key are the capabilities of the whole
+    # 	key, including its subkeys
+    if not any(c in key['capabilities'] for key in keys for c in 'sS'):
+        problems.append(NO_SIGN)
+
+    email = '<{0}>'.format(prof.email.lower())
+    if not any(email in uid.lower() for key in keys for uid in key['uids']):
+        problems.append(UID_MISMATCH)
+    return problems
+
+
+def check_profs_keys(profs: list, cache: bool = True, index: dict = None):
+    """Generator that validates the sign keys of a list of gitcher profiles
+    against the keyring in use.
+
+    :param profs: Gitcher profiles to validate
+    :type profs: [Prof]
+    :param cache: Use and refresh the cached index
+    :type cache: bool
+    :param index: Index, as returned by 'build_index'. None to load it
+    :type index: dict
+    :return: Pairs of profile and its problems, as returned by
+        'check_prof_key'
+    :rtype: Iterator[(Prof, [str])]
+    :raise KeyringError: If gpg fails to list the secret keys
+    """
+    if index is None:
+        index = load_index(cache)
+    now = time.time()
+    for prof in profs:
+        yield prof, check_prof_key(prof, index, now)
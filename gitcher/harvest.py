@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's harvest module
+
+This module bootstraps the gitcher profiles from the identities that the
+existing repositories have configured. The repositories below some roots
+are found by the parallel walk of the repositories index (see
+'repo_index'), with no index write. Then the local identity of each one,
+the keys which 'model_layer.recuperate_git_current_prof' reads, is read
+in parallel and in process, by the config files git backend, so no git
+process is spawned.
+
+The identities are grouped in a hash map by 'Prof.identity', in a single
+pass. Every one which is not yet saved becomes a new profile, with a
+profile name generated from its email, and the new profiles are saved in
+a single atomic batch.
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from gitcher import model_layer
+from gitcher.git_backend import GitBackend, ConfigFileGitBackend
+from gitcher.git_command_error import GitCommandError
+from gitcher.prof import Prof
+from gitcher.prof_store import ProfStore
+from gitcher.repo_index import RepoIndex, MAX_DEPTH
+
+# Characters replaced on the generated profile names
+PROFNAME_ILLEGAL = re.compile(r'[^a-z0-9._-]+')
+
+
+def read_identity(path: str, backend: GitBackend) -> Prof:
+    """Function that reads the local identity of a repository.
+
+    :param path: Repository path
+    :type path: str
+    :param backend: Git backend to operate with
+    :type backend: GitBackend
+    :return: The identity, as a gitcher profile with no profname, or None
+        if the repository has not a local name and email
+    :rtype: Prof
+    """
+    try:
+        prof = model_layer.recuperate_git_current_prof(path, '--local',
+                                                       backend)
+    except (GitCommandError, OSError):
+        return None
+    if not prof.name.strip() or not prof.email.strip():
+        return None
+    return Prof(None, prof.name.strip(), prof.email.strip(),
+                prof.signkey.strip() if prof.signkey else None,
+                prof.signpref is True)
+
+
+def harvest_identities(repo_paths: [str], workers: int = 8,
+                       backend: GitBackend = None) -> dict:
+    """Function that reads the local identities of some repositories, in
+    parallel, and groups them.
+
+    :param repo_paths: Repository paths
+    :type repo_paths: [str]
+    :param workers: Number of repositories read at the same time
+    :type workers: int
+    :param backend: Git backend to operate with. None to read the config
+        files in process
+    :type backend: GitBackend
+    :return: Identity, as returned by 'Prof.identity', to its first read
+        profile and the paths of its repositories
+    :rtype: dict
+    """
+    backend = backend or ConfigFileGitBackend()
+    groups = dict()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, prof in zip(repo_paths, pool.map(
+                lambda path: read_identity(path, backend), repo_paths)):
+            if prof is not None:
+                groups.setdefault(prof.identity(), (prof, []))[1].append(
+                    path)
+    return groups
+
+
+def generate_profname(prof: Prof, taken: set) -> str:
+    """Function that generates a profile name for an identity, from its
+    email: its local part, followed by its domain first label and then by
+    a number, if needed to not repeat a taken one.
+
+    :param prof: Gitcher profile of the identity
+    :type prof: Prof
+    :param taken: Taken profile names
+    :type taken: set
+    :return: Profile name
+    :rtype: str
+    """
+    local, _, domain = prof.email.strip().lower().partition('@')
+    profname = PROFNAME_ILLEGAL.sub('-', local).strip('-') or 'profile'
+    if profname not in taken:
+        return profname
+    label = PROFNAME_ILLEGAL.sub('-', domain.split('.')[0]).strip('-')
+    if label:
+        profname += '-' + label
+    candidate = profname
+    n = 2
+    while candidate in taken:
+        candidate = '{0}-{1}'.format(profname, n)
+        n += 1
+    return candidate
+
+
+def plan_harvest(groups: dict, profs: [Prof]) -> [(Prof, [str])]:
+    """Function that plans the profiles to create for some harvested
+    identities, skipping the ones which are yet saved.
+
+    :param groups: Harvested identities, as returned by
+        'harvest_identities'
+    :type groups: dict
+    :param profs: Saved gitcher profiles
+    :type profs: [Prof]
+    :return: New profiles, with generated names, and the sorted paths of
+        their repositories, sorted by email and name
+    :rtype: [(Prof, [str])]
+    """
+    saved = set(prof.identity() for prof in profs)
+    taken = set(prof.profname for prof in profs)
+    plan = []
+    for identity in sorted(groups, key=lambda identity: (
+            identity[1], identity[0], identity[2] or '', identity[3])):
+        if identity in saved:
+            continue
+        prof, repo_paths = groups[identity]
+        profname = generate_profname(prof, taken)
+        taken.add(profname)
+        plan.append((Prof(profname, prof.name, prof.email, prof.signkey,
+                          prof.signpref), sorted(repo_paths)))
+    return plan
+
+
+def harvest(roots: [str], max_depth: int = MAX_DEPTH, dry_run: bool = False,
+            workers: int = 8, store: ProfStore = None,
+            backend: GitBackend = None) -> [(Prof, [str])]:
+    """Function that creates a gitcher profile for every identity which is
+    configured on the repositories below some roots, and is not yet saved.
+
+    :param roots: Root directories to walk
+    :type roots: [str]
+    :param max_depth: Maximum depth to walk below the roots
+    :type max_depth: int
+    :param dry_run: Only plan the new profiles, with no write
+    :type dry_run: bool
+    :param workers: Number of directories or repositories read at the same
+        time
+    :type workers: int
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :param backend: Git backend to read with. None to read the config files
+        in process
+    :type backend: GitBackend
+    :return: The new profiles, as returned by 'plan_harvest'
+    :rtype: [(Prof, [str])]
+    """
+    index = RepoIndex(roots, max_depth=max_depth)
+    index.scan(workers)
+    store = store or model_layer.get_store()
+    plan = plan_harvest(harvest_identities(index.repos(), workers, backend),
+                        list(store.iter_profs()))
+    if plan and not dry_run:
+        model_layer.save_profiles([prof for prof, _ in plan], store)
+    return plan
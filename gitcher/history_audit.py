@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's history audit module
+
+This module checks the authorship of the commits of a set of repositories
+against the saved gitcher profiles. Each repository history is streamed
+from 'git log', so the memory used does not grow with the history length,
+and the repositories are spread across a process pool.
+"""
+
+import os
+import subprocess
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gitcher import model_layer
+from gitcher.git_command_error import GitCommandError
+from gitcher.gpg_keyring import normalize_key_id
+
+# Commit classifications
+MATCH = 'match'
+WRONG = 'wrong'
+UNKNOWN = 'unknown'
+
+
+def build_index(profs: list) -> dict:
+    """Function that builds the authorship index of a gitcher profiles list,
+    to match commit identities without looping over the profiles.
+
+    The index is made of plain containers, so it can be sent to the pool
+    workers.
+
+    :param profs: Gitcher profiles list
+    :type profs: [Prof]
+    :return: The authorship index
+    :rtype: dict
+    """
+    index = {'identity': {}, 'email': {}, 'signkey': {}}
+    for prof in profs:
+        email = prof.email.lower()
+        index['identity'].setdefault((prof.name, email),
+                                     []).append(prof.profname)
+        index['email'].setdefault(email, []).append(prof.profname)
+        if prof.signkey is not None and normalize_key_id(prof.signkey):
+            index['signkey'][prof.profname] = normalize_key_id(prof.signkey)
+    return index
+
+
+def classify_commit(index: dict, expected: set, name: str, email: str,
+                    signkey: str) -> (str, [str]):
+    """Function that classifies a commit identity against the authorship
+    index.
+
+    A commit matches when it belongs to a saved profile which is one of the
+    expected for the repository, or to any saved profile if the repository
+    does not use a saved one. Commits of other saved profiles are wrong, and
+    the rest are unknown.
+
+    :param index: Authorship index
+    :type index: dict
+    :param expected: Profile names which the repository uses
+    :type expected: set
+    :param name: Commit author name
+    :type name: str
+    :param email: Commit author email
+    :type email: str
+    :param signkey: Key which signs the commit, or empty string
+    :type signkey: str
+    :return: The classification and the candidate profile names
+    :rtype: (str, [str])
+    """
+    email = email.lower()
+    candidates = index['identity'].get((name, email)) or \
+        index['email'].get(email)
+    if not candidates:
+        return UNKNOWN, []
+
+    signkey = normalize_key_id(signkey) if signkey else ''
+    if signkey:  # Prefer the profiles which own the signing key
+        # Each side can be a fingerprint, a long or a short ID, so the
+        # 	shorter one has to end the longer one
+        owners = [profname for profname in candidates
+                  if profname in index['signkey'] and
+                  (signkey.endswith(index['signkey'][profname]) or
+                   index['signkey'][profname].endswith(signkey))]
+        candidates = owners or candidates
+
+    if not expected or expected.intersection(candidates):
+        return MATCH, candidates
+    return WRONG, candidates
+
+
+def audit_repo(path: str, index: dict, expected: set,
+               since: str = None) -> dict:
+    """Function that streams the history of a repository and classifies each
+    commit. Only counters are kept, one per distinct identity.
+
+    :param path: Repository path
+    :type path: str
+    :param index: Authorship index
+    :type index: dict
+    :param expected: Profile names which the repository uses
+    :type expected: set
+    :param since: Only check commits after this revision. None to check the
+        whole history
+    :type since: str
+    :return: Audit report with the 'path', the 'counts' by classification,
+        the 'findings' counter of (classification, name, email, profiles)
+        for not matching commits, and the git 'error' output, if any
+    :rtype: dict
+    """
+    cmd = ['git', '-C', path, 'log', '--format=%an%x00%ae%x00%GK']
+    if since:
+        cmd.append(since + '..HEAD')
+
+    counts = Counter()
+    findings = Counter()
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE) as p:
+        for line in p.stdout:
+            name, email, signkey = line.decode('utf-8', 'replace')\
+                .rstrip('\n').split('\0')[:3]
+            status, candidates = classify_commit(index, expected, name,
+                                                 email, signkey)
+            counts[status] += 1
+            if status != MATCH:
+                findings[(status, name, email, ','.join(candidates))] += 1
+        errors = p.stderr.read().decode('utf-8')
+
+    return {'path': path, 'counts': counts, 'findings': findings,
+            'error': errors.strip() if p.returncode != 0 else None}
+
+
+def expected_profnames(path: str, profs: list) -> set:
+    """Function that returns the names of the saved profiles which match the
+    current git configuration of a repository.
+
+    :param path: Repository path
+    :type path: str
+    :param profs: Gitcher profiles list
+    :type profs: [Prof]
+    :return: Profile names
+    :rtype: set
+    """
+    cprof = model_layer.recuperate_git_current_prof(path)
+    return {prof.profname for prof in profs if prof == cprof}
+
+
+def _audit_repo_task(path: str, index: dict, profs: list,
+                     since: str) -> dict:
+    """Pool task that audits a repository against the profile that it
+    currently uses. If its configuration can not be read, the report only
+    has the error."""
+    try:
+        expected = expected_profnames(path, profs)
+    except (GitCommandError, OSError) as e:
+        return {'path': path, 'counts': Counter(), 'findings': Counter(),
+                'error': str(e)}
+    return audit_repo(path, index, expected, since)
+
+
+def audit_repos(paths: [str], since: str = None, workers: int = None):
+    """Generator that audits a set of repositories in a process pool, and
+    yields their reports as they are finished.
+
+    :param paths: Repository paths
+    :type paths: [str]
+    :param since: Only check commits after this revision. None to check the
+        whole history
+    :type since: str
+    :param workers: Number of worker processes. None to use one per CPU
+    :type workers: int
+    :return: Audit reports, as described in 'audit_repo'
+    :rtype: Iterator[dict]
+    """
+    profs = model_layer.recuperate_profs()
+    index = build_index(profs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_audit_repo_task, os.path.abspath(path), index,
+                               profs, since)
+                   for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
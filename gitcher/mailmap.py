@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's mailmap module
+
+This module writes the saved profiles to a '.mailmap' file, so 'git
+shortlog', 'git blame' and 'git log --use-mailmap' attribute the commits
+to the canonical profile identities with no history rewrite.
+
+The saved profiles are grouped by email, ignoring its case and surrounding
+whitespace. The first profile of each group, by profname, is the canonical
+identity: its entry, 'Name <email> <email>', maps every commit with that
+email, whatever its name and email case variant is, to it. Git matches
+emails case insensitively, so a single entry per email is enough.
+
+An existing file is merged incrementally: its lines, comments and blank
+ones included, are kept in place, but the entries which map the same
+commit identity as gitcher does. The new and changed entries are inserted
+in sorted order after the entry they follow, so a sorted file keeps
+sorted, and the file is only rewritten if it changes, keeping its mode.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+
+from gitcher.prof import Prof
+
+MAILMAP_NAME = '.mailmap'
+
+# 'Proper Name <proper@email> Commit Name <commit@email>', with every part
+# 	but the first email optional
+ENTRY = re.compile(r'^\s*([^<#]*?)\s*<([^>]*)>(?:\s*([^<#]*?)\s*<([^>]*)>)?'
+                   r'\s*(?:#.*)?$')
+
+
+def parse_entry(line: str) -> tuple:
+    """Function that parses a mailmap line.
+
+    :param line: Mailmap line
+    :type line: str
+    :return: Proper name, proper email, commit name and commit email, with
+        None for the missing parts, or None if the line is not an entry
+    :rtype: (str, str, str, str)
+    """
+    match = ENTRY.match(line)
+    if match is None:
+        return None
+    return tuple(part or None for part in match.groups())
+
+
+def format_entry(entry: tuple) -> str:
+    """Function that formats a mailmap entry.
+
+    :param entry: Entry, as returned by 'parse_entry'
+    :type entry: (str, str, str, str)
+    :return: Mailmap line
+    :rtype: str
+    """
+    parts = []
+    for name, email in [entry[:2], entry[2:]]:
+        if name:
+            parts.append(name)
+        if email:
+            parts.append('<' + email + '>')
+    return ' '.join(parts)
+
+
+def entry_key(entry: tuple) -> tuple:
+    """Function that returns the commit identity which a mailmap entry
+    maps, as git matches it: case insensitive.
+
+    :param entry: Entry, as returned by 'parse_entry'
+    :type entry: (str, str, str, str)
+    :return: Commit name, or None for every name, and commit email
+    :rtype: (str, str)
+    """
+    proper_name, proper_email, commit_name, commit_email = entry
+    if commit_email is None:
+        return None, proper_email.lower()
+    return (commit_name.lower() if commit_name else None,
+            commit_email.lower())
+
+
+def prof_entries(profs: [Prof]) -> [tuple]:
+    """Function that returns the mailmap entries of some gitcher profiles:
+    one per email, with the canonical identity.
+
+    :param profs: Gitcher profiles
+    :type profs: [Prof]
+    :return: Entries, as returned by 'parse_entry'
+    :rtype: [(str, str, str, str)]
+    """
+    canons = dict()  # Email to canonical profile
+    for prof in sorted(profs, key=lambda prof: prof.profname):
+        canons.setdefault(prof.identity()[1], prof)
+    return [(prof.name.strip(), prof.email.strip(), None, prof.email.strip())
+            for prof in canons.values()]
+
+
+def sort_key(line: str) -> tuple:
+    """Function that returns the sort key of a mailmap entry line.
+
+    :param line: Mailmap entry line
+    :type line: str
+    :return: Sort key, case insensitive first
+    :rtype: (str, str)
+    """
+    return line.lower(), line
+
+
+def insert_sorted(lines: [str], new_lines: [str]) -> [str]:
+    """Function that inserts some entry lines into the lines of a mailmap,
+    each one just after the last entry which sorts before it. The ones
+    which sort before every entry go after the leading comments.
+
+    :param lines: Mailmap lines
+    :type lines: [str]
+    :param new_lines: Entry lines to insert
+    :type new_lines: [str]
+    :return: Merged lines
+    :rtype: [str]
+    """
+    pending = sorted(new_lines, key=sort_key)
+    merged = []
+    others = []  # Non entry lines since the last entry
+    seen_entry = False
+    for line in lines:
+        if parse_entry(line) is None:
+            others.append(line)
+            continue
+        before = []
+        while pending and sort_key(pending[0]) < sort_key(line):
+            before.append(pending.pop(0))
+        merged.extend(before + others if seen_entry else others + before)
+        merged.append(line)
+        others = []
+        seen_entry = True
+    merged.extend(pending + others if seen_entry else others + pending)
+    return merged
+
+
+def merge_mailmap(path: str, entries: [tuple]) -> int:
+    """Function that merges some entries into a mailmap file, creating it
+    if it does not exist. Entries are deduplicated by the commit identity
+    they map, the rest of the file lines are kept, and it is written
+    atomically, only if it changes.
+
+    :param path: Mailmap file path
+    :type path: str
+    :param entries: Entries, as returned by 'parse_entry', which replace
+        the ones of the file which map the same commit identity
+    :type entries: [(str, str, str, str)]
+    :return: Number of added or changed entries
+    :rtype: int
+    """
+    new = dict()  # Commit identity to entry
+    for entry in entries:
+        new[entry_key(entry)] = entry
+    try:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+        exists = True
+    except FileNotFoundError:
+        lines = []
+        exists = False
+
+    kept = []
+    placed = set()  # Commit identities whose file entry is yet right
+    for line in lines:
+        entry = parse_entry(line)
+        if entry is not None and entry_key(entry) in new:
+            key = entry_key(entry)
+            if entry != new[key] or key in placed:
+                continue  # Replaced or duplicated
+            placed.add(key)
+        kept.append(line)
+    added = [format_entry(new[key]) for key in new if key not in placed]
+
+    content = '\n'.join(insert_sorted(kept, added)) + '\n'
+    if content != '\n'.join(lines) + '\n':
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        if exists:
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    return len(added)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's metrics module
+
+This module keeps a local ledger of the gitcher invocations, to watch the
+command latencies on real machines with no external telemetry service. It
+is disabled unless the GITCHER_METRICS environment variable is set.
+
+Every invocation appends one tab separated record with its epoch time,
+command, wall time and profiles parse time (both in milliseconds), store
+size in bytes and number of spawned subprocesses. The ledger is rotated
+when it reaches MAX_LEDGER_SIZE, keeping only the previous one.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Environment variable which enables the ledger
+ENV_VAR = 'GITCHER_METRICS'
+
+# Ledger file name, inside the cache directory
+LEDGER_NAME = 'metrics.log'
+
+# Ledger size which triggers its rotation, in bytes
+MAX_LEDGER_SIZE = 256 * 1024
+
+# Counters of the running invocation
+counters = {'spawns': 0, 'parse': 0.0}
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """Function that checks if the metrics ledger is enabled.
+
+    :return: Confirmation about the ledger enablement
+    :rtype: bool
+    """
+    return os.environ.get(ENV_VAR, '') not in ['', '0']
+
+
+def count_spawn() -> None:
+    """Function that counts a spawned subprocess."""
+    with _lock:
+        counters['spawns'] += 1
+
+
+@contextmanager
+def timed(counter: str):
+    """Context manager that adds its running time, in seconds, to a
+    counter."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            counters[counter] += time.perf_counter() - start
+
+
+def record(path: str, cmd: str, wall: float, store_size: int) -> None:
+    """Function that appends the record of an invocation to the ledger,
+    rotating it if it is full.
+
+    :param path: Ledger path
+    :type path: str
+    :param cmd: Command name
+    :type cmd: str
+    :param wall: Wall time, in seconds
+    :type wall: float
+    :param store_size: Profiles store size, in bytes
+    :type store_size: int
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        if os.path.getsize(path) >= MAX_LEDGER_SIZE:
+            os.replace(path, path + '.1')
+    except FileNotFoundError:
+        pass
+    line = '{0:.0f}\t{1}\t{2:.2f}\t{3:.2f}\t{4}\t{5}\n'.format(
+        time.time(), cmd, wall * 1000, counters['parse'] * 1000, store_size,
+        counters['spawns'])
+    # A single append write, so concurrent invocations do not mix records
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def read_records(path: str):
+    """Generator that yields the records of the ledger, from the oldest,
+    skipping the malformed ones.
+
+    :param path: Ledger path
+    :type path: str
+    :return: Records, as dicts with 'time', 'cmd', 'wall', 'parse',
+        'store_size' and 'spawns' keys
+    :rtype: Iterator[dict]
+    """
+    for ledger in [path + '.1', path]:
+        try:
+            f = open(ledger, 'r')
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                try:
+                    yield {'time': int(fields[0]), 'cmd': fields[1],
+                           'wall': float(fields[2]),
+                           'parse': float(fields[3]),
+                           'store_size': int(fields[4]),
+                           'spawns': int(fields[5])}
+                except (IndexError, ValueError):
+                    continue  # Truncated by a crash
+
+
+def percentile(values: [float], p: float) -> float:
+    """Function that returns a percentile of a sorted list, by the nearest
+    rank method.
+
+    :param values: Sorted values
+    :type values: [float]
+    :param p: Percentile, from 0 to 100
+    :type p: float
+    :return: The percentile value
+    :rtype: float
+    """
+    rank = max(1, -(-len(values) * p // 100))  # Ceil
+    return values[int(rank) - 1]
+
+
+def summarize(records) -> dict:
+    """Function that summarizes the records of the ledger per command.
+
+    The trend compares the median wall time of the newer half of the
+    records with the older half one.
+
+    :param records: Records, as returned by 'read_records'
+    :type records: Iterator[dict]
+    :return: Command name to dict with 'count', 'p50', 'p95', 'p99' (wall
+        times in milliseconds), 'spawns' (mean) and 'trend' (relative
+        change, or None if there are less than four records)
+    :rtype: dict
+    """
+    by_cmd = dict()
+    for rec in records:
+        by_cmd.setdefault(rec['cmd'], []).append(rec)
+
+    summary = dict()
+    for cmd, recs in by_cmd.items():
+        recs.sort(key=lambda rec: rec['time'])
+        walls = sorted(rec['wall'] for rec in recs)
+        trend = None
+        if len(recs) >= 4:
+            half = len(recs) // 2
+            old = percentile(sorted(rec['wall'] for rec in recs[:half]), 50)
+            new = percentile(sorted(rec['wall'] for rec in recs[half:]), 50)
+            if old > 0:
+                trend = (new - old) / old
+        summary[cmd] = {'count': len(recs),
+                        'p50': percentile(walls, 50),
+                        'p95': percentile(walls, 95),
+                        'p99': percentile(walls, 99),
+                        'spawns': sum(rec['spawns'] for rec in recs) /
+                        len(recs),
+                        'trend': trend}
+    return summary
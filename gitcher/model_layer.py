@@ -14,127 +14,491 @@
 """Gitcher's model layer module
 
 This module access and manipulate the 'CHERFILE', isolating this
-operations to the rest of the program.
+operations to the rest of the program. The profiles are kept by the store
+backend in use, see 'prof_store'.
 """
 
 import os
-import subprocess
-import operator
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from os.path import expanduser
 from shutil import which
+from urllib.parse import quote
 
+from gitcher import metrics, repo_resolver
+from gitcher.git_backend import GitBackend, SubprocessGitBackend, \
+    ConfigFileGitBackend, PROF_GIT_KEYS
+from gitcher.git_command_error import GitCommandError
 from gitcher.prof import Prof
-from gitcher.not_found_prof_error import NotFoundProfError
+from gitcher.prof_store import ProfStore, CherfileStore, SqliteStore, \
+    ShardedStore
 
-# Paths
+# Paths. They are read at call time, so they can be patched
 HOME = expanduser('~')
 CHERFILE = HOME + '/.cherfile'
+CHERDB = HOME + '/.cherfile.db'  # Optional SQLite profiles store
+CHERSHARDS = HOME + '/.cherfile.shards'  # Optional sharded profiles store
+CACHE_DIR = HOME + '/.cache/gitcher'
+PROFNAMES_NAME = 'profnames'  # Profile names cache, inside CACHE_DIR
+
+# Default git backend
+GIT_BACKEND = SubprocessGitBackend()
 
 
 # ===============================================
 # =             CHERFILE model layer            =
 # ===============================================
 
-def check_cherfile() -> bool:
+def get_store() -> ProfStore:
+    """Function that returns the gitcher profiles store in use. It is the
+    SQLite database if it exists, the sharded store if it exists, and the
+    flat CHERFILE otherwise.
+
+    :return: The profiles store
+    :rtype: ProfStore
+    """
+    # Fragments stay next to the CHERFILE whatever the store is, because
+    # 	repositories reference them by path
+    fragments_dir = CHERFILE + '.d'
+    if os.path.exists(CHERDB):
+        return SqliteStore(CHERDB, fragments_dir)
+    shards = ShardedStore(CHERSHARDS, fragments_dir)
+    if shards.exists():
+        return shards
+    return CherfileStore(CHERFILE, fragments_dir)
+
+
+def check_cherfile(store: ProfStore = None) -> bool:
     """Function that checks if CHERFILE exists.
 
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
     :return: Confirmation about the existence of CHERFILE
     :rtype: bool
     """
-    return os.path.exists(CHERFILE)
+    return (store or get_store()).exists()
 
 
-def create_cherfile() -> None:
+def create_cherfile(store: ProfStore = None) -> None:
     """Function that creates a CHERFILE.
 
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
     :return: None
     """
-    open(CHERFILE, 'w')
-    with open(CHERFILE, 'a') as f:
-        print("####################\n"
-              "# GITCHER CHERFILE #\n"
-              "####################\n", file=f)
+    (store or get_store()).create()
 
 
-def recuperate_profs() -> [Prof]:
+def recuperate_profs(store: ProfStore = None) -> [Prof]:
     """Function that access CHERFILE and extracts profiles to Prof objects
     list. If there are not gitcher profiles in CHERFILE, returns an empty list.
     This function sorts profiles on alphabetical order looking its profname
     value.
 
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
     :return: A sort list with all gitcher profiles saved
     :rtype: [Prof]
     """
-    profs = list()
-    f = open(CHERFILE, 'r')
-    lines = filter(None, (line.rstrip() for line in f))  # Not empty lines
-    lines = [line for line in lines if not line.startswith('#')]  # Not comment
-    for line in lines:
-        profname = line.split(",")[0]
-        name = line.split(",")[1]
-        email = line.split(",")[2]
-        signkey = line.split(",")[3]
-        signpref = line.split(",")[4].split("\n")[0]
+    with metrics.timed('parse'):
+        return (store or get_store()).recuperate_profs()
 
-        # Type conversions
-        if signkey == "None":
-            signkey = None
-        signpref = (signpref == "True")
 
-        prof = Prof(profname, name, email, signkey, signpref)
-        profs.append(prof)
+def iter_profs(store: ProfStore = None):
+    """Generator that yields every saved profile in storage order, without
+    loading them all at once.
 
-    return sorted(profs, key=operator.attrgetter('profname'))
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: Saved profiles
+    :rtype: Iterator[Prof]
+    """
+    return (store or get_store()).iter_profs()
 
 
-def recuperate_prof(profname: str) -> Prof:
+def recuperate_prof(profname: str, store: ProfStore = None) -> Prof:
     """ Function that return the required gitcher profile. If it does not
     exist, raise a not found exception.
 
     :param profname: Name of the gitcher profile to operate with
     :type profname: str
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
     :return: The required profile
     :rtype: Prof
     :raise: NotFoundProfError
     """
-    profs = recuperate_profs()
-    for prof in profs:
-        if prof.profname == profname:
-            return prof
-
-    raise NotFoundProfError  # If not founds profile and not returns before
+    with metrics.timed('parse'):
+        return (store or get_store()).recuperate_prof(profname)
 
 
-def save_profile(prof: Prof) -> None:
+def save_profile(prof: Prof, store: ProfStore = None) -> None:
     """ Function that saves a new gitcher profile to the CHERFILE.
 
     :param prof: Gitcher profile to save
     :type prof: str
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: None
+    """
+    store = store or get_store()
+    store.save_profile(prof)
+    save_prof_fragment(prof, store)
+    update_profnames_cache([prof.profname], [], store)
+
+
+def save_profiles(profs: [Prof], store: ProfStore = None) -> None:
+    """ Function that saves several new gitcher profiles in a single atomic
+    batch, keeping the saved ones as they are.
+
+    :param profs: Gitcher profiles to save
+    :type profs: [Prof]
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: None
+    """
+    store = store or get_store()
+    store.save_profiles(profs)
+    for prof in profs:
+        save_prof_fragment(prof, store)
+    update_profnames_cache([prof.profname for prof in profs], [], store)
+
+
+def update_profile(profname: str, prof: Prof,
+                   store: ProfStore = None) -> None:
+    """ Function that replaces a gitcher profile of the CHERFILE by a new
+    version of it, which can have another profile name.
+
+    :param profname: Name of the gitcher profile to replace
+    :type profname: str
+    :param prof: New version of the gitcher profile
+    :type prof: Prof
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
     :return: None
     """
-    prof = [prof.profname, prof.name, prof.email, str(prof.signkey),
-            str(prof.signpref)]
-    prof_string = ','.join(prof)
-    with open(CHERFILE, 'a') as f:
-        print(prof_string, file=f)
+    store = store or get_store()
+    store.update_profile(profname, prof)
+    if profname != prof.profname:
+        delete_prof_fragment(profname, store)
+        update_profnames_cache([prof.profname], [profname], store)
+    save_prof_fragment(prof, store)
 
 
-def delete_profile(profname: str) -> None:
+def delete_profile(profname: str, store: ProfStore = None) -> None:
     """ Function that deletes a gitcher profile from the CHERFILE.
 
     :param profname: Name of the gitcher profile to operate with
     :type profname: str
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: None
+    """
+    store = store or get_store()
+    store.delete_profile(profname)
+    delete_prof_fragment(profname, store)
+    update_profnames_cache([], [profname], store)
+
+
+def migrate_store(backend: str) -> int:
+    """Function that moves every saved profile to the selected store
+    backend, which becomes the one in use.
+
+    Migrating to SQLite or to the sharded store keeps the CHERFILE as a
+    backup, and migrating back rewrites the CHERFILE and removes the other
+    stores.
+
+    :param backend: Target backend, 'sqlite', 'shards' or 'cherfile'
+    :type backend: str
+    :return: Number of migrated profiles
+    :rtype: int
+    """
+    profs = recuperate_profs()
+    if backend == 'sqlite':
+        tmp_path = CHERDB + '.tmp'
+        for suffix in ['', '-wal', '-shm']:  # Possible dirty previous try
+            if os.path.exists(tmp_path + suffix):
+                os.remove(tmp_path + suffix)
+        store = SqliteStore(tmp_path, CHERFILE + '.d')
+        store.create()
+        store.replace_profiles(profs)
+        os.replace(tmp_path, CHERDB)  # The store switch is atomic
+    elif backend == 'shards':
+        # The manifest is written the last, so the store switch is atomic
+        ShardedStore(CHERSHARDS, CHERFILE + '.d').replace_profiles(profs)
+        remove_sqlite_store()
+    elif backend == 'cherfile':
+        CherfileStore(CHERFILE, CHERFILE + '.d').replace_profiles(profs)
+        remove_sqlite_store()
+        shutil.rmtree(CHERSHARDS, ignore_errors=True)
+    else:
+        raise ValueError("Unknown store backend '{0}'".format(backend))
+    save_profnames_cache()
+    return len(profs)
+
+
+def remove_sqlite_store() -> None:
+    """Function that removes the SQLite store, if it exists.
+
+    :return: None
+    """
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(CHERDB + suffix):
+            os.remove(CHERDB + suffix)
+
+
+def find_duplicate_profs(profs) -> [[Prof]]:
+    """Function that groups the gitcher profiles with the same identity, in
+    a single pass.
+
+    :param profs: Gitcher profiles
+    :type profs: Iterable[Prof]
+    :return: Groups of more than one profile, each one sorted by profname,
+        sorted by their first profname
+    :rtype: [[Prof]]
+    """
+    groups = dict()  # Identity to profiles
+    for prof in profs:
+        groups.setdefault(prof.identity(), []).append(prof)
+    return sorted((sorted(group, key=lambda prof: prof.profname)
+                   for group in groups.values() if len(group) > 1),
+                  key=lambda group: group[0].profname)
+
+
+def dedupe_profiles(dry_run: bool = False,
+                    store: ProfStore = None) -> [[Prof]]:
+    """Function that merges the saved profiles with the same identity under
+    the first profname of each group, deleting the rest of them from the
+    store in a single atomic batch. Every other line of the store, even
+    comments and malformed ones, is kept, and the malformed ones are
+    reported as 'MalformedLineWarning' by the read.
+
+    Repositories may include the config fragments of the merged profiles,
+    so each of them which exists is rewritten to include the fragment of
+    the kept profile, and follows its later changes.
+
+    :param dry_run: Only find the groups, with no write
+    :type dry_run: bool
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: Groups of duplicated profiles, as returned by
+        'find_duplicate_profs'. The first profile of each one is kept
+    :rtype: [[Prof]]
+    """
+    store = store or get_store()
+    with metrics.timed('parse'):
+        profs = list(store.iter_profs())
+    groups = find_duplicate_profs(profs)
+    if not dry_run and groups:
+        merged = [prof.profname for group in groups for prof in group[1:]]
+        store.delete_profiles(merged)
+        for group in groups:
+            for prof in group[1:]:
+                redirect_prof_fragment(prof.profname, group[0], store)
+        update_profnames_cache([], merged, store)
+    return groups
+
+
+def profnames_cache_path() -> str:
+    """Function that returns the path of the profile names cache.
+
+    :return: Cache path
+    :rtype: str
+    """
+    return os.path.join(CACHE_DIR, PROFNAMES_NAME)
+
+
+def save_profnames_cache(store: ProfStore = None) -> None:
+    """Function that writes the sorted names of the saved profiles to a
+    plain text cache, one per line, for the shell completions, which read
+    it with no need to start gitcher. It reads the whole store, so single
+    profile changes use 'update_profnames_cache' instead. The file is
+    replaced atomically, so a completion never reads a half written cache.
+    Cache errors never break the order.
+
+    :param store: Profiles store to operate with. None to use the default.
+        Other stores than the user ones (e.g.: embedders' ones) are not
+        cached
+    :type store: ProfStore
+    :return: None
+    """
+    store = store or get_store()
+    if store.path not in [CHERFILE, CHERDB, CHERSHARDS]:
+        return
+    try:
+        profnames = sorted(prof.profname for prof in store.iter_profs())
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(''.join(profname + '\n' for profname in profnames))
+        os.replace(tmp_path, profnames_cache_path())
+    except OSError:
+        pass
+
+
+def update_profnames_cache(added: [str], removed: [str],
+                           store: ProfStore = None) -> None:
+    """Function that updates the profile names cache with some added and
+    removed names, with no store read, so its cost does not depend on the
+    number of saved profiles. Added names are appended, and removed ones
+    are filtered out on a streaming copy of the cache, which replaces it
+    atomically. If there is no cache, it is built whole, as
+    'save_profnames_cache' does. Cache errors never break the order.
+
+    :param added: Names of the saved gitcher profiles
+    :type added: [str]
+    :param removed: Names of the deleted gitcher profiles
+    :type removed: [str]
+    :param store: Profiles store to operate with. None to use the default.
+        Other stores than the user ones are not cached
+    :type store: ProfStore
+    :return: None
+    """
+    store = store or get_store()
+    if store.path not in [CHERFILE, CHERDB, CHERSHARDS]:
+        return
+    path = profnames_cache_path()
+    lines = ''.join(profname + '\n' for profname in added)
+    try:
+        if removed:
+            removed = set(removed)
+            with open(path, 'r') as src:
+                fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.tmp')
+                with os.fdopen(fd, 'w') as dst:
+                    for line in src:
+                        if line.rstrip('\n') not in removed:
+                            dst.write(line)
+                    dst.write(lines)
+            os.replace(tmp_path, path)
+        elif lines:
+            # A single append write, so concurrent orders do not mix lines
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, lines.encode('utf-8'))
+            finally:
+                os.close(fd)
+    except FileNotFoundError:
+        save_profnames_cache(store)
+    except OSError:
+        pass
+
+
+# ===============================================
+# =        Profile config fragments layer       =
+# ===============================================
+
+def fragment_path(profname: str, store: ProfStore = None) -> str:
+    """Function that returns the path of the rendered git config fragment
+    of a gitcher profile.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: Path of the profile fragment
+    :rtype: str
+    """
+    return os.path.join((store or get_store()).fragments_dir,
+                        quote(profname, safe='') + '.gitconfig')
+
+
+def render_prof_fragment(prof: Prof) -> str:
+    """Function that renders a gitcher profile as a git config fragment,
+    ready to be referenced by an 'include.path' key.
+
+    :param prof: Gitcher profile to render
+    :type prof: Prof
+    :return: Rendered git config fragment
+    :rtype: str
+    """
+    def quote_value(value: str) -> str:
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    lines = ["# Generated by gitcher from profile '{0}'. Do not edit."
+             .format(prof.profname),
+             "[user]",
+             "\tname = " + quote_value(prof.name),
+             "\temail = " + quote_value(prof.email)]
+    if prof.signkey is not None:
+        lines.append("\tsigningkey = " + quote_value(prof.signkey))
+    lines.append("[commit]")
+    lines.append("\tgpgsign = " + str(prof.signpref).lower())
+    return '\n'.join(lines) + '\n'
+
+
+def save_prof_fragment(prof: Prof, store: ProfStore = None) -> str:
+    """Function that writes the git config fragment of a gitcher profile.
+    The file is only rewritten if its content changes, and it is replaced
+    atomically, so git never reads a half written fragment.
+
+    :param prof: Gitcher profile to render
+    :type prof: Prof
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: Path of the profile fragment
+    :rtype: str
+    """
+    store = store or get_store()
+    path = fragment_path(prof.profname, store)
+    content = render_prof_fragment(prof)
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return path
+    except FileNotFoundError:
+        os.makedirs(store.fragments_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=store.fragments_dir, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+def redirect_prof_fragment(profname: str, prof: Prof,
+                           store: ProfStore = None) -> None:
+    """Function that rewrites the git config fragment of a gitcher profile,
+    if it exists, to include the fragment of another one, so the
+    configurations which include it follow that other profile.
+
+    :param profname: Name of the gitcher profile whose fragment to rewrite
+    :type profname: str
+    :param prof: Gitcher profile to include
+    :type prof: Prof
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :return: None
+    """
+    store = store or get_store()
+    path = fragment_path(profname, store)
+    if not os.path.exists(path):
+        return
+    target = save_prof_fragment(prof, store)
+    fd, tmp_path = tempfile.mkstemp(dir=store.fragments_dir, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write("# Generated by gitcher from profile '{0}', merged into "
+                "'{1}'. Do not edit.\n[include]\n\tpath = {2}\n".format(
+                    profname, prof.profname,
+                    os.path.basename(target)))  # Relative to this one
+    os.replace(tmp_path, path)
+
+
+def delete_prof_fragment(profname: str, store: ProfStore = None) -> None:
+    """Function that deletes the git config fragment of a gitcher profile,
+    if it exists.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
     :return: None
     """
-    f = open(CHERFILE, 'r+')  # Read and write mode
-    lines = f.readlines()
-    lines = [line.strip('\n') for line in lines]
-    f.seek(0)  # Return to the start of the file
-    for line in lines:
-        if line.split(',')[0] != profname:
-            print(line, file=f)
-    f.truncate()  # Delete possible dirty lines below
-    f.close()
+    try:
+        os.remove(fragment_path(profname, store))
+    except FileNotFoundError:
+        pass
 
 
 # ===============================================
@@ -151,19 +515,155 @@ def check_git_installed() -> bool:
 
 
 def check_git_context() -> bool:
-    """Function that checks if the current directory have a git repository.
+    """Function that checks if the current directory is inside a git
+    repository, a linked worktree or a submodule.
 
     :return: Confirmation about the presence of a git repository in the
         current directory
-    :rtype: bool    """
-    cwd = os.getcwd()
-    return os.path.exists(cwd + "/.git")
+    :rtype: bool
+    """
+    return find_repo_root() is not None
+
+
+def find_repo_root(path: str = None) -> str:
+    """Function that finds the working tree root of the repository which
+    contains a path, in process and with cache, see 'repo_resolver'.
+
+    :param path: Path to look from. None to use the current working
+        directory
+    :type path: str
+    :return: The working tree root, the git directory for bare
+        repositories, or None if the path is not inside a repository
+    :rtype: str
+    """
+    location = repo_resolver.resolve(path)
+    if location is None:
+        return None
+    return location.git_dir if location.bare else location.worktree
+
+
+def repo_configs(path: str = None) -> [(str, str, str)]:
+    """Function that discovers every git configuration which sets the
+    identity of a repository: its own one, the ones of its submodules,
+    nested at any depth and initialized or not (on '.git/modules'), and,
+    if 'extensions.worktreeConfig' is enabled, the ones of its worktrees.
+
+    :param path: Repository path, or a path inside it. None to use the
+        current working directory
+    :type path: str
+    :return: Triplets of label, repository path and scope flag, as the git
+        backends receive them
+    :rtype: [(str, str, str)]
+    :raise GitCommandError: If the path is not inside a repository
+    """
+    root = find_repo_root(path) or os.path.abspath(path or os.getcwd())
+    git_dir, common_dir = ConfigFileGitBackend.git_dirs(root)
+    configs = [('.', root, '')]
+
+    git_dirs = [common_dir]
+    worktrees_dir = os.path.join(common_dir, 'worktrees')
+    worktrees = sorted(os.listdir(worktrees_dir)) \
+        if os.path.isdir(worktrees_dir) else []
+    if ConfigFileGitBackend().worktree_config_path(root):
+        configs.append(('worktree ' + os.path.dirname(common_dir), root,
+                        '--file=' + os.path.join(common_dir,
+                                                 'config.worktree')))
+        for name in worktrees:
+            wt_git_dir = os.path.join(worktrees_dir, name)
+            try:
+                with open(os.path.join(wt_git_dir, 'gitdir'), 'r') as f:
+                    wt_path = os.path.dirname(f.read().strip())
+            except FileNotFoundError:
+                continue
+            configs.append(('worktree ' + wt_path, root,
+                            '--file=' + os.path.join(wt_git_dir,
+                                                     'config.worktree')))
+    git_dirs += [os.path.join(worktrees_dir, name) for name in worktrees]
+
+    # Submodule git directories, which can be nested
+    pending = [(os.path.join(d, 'modules'), '') for d in git_dirs]
+    while pending:
+        modules_dir, prefix = pending.pop()
+        try:
+            entries = sorted(os.scandir(modules_dir), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            name = prefix + entry.name
+            if os.path.isfile(os.path.join(entry.path, 'HEAD')) and \
+                    os.path.isfile(os.path.join(entry.path, 'config')):
+                configs.append(('submodule ' + name, root, '--file=' +
+                                os.path.join(entry.path, 'config')))
+                pending.append((os.path.join(entry.path, 'modules'),
+                                name + '/'))
+            else:  # Submodule names can have slashes
+                pending.append((entry.path, name + '/'))
+    return configs
+
+
+def read_git_config(path: str = None, flag: str = '',
+                    backend: GitBackend = None) -> dict:
+    """Function that reads the gitcher profile keys of a git configuration,
+    all of them at once.
+
+    :param path: Path to read git configuration from. None to use the
+        current working directory
+    :type path: str
+    :param flag: Scope of the configuration to read (e.g.: '--local' or
+        '--global'). Empty to read the applicable configuration
+    :type flag: str
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: Set keys, as 'PROF_GIT_KEYS', with their values
+    :rtype: dict
+    """
+    if path is None:
+        path = os.getcwd()
+    return (backend or GIT_BACKEND).read_config(path, flag)
+
+
+def plan_switch(prof: Prof, config: dict,
+                gitcher_includes: bool = False) -> [(str, str)]:
+    """Function that computes the minimal git configuration changes to
+    switch to a gitcher profile.
+
+    :param prof: Gitcher profile to switch to
+    :type prof: Prof
+    :param config: Current git configuration, as returned by
+        'read_git_config'
+    :type config: dict
+    :param gitcher_includes: The configuration includes profile fragments,
+        which would override the written keys, so they are removed
+    :type gitcher_includes: bool
+    :return: Pairs of key and new value, with None as value for the keys to
+        unset, and ('include.path', None) to remove the profile fragment
+        includes. Empty if the configuration yet matches the profile
+    :rtype: [(str, str)]
+    """
+    # Is necessary to set gpgsign even preference is false because
+    # 	it would be necessary overwrite git global criteria.
+    wanted = [('user.name', prof.name), ('user.email', prof.email),
+              ('user.signingkey', prof.signkey),
+              ('commit.gpgsign', str(prof.signpref).lower())]
+    changes = [(key, value) for key, value in wanted
+               if config.get(key) != value]
+    if gitcher_includes:
+        changes.append(('include.path', None))
+    return changes
 
 
 # noinspection PyShadowingNames
-def switch_prof(profname: str, path: str = None, flag: str = '') -> None:
+def switch_prof(profname: str, path: str = None, flag: str = '',
+                dry_run: bool = False, store: ProfStore = None,
+                backend: GitBackend = None) -> [(str, str)]:
     """Function that plays the git profile switching.
 
+    The current configuration of the switched scope is read first, and only
+    the keys which differ are written, so switching to the profile in use
+    does not rewrite the git configuration file.
+
     This function can receive a '--global' flag to switch profile globally.
 
     :param profname: Name of the gitcher profile to operate with
@@ -172,41 +672,137 @@ def switch_prof(profname: str, path: str = None, flag: str = '') -> None:
     :type path: str
     :param flag: With '--global' flag switch profile globally
     :type flag: str
-    :return: None
+    :param dry_run: Only compute the changes, without applying them
+    :type dry_run: bool
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: The planned changes, as returned by 'plan_switch'
+    :rtype: [(str, str)]
+    :raise GitCommandError: If the git configuration can not be written
     """
-    if not path:
-        path = os.getcwd()  #  Current working directory path
-    prof = recuperate_prof(profname)
+    store = store or get_store()
+    return apply_prof(recuperate_prof(profname, store), path, flag, dry_run,
+                      backend, store)
 
-    go_to_cwd = "cd '{0}' && ".format(path)
-    if flag == '--global':
-        go_to_cwd = ""
 
-    cmd = "{0}git config {1} user.name '{2}'".format(go_to_cwd, flag,
-                                                     prof.name)
-    os.system(cmd)
+# noinspection PyShadowingNames
+def apply_prof(prof: Prof, path: str = None, flag: str = '',
+               dry_run: bool = False, backend: GitBackend = None,
+               store: ProfStore = None) -> [(str, str)]:
+    """Function that writes a gitcher profile into a git configuration,
+    only changing the keys which differ. It is the 'switch_prof' work once
+    the profile is recuperated.
+
+    :param prof: Gitcher profile to apply
+    :type prof: Prof
+    :param path: The optional specified repository path
+    :type path: str
+    :param flag: With '--global' flag switch profile globally
+    :type flag: str
+    :param dry_run: Only compute the changes, without applying them
+    :type dry_run: bool
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :param store: Profiles store which owns the fragments. None to use the
+        default
+    :type store: ProfStore
+    :return: The planned changes, as returned by 'plan_switch'
+    :rtype: [(str, str)]
+    :raise GitCommandError: If the git configuration can not be written
+    """
+    if not path:
+        path = os.getcwd()  # Current working directory path
+    backend = backend or GIT_BACKEND
+    store = store or get_store()
+
+    # The scope is read with no include followed, because a profile
+    # 	fragment include overrides the keys which are written
+    config, includes = backend.read_scope(path, flag or '--local')
+    regex = fragments_regex(store)
+    changes = plan_switch(prof, config, any(re.search(regex, include)
+                                            for include in includes))
+    if not dry_run:
+        write_changes(path, flag, changes, backend, store)
+    return changes
+
+
+def write_changes(path: str, flag: str, changes: [(str, str)],
+                  backend: GitBackend = None,
+                  store: ProfStore = None) -> None:
+    """Function that writes a list of git configuration changes.
+
+    :param path: Repository path
+    :type path: str
+    :param flag: Scope of the configuration to write
+    :type flag: str
+    :param changes: Pairs of key and new value, with None as value for the
+        keys to unset, as returned by 'plan_switch'
+    :type changes: [(str, str)]
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :param store: Profiles store which owns the fragments, whose includes
+        are removed. None to use the default
+    :type store: ProfStore
+    :return: None
+    :raise GitCommandError: If the git configuration can not be written
+    """
+    backend = backend or GIT_BACKEND
+    for key, value in changes:
+        if key == 'include.path':  # Only the profile fragment includes
+            backend.unset_config(path, flag, key,
+                                 fragments_regex(store or get_store()))
+        elif value is None:
+            backend.unset_config(path, flag, key)
+        else:
+            backend.set_config(path, flag, key, value)
+
+
+def switch_prof_recursive(profname: str, path: str = None,
+                          dry_run: bool = False, workers: int = 8,
+                          store: ProfStore = None,
+                          backend: GitBackend = None) -> [tuple]:
+    """Function that switches a repository, its submodules and its worktrees
+    configurations, as found by 'repo_configs', in a worker pool.
 
-    cmd = "{0}git config {1} user.email {2}".format(go_to_cwd, flag,
-                                                    prof.email)
-    os.system(cmd)
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param path: The optional specified repository path
+    :type path: str
+    :param dry_run: Only compute the changes, without applying them
+    :type dry_run: bool
+    :param workers: Number of configurations switched at the same time
+    :type workers: int
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: Pairs of label and result per configuration, in discovery
+        order. The result is the planned changes, as returned by
+        'plan_switch', or the raised GitCommandError
+    :rtype: [(str, [(str, str)] or GitCommandError)]
+    :raise: NotFoundProfError
+    :raise GitCommandError: If the path is not inside a repository
+    """
+    store = store or get_store()
+    prof = recuperate_prof(profname, store)
+    configs = repo_configs(path)
 
-    if prof.signkey is not None:
-        cmd = "{0}git config {1} user.signingkey {2}". \
-            format(go_to_cwd, flag, prof.signkey)
-        os.system(cmd)
-    else:
-        cmd = "{0}git config {1} --unset user.signingkey". \
-            format(go_to_cwd, flag)
-        os.system(cmd)
+    def switch(config: (str, str, str)):
+        _, repo_path, flag = config
+        try:
+            return apply_prof(prof, repo_path, flag, dry_run, backend, store)
+        except GitCommandError as e:
+            return e
 
-    # Is necessary to run next command even preference is false because
-    # 	it would be necessary overwrite git global criteria.
-    cmd = "{0}git config {1} commit.gpgsign {2}". \
-        format(go_to_cwd, flag, str(prof.signpref).lower())
-    os.system(cmd)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(zip([label for label, _, _ in configs],
+                        pool.map(switch, configs)))
 
 
-def recuperate_git_current_prof(path: str = None) -> Prof:
+def recuperate_git_current_prof(path: str = None, flag: str = '',
+                                backend: GitBackend = None) -> Prof:
     """Function that recuperates the applicable git configuration of the
     param passed path and builds with this data a gitcher Prof. If param
     passed is None, then use the current working directory to evaluate it.
@@ -216,36 +812,30 @@ def recuperate_git_current_prof(path: str = None) -> Prof:
 
     :param path: Path to recuperates git user configuration
     :type path: str
+    :param flag: Scope of the configuration to read (e.g.: '--local').
+        Empty to read the applicable configuration
+    :type flag: str
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
     :return: Rebuilt git profile as gitcher Prof object
     :rtype: Prof
     """
-    if path is None:
-        path = os.getcwd()
-    go_to_path = "cd '{0}' && ".format(path)
-
-    with subprocess.Popen(go_to_path + "git config user.name",
-                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                          shell=True) as p:
-        output, errors = p.communicate()
-    name = output.decode('utf-8').split("\n")[0]
-
-    with subprocess.Popen(go_to_path + "git config user.email",
-                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                          shell=True) as p:
-        output, errors = p.communicate()
-    email = output.decode('utf-8').split("\n")[0]
-
-    with subprocess.Popen(go_to_path + "git config user.signingKey",
-                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                          shell=True) as p:
-        output, errors = p.communicate()
-    signkey = output.decode('utf-8').split("\n")[0]
-
-    with subprocess.Popen(go_to_path + "git config commit.gpgsign",
-                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                          shell=True) as p:
-        output, errors = p.communicate()
-    signpref = output.decode('utf-8').split("\n")[0]
+    return prof_from_git_config(read_git_config(path, flag, backend))
+
+
+def prof_from_git_config(config: dict) -> Prof:
+    """Function that builds a gitcher Prof with the values of a git
+    configuration.
+
+    :param config: Git configuration, as returned by 'read_git_config'
+    :type config: dict
+    :return: Rebuilt git profile as gitcher Prof object
+    :rtype: Prof
+    """
+    name = config.get('user.name', '')
+    email = config.get('user.email', '')
+    signkey = config.get('user.signingkey')
+    signpref = config.get('commit.gpgsign', '')
 
     # Validations
     if signkey == "":
@@ -257,3 +847,128 @@ def recuperate_git_current_prof(path: str = None) -> Prof:
         signpref = False
 
     return Prof('tmp', name, email, signkey, signpref)
+
+
+# noinspection PyShadowingNames
+def include_prof(profname: str, path: str = None, flag: str = '',
+                 store: ProfStore = None,
+                 backend: GitBackend = None) -> None:
+    """Function that plays the git profile switching through a single
+    'include.path' key pointing to the rendered profile fragment.
+
+    Unlike 'switch_prof', the repository does not keep a copy of the profile
+    values, so later profile updates reach it with no need of switching it
+    again. Only previous gitcher includes are replaced; other user includes
+    are kept.
+
+    This function can receive a '--global' flag to switch profile globally.
+
+    :param profname: Name of the gitcher profile to operate with
+    :type profname: str
+    :param path: The optional specified repository path
+    :type path: str
+    :param flag: With '--global' flag switch profile globally
+    :type flag: str
+    :param store: Profiles store to operate with. None to use the default
+    :type store: ProfStore
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: None
+    :raise GitCommandError: If the git configuration can not be written
+    """
+    store = store or get_store()
+    apply_prof_include(recuperate_prof(profname, store), path, flag, store,
+                       backend)
+
+
+# noinspection PyShadowingNames
+def apply_prof_include(prof: Prof, path: str = None, flag: str = '',
+                       store: ProfStore = None,
+                       backend: GitBackend = None) -> None:
+    """Function that points a git configuration to the rendered fragment of
+    a gitcher profile. It is the 'include_prof' work once the profile is
+    recuperated.
+
+    :param prof: Gitcher profile to apply
+    :type prof: Prof
+    :param path: The optional specified repository path
+    :type path: str
+    :param flag: With '--global' flag switch profile globally
+    :type flag: str
+    :param store: Profiles store which owns the fragments. None to use the
+        default
+    :type store: ProfStore
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: None
+    :raise GitCommandError: If the git configuration can not be written
+    """
+    if not path:
+        path = os.getcwd()  # Current working directory path
+    store = store or get_store()
+    backend = backend or GIT_BACKEND
+    fragment = save_prof_fragment(prof, store)  # Refresh it if edited
+
+    backend.replace_all(path, flag, 'include.path', fragment,
+                        fragments_regex(store))
+    # The keys set in the configuration itself would override the included
+    # 	ones, as the include section can be before them
+    config, _ = backend.read_scope(path, flag or '--local')
+    for key in PROF_GIT_KEYS:
+        if key in config:
+            backend.unset_config(path, flag, key)
+
+
+def fragments_regex(store: ProfStore = None) -> str:
+    """Function that returns the extended regular expression which matches
+    the include paths of the profile fragments of a store.
+
+    :param store: Profiles store which owns the fragments. None to use the
+        default
+    :type store: ProfStore
+    :return: Extended regular expression, escaping the fragments directory
+    :rtype: str
+    """
+    return '^' + ''.join('\\' + c if c in '.^$*+?{}[]\\|()' else c
+                         for c in (store or get_store()).fragments_dir +
+                         os.sep)
+
+
+def prof_env(prof: Prof, environ: dict = None) -> dict:
+    """Function that returns the environment variables which apply a
+    gitcher profile to the git commands run with them, with no git
+    configuration write: the author and committer identity variables and
+    the profile keys as 'GIT_CONFIG_COUNT' / 'GIT_CONFIG_KEY_<n>' /
+    'GIT_CONFIG_VALUE_<n>' entries (git >= 2.31), appended to the entries
+    of the base environment, if any.
+
+    So any number of concurrent processes can run with different profiles
+    with no lock contention.
+
+    :param prof: Gitcher profile to apply
+    :type prof: Prof
+    :param environ: Base environment. None to use the process one
+    :type environ: dict
+    :return: Environment variables to add to the base environment
+    :rtype: dict
+    """
+    environ = os.environ if environ is None else environ
+    env = {'GIT_AUTHOR_NAME': prof.name, 'GIT_AUTHOR_EMAIL': prof.email,
+           'GIT_COMMITTER_NAME': prof.name, 'GIT_COMMITTER_EMAIL': prof.email}
+
+    # An unset sign key can not be unset through the environment, but
+    # 	it is not used with the sign preference overwritten to false
+    entries = [('user.name', prof.name), ('user.email', prof.email),
+               ('commit.gpgsign', str(prof.signpref).lower())]
+    if prof.signkey is not None:
+        entries.append(('user.signingkey', prof.signkey))
+    try:
+        count = int(environ.get('GIT_CONFIG_COUNT', 0))
+    except ValueError:
+        count = 0
+    for key, value in entries:
+        env['GIT_CONFIG_KEY_{0}'.format(count)] = key
+        env['GIT_CONFIG_VALUE_{0}'.format(count)] = value
+        count += 1
+    env['GIT_CONFIG_COUNT'] = str(count)
+    return env
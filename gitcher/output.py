@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's machine output module
+
+This module writes the results of the read orders for other programs, as
+NDJSON (a JSON object per line), a JSON array or TSV (with a header line).
+Records are written as they come, so long listings run in constant memory.
+
+The fields of each kind of record are stable, and new fields are only
+added at the end. TSV values escape backslashes, tabs and newlines, and
+write null values as empty strings.
+"""
+
+import json
+import sys
+
+from gitcher.prof import Prof
+
+FORMATS = ['ndjson', 'json', 'tsv']
+
+# Records fields
+PROF_FIELDS = ['profname', 'name', 'email', 'signkey', 'signpref',
+               'current', 'saved']
+HISTORY_FIELDS = ['path', 'status', 'name', 'email', 'commits', 'profnames',
+                  'error']
+DOCTOR_FIELDS = ['profname', 'signkey', 'problems']
+REPO_FIELDS = ['path', 'profname']
+STATS_FIELDS = ['cmd', 'count', 'p50', 'p95', 'p99', 'spawns', 'trend']
+
+
+def prof_record(prof: Prof, current: bool, saved: bool = True) -> dict:
+    """Function that returns the record of a gitcher profile.
+
+    :param prof: Gitcher profile
+    :type prof: Prof
+    :param current: The profile is the one in use
+    :type current: bool
+    :param saved: The profile is saved. Unsaved ones have null profname
+    :type saved: bool
+    :return: Record with PROF_FIELDS
+    :rtype: dict
+    """
+    return {'profname': prof.profname if saved else None,
+            'name': prof.name, 'email': prof.email, 'signkey': prof.signkey,
+            'signpref': bool(prof.signpref), 'current': current,
+            'saved': saved}
+
+
+def _tsv_value(value) -> str:
+    """Function that formats a TSV value."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (list, tuple)):
+        value = ','.join(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n')
+
+
+class RecordWriter(object):
+    """Class that represents a machine output stream of records."""
+
+    def __init__(self, fmt: str, fields: [str], stream=None):
+        """Record writer constructor.
+
+        :param fmt: Output format, one of FORMATS
+        :type fmt: str
+        :param fields: Record fields, in output order
+        :type fields: [str]
+        :param stream: Output stream. None to use the standard output
+        :type stream: file
+        """
+        if fmt not in FORMATS:
+            raise ValueError("Unknown output format: " + str(fmt))
+        self.fmt = fmt
+        self.fields = fields
+        self.stream = stream or sys.stdout
+        self.count = 0
+        if fmt == 'tsv':
+            self.stream.write('\t'.join(fields) + '\n')
+        elif fmt == 'json':
+            self.stream.write('[')
+
+    def write(self, record: dict) -> None:
+        """Function that writes a record.
+
+        :param record: Record, with every writer field
+        :type record: dict
+        :return: None
+        """
+        if self.fmt == 'tsv':
+            line = '\t'.join(_tsv_value(record[field])
+                             for field in self.fields)
+        else:
+            line = json.dumps({field: record[field] for field in self.fields},
+                              ensure_ascii=False)
+            if self.fmt == 'json':
+                line = ('\n' if self.count == 0 else ',\n') + line
+        self.stream.write(line if self.fmt == 'json' else line + '\n')
+        self.count += 1
+
+    def close(self) -> None:
+        """Function that ends the output.
+
+        :return: None
+        """
+        if self.fmt == 'json':
+            self.stream.write('\n]\n' if self.count else ']\n')
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
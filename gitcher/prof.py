@@ -71,6 +71,14 @@ class Prof(object):
 
         return self.profname, self.name, self.email, signkey_str, signpref_str
 
+    def identity(self):
+        """This function return the canonical identity tuple of the profile,
+        without its name: profiles with the same one sign commits the same
+        way. Surrounding whitespace is ignored, and email case too."""
+        return (self.name.strip(), self.email.strip().lower(),
+                None if self.signkey is None else self.signkey.strip(),
+                bool(self.signpref))
+
     def __hash__(self):
         return hash((self.name + self.email + str(self.signkey) +
                      str(self.signpref)))
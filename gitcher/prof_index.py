@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's profile index class module
+
+This module contains the class that represents a set of secondary indexes
+over the gitcher profiles, to answer search queries without looping over
+every profile. The indexes are the columns of a SQLite table, in memory or
+persisted on 'model_layer.CACHE_DIR' until the profiles store changes, so a
+search does not need to parse the store nor to build the indexes again.
+
+A query is composed by space separated terms, and a profile has to match all
+of them. Each term is 'field:pattern', where the pattern can use shell
+wildcards, or 'field~text', to look for a case insensitive substring. Valid
+fields are 'profname', 'name', 'email', 'key' and 'signpref'. E.g.:
+'email:*@corp.com key:ABCD* name~jane signpref:true'.
+"""
+
+import os
+import sqlite3
+from fnmatch import fnmatchcase
+
+from gitcher import model_layer
+from gitcher.prof import Prof
+from gitcher.prof_store import ProfStore
+
+FIELDS = ['profname', 'name', 'email', 'key', 'signpref']
+WILDCARDS = '*?['
+INDEX_NAME = 'profs.idx'  # Persisted index, inside 'model_layer.CACHE_DIR'
+
+
+class ProfIndex(object):
+    """Class that represents the secondary indexes over a set of gitcher
+    profiles."""
+
+    SCHEMA = ["CREATE TABLE IF NOT EXISTS profs ("
+              "profname TEXT PRIMARY KEY, name TEXT NOT NULL, "
+              "email TEXT NOT NULL, signkey TEXT, "
+              "signpref INTEGER NOT NULL, lower_name TEXT NOT NULL, "
+              "lower_email TEXT NOT NULL, domain TEXT NOT NULL, "
+              "upper_key TEXT)",
+              "CREATE INDEX IF NOT EXISTS profs_name ON profs (lower_name)",
+              "CREATE INDEX IF NOT EXISTS profs_email ON profs (lower_email)",
+              "CREATE INDEX IF NOT EXISTS profs_domain ON profs (domain)",
+              "CREATE INDEX IF NOT EXISTS profs_key ON profs (upper_key)",
+              "CREATE INDEX IF NOT EXISTS profs_signpref ON profs "
+              "(signpref)",
+              "CREATE TABLE IF NOT EXISTS stamp (stamp TEXT)"]
+
+    def __init__(self, profs=None, path: str = ':memory:'):
+        """Profile index constructor.
+
+        :param profs: Gitcher profiles to index. None to keep the indexed
+            ones
+        :type profs: Iterable[Prof]
+        :param path: Database path. ':memory:' to not persist the index
+        :type path: str
+        """
+        self.conn = sqlite3.connect(path, timeout=10)
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+        if profs is not None:
+            self.replace(profs)
+
+    def replace(self, profs, stamp: str = None) -> None:
+        """Function that replaces atomically every indexed profile by the
+        passed ones.
+
+        :param profs: Gitcher profiles to index
+        :type profs: Iterable[Prof]
+        :param stamp: State of the indexed store, see 'stamp'
+        :type stamp: str
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM profs")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO profs VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((prof.profname, prof.name, prof.email, prof.signkey,
+                  int(bool(prof.signpref)), prof.name.lower(),
+                  prof.email.lower(), prof.email.lower().rpartition('@')[2],
+                  None if prof.signkey is None else prof.signkey.upper())
+                 for prof in profs))
+            self.conn.execute("DELETE FROM stamp")
+            self.conn.execute("INSERT INTO stamp VALUES (?)", (stamp,))
+
+    def stamp(self) -> str:
+        """Function that returns the state of the indexed store when it was
+        indexed.
+
+        :return: Store state, as passed to 'replace'
+        :rtype: str
+        """
+        row = self.conn.execute("SELECT stamp FROM stamp").fetchone()
+        return None if row is None else row[0]
+
+    def close(self) -> None:
+        """Function that closes the index database.
+
+        :return: None
+        """
+        self.conn.close()
+
+    # ===============================================
+    # =                   Queries                   =
+    # ===============================================
+
+    @staticmethod
+    def parse_term(term: str) -> (str, str, str):
+        """Function that splits a query term into its field, operator and
+        pattern.
+
+        :param term: Query term
+        :type term: str
+        :return: Field, operator (':' or '~') and pattern
+        :rtype: (str, str, str)
+        :raise ValueError: If the term is malformed
+        """
+        cut = min((i for i in [term.find(':'), term.find('~')] if i > 0),
+                  default=-1)
+        if cut < 0 or term[:cut] not in FIELDS or not term[cut + 1:]:
+            raise ValueError("Invalid query term '{0}'".format(term))
+        field, op, pattern = term[:cut], term[cut], term[cut + 1:]
+        if field == 'signpref' and (op != ':' or
+                                    pattern.lower() not in ['true',
+                                                            'false']):
+            raise ValueError("Invalid query term '{0}'".format(term))
+        return field, op, pattern
+
+    @staticmethod
+    def match(prof: Prof, field: str, op: str, pattern: str) -> bool:
+        """Function that checks if a gitcher profile matches a query term.
+
+        :param prof: Gitcher profile to check
+        :type prof: Prof
+        :param field: Term field
+        :type field: str
+        :param op: Term operator, ':' or '~'
+        :type op: str
+        :param pattern: Term pattern
+        :type pattern: str
+        :return: True if the profile matches the term
+        :rtype: bool
+        """
+        if field == 'signpref':
+            return bool(prof.signpref) == (pattern.lower() == 'true')
+        if field == 'key':
+            if prof.signkey is None:
+                return False
+            value, pattern = prof.signkey.upper(), pattern.upper()
+        elif field == 'email':
+            value, pattern = prof.email.lower(), pattern.lower()
+        elif field == 'name':
+            value, pattern = prof.name.lower(), pattern.lower()
+        else:  # Profile names are case sensitive on glob patterns
+            value = prof.profname
+        if op == '~':
+            return pattern.lower() in value.lower()
+        return fnmatchcase(value, pattern)
+
+    @staticmethod
+    def condition(field: str, op: str, pattern: str) -> (str, tuple):
+        """Function that returns the SQL condition which selects, through
+        the indexes, the candidate profiles of a query term: a superset of
+        the profiles which match it.
+
+        :param field: Term field
+        :type field: str
+        :param op: Term operator, ':' or '~'
+        :type op: str
+        :param pattern: Term pattern
+        :type pattern: str
+        :return: SQL condition and its parameters, or None if the term can
+            not be answered by the indexes
+        :rtype: (str, tuple)
+        """
+        if field == 'signpref':
+            return "signpref = ?", (int(pattern.lower() == 'true'),)
+        if op == '~':  # Substrings are not indexed
+            return None
+
+        # Glob patterns. Literal prefixes go through the sorted indexes
+        literal = pattern
+        for i, c in enumerate(pattern):
+            if c in WILDCARDS:
+                literal = pattern[:i]
+                break
+        if field == 'email':
+            if literal == pattern:
+                return "lower_email = ?", (pattern.lower(),)
+            if pattern.startswith('*@') and \
+                    not any(c in WILDCARDS for c in pattern[2:]):
+                return "domain = ?", (pattern[2:].lower(),)
+            column, literal = 'lower_email', literal.lower()
+        elif field == 'key':
+            column, literal = 'upper_key', literal.upper()
+        elif field == 'name':
+            column, literal = 'lower_name', literal.lower()
+        else:
+            column = 'profname'
+        if not literal:
+            return None
+        return ("{0} >= ? AND {0} < ?".format(column),
+                (literal, literal + '\U0010ffff'))
+
+    def search(self, query: str):
+        """Generator that yields the profiles which match every term of a
+        query, as they are found.
+
+        The term with the fewest candidates is answered by the indexes, and
+        its candidates are checked against every term as they are read.
+
+        :param query: Space separated query terms
+        :type query: str
+        :return: Matching profiles, sorted by profname
+        :rtype: Iterator[Prof]
+        :raise ValueError: If some query term is malformed
+        """
+        terms = [self.parse_term(term) for term in query.split()]
+        if not terms:
+            raise ValueError("Empty query")
+        best, best_count = None, None
+        for term in terms:
+            condition = self.condition(*term)
+            if condition is None:
+                continue
+            count = self.conn.execute(
+                "SELECT COUNT(*) FROM profs WHERE " + condition[0],
+                condition[1]).fetchone()[0]
+            if best is None or count < best_count:
+                best, best_count = condition, count
+        sql = "SELECT profname, name, email, signkey, signpref FROM profs"
+        params = ()
+        if best is not None:
+            sql += " WHERE " + best[0]
+            params = best[1]
+        for row in self.conn.execute(sql + " ORDER BY profname", params):
+            prof = Prof(row[0], row[1], row[2], row[3], bool(row[4]))
+            if all(self.match(prof, *term) for term in terms):
+                yield prof
+
+
+def load_index(store: ProfStore = None, cache: bool = True) -> ProfIndex:
+    """Function that returns the index over the profiles of a store. The
+    persisted index is only built again if the store has changed since it
+    was built.
+
+    :param store: Profiles store to index. None to use the default
+    :type store: ProfStore
+    :param cache: Use and refresh the persisted index
+    :type cache: bool
+    :return: Profile index
+    :rtype: ProfIndex
+    """
+    store = store or model_layer.get_store()
+    if cache:
+        # Read before the profiles, so a change while they are read is
+        # 	found on the next load
+        stamp = repr((os.path.abspath(store.path), store.stamp()))
+        try:
+            os.makedirs(model_layer.CACHE_DIR, exist_ok=True)
+            index = ProfIndex(path=os.path.join(model_layer.CACHE_DIR,
+                                                INDEX_NAME))
+            if index.stamp() != stamp:
+                index.replace(store.iter_profs(), stamp)
+            return index
+        except (OSError, sqlite3.Error):
+            pass  # Unwritable or corrupted, so the index is not persisted
+    return ProfIndex(store.iter_profs())
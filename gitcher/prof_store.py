@@ -0,0 +1,779 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's profile stores module
+
+This module contains the storage backends where gitcher profiles are saved.
+The flat CHERFILE is the default one, and a SQLite database is offered for
+large profile volumes, with indexed queries and safe concurrent access.
+Large profile volumes split in namespaces (e.g.: 'team/profname') can
+also be kept in a directory of CHERFILE shards, one per namespace, which
+are only read on demand.
+"""
+
+import operator
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import warnings
+from urllib.parse import quote
+
+from gitcher.prof import Prof
+from gitcher.not_found_prof_error import NotFoundProfError
+
+
+class ProfStore(object):
+    """Class that represents a gitcher profiles storage backend. It is the
+    interface that every backend implements."""
+
+    def __init__(self, path: str, fragments_dir: str = None):
+        self.path = path
+        # Directory of the rendered profile git config fragments
+        self.fragments_dir = fragments_dir or path + '.d'
+
+    def exists(self) -> bool:
+        """Function that checks if the store exists.
+
+        :return: Confirmation about the existence of the store
+        :rtype: bool
+        """
+        return os.path.exists(self.path)
+
+    def stamp(self) -> tuple:
+        """Function that returns a fingerprint of the store state on disk,
+        which changes with every store change.
+
+        :return: Modification time and size of the store files
+        :rtype: tuple
+        """
+        stamp = []
+        for path in [self.path, self.path + '-wal']:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def create(self) -> None:
+        """Function that creates an empty store.
+
+        :return: None
+        """
+        raise NotImplementedError
+
+    def iter_profs(self):
+        """Generator that yields every saved profile, in storage order.
+
+        :return: Saved profiles
+        :rtype: Iterator[Prof]
+        """
+        raise NotImplementedError
+
+    def recuperate_profs(self) -> [Prof]:
+        """Function that returns every saved profile, sorted on alphabetical
+        order looking its profname value.
+
+        :return: A sort list with all gitcher profiles saved
+        :rtype: [Prof]
+        """
+        return sorted(self.iter_profs(), key=operator.attrgetter('profname'))
+
+    def recuperate_prof(self, profname: str) -> Prof:
+        """Function that returns the required gitcher profile. If it does
+        not exist, raise a not found exception.
+
+        :param profname: Name of the gitcher profile to operate with
+        :type profname: str
+        :return: The required profile
+        :rtype: Prof
+        :raise: NotFoundProfError
+        """
+        for prof in self.iter_profs():
+            if prof.profname == profname:
+                return prof
+        raise NotFoundProfError
+
+    def save_profile(self, prof: Prof) -> None:
+        """Function that saves a new gitcher profile.
+
+        :param prof: Gitcher profile to save
+        :type prof: Prof
+        :return: None
+        """
+        raise NotImplementedError
+
+    def save_profiles(self, profs: [Prof]) -> None:
+        """Function that saves several new gitcher profiles in a single
+        atomic batch, keeping the saved ones as they are.
+
+        :param profs: Gitcher profiles to save
+        :type profs: [Prof]
+        :return: None
+        """
+        raise NotImplementedError
+
+    def update_profile(self, profname: str, prof: Prof) -> None:
+        """Function that replaces a saved gitcher profile by a new version
+        of it, which can have another profile name.
+
+        :param profname: Name of the gitcher profile to replace
+        :type profname: str
+        :param prof: New version of the gitcher profile
+        :type prof: Prof
+        :return: None
+        """
+        raise NotImplementedError
+
+    def delete_profile(self, profname: str) -> None:
+        """Function that deletes a gitcher profile.
+
+        :param profname: Name of the gitcher profile to operate with
+        :type profname: str
+        :return: None
+        """
+        raise NotImplementedError
+
+    def delete_profiles(self, profnames: [str]) -> None:
+        """Function that deletes several gitcher profiles in a single atomic
+        batch, keeping the rest of the store as it is.
+
+        :param profnames: Names of the gitcher profiles to delete
+        :type profnames: [str]
+        :return: None
+        """
+        raise NotImplementedError
+
+    def replace_profiles(self, profs: [Prof]) -> None:
+        """Function that replaces atomically every saved profile by the
+        passed ones.
+
+        :param profs: Gitcher profiles to save
+        :type profs: [Prof]
+        :return: None
+        """
+        raise NotImplementedError
+
+
+class MalformedLineWarning(UserWarning):
+    """Class that represents the warning of a CHERFILE line which can not
+    be parsed, and is skipped."""
+
+
+class StoreFormatError(ValueError):
+    """Class that represents the error of a profiles store whose format or
+    version is not supported, so it can not be read."""
+
+
+def escape_field(value: str) -> str:
+    """Function that escapes a CHERFILE field: backslashes, tabs and line
+    breaks.
+
+    :param value: Field value
+    :type value: str
+    :return: Escaped field
+    :rtype: str
+    """
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+_UNESCAPES = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r'}
+_ESCAPE = re.compile(r'\\(.?)')
+
+
+def unescape_field(field: str) -> str:
+    """Function that unescapes a CHERFILE field.
+
+    :param field: Escaped field
+    :type field: str
+    :return: Field value
+    :rtype: str
+    :raise ValueError: If the field has an unknown escape
+    """
+    if '\\' not in field:
+        return field
+
+    def unescape(match) -> str:
+        try:
+            return _UNESCAPES[match.group(1)]
+        except KeyError:
+            raise ValueError("unknown escape '\\{0}'".format(match.group(1)))
+
+    return _ESCAPE.sub(unescape, field)
+
+
+class CherfileStore(ProfStore):
+    """Class that represents the flat CHERFILE gitcher profiles store.
+
+    The CHERFILE starts with a version header, and has a line per profile,
+    with its FIELDS separated by tabs and escaped by 'escape_field'. The
+    sign key is empty if there is none, and the autosign preference is
+    'true' or 'false'. Later fields are ignored, so new versions can add
+    them. Lines starting with '#' are comments.
+
+    The version header is looked for among the comment lines before the
+    first profile, so users can write comments above it. A CHERFILE of
+    another version is never operated.
+
+    A malformed line is skipped, with a 'MalformedLineWarning' with its line
+    number. A legacy CHERFILE, of comma separated values with no header, is
+    migrated to the current format in a single streaming pass the first
+    time it is operated, and replaced atomically.
+    """
+
+    VERSION = 2
+    HEADER = "# gitcher cherfile {0}".format(VERSION)
+    HEADER_REGEX = re.compile(r'^# gitcher cherfile (\d+)\s*$')
+    FIELDS = ['profname', 'name', 'email', 'signkey', 'signpref']
+    LEGACY_HEADER = ["####################", "# GITCHER CHERFILE #",
+                     "####################"]
+
+    @staticmethod
+    def format_prof(prof: Prof) -> str:
+        """Function that returns the CHERFILE line of a gitcher profile."""
+        return '\t'.join([escape_field(prof.profname),
+                          escape_field(prof.name), escape_field(prof.email),
+                          escape_field(prof.signkey or ''),
+                          str(bool(prof.signpref)).lower()])
+
+    @staticmethod
+    def parse_prof(line: str) -> Prof:
+        """Function that builds a gitcher profile from a CHERFILE line.
+
+        :raise ValueError: If the line is malformed
+        """
+        fields = line.split('\t')
+        if len(fields) < 5:
+            raise ValueError("{0} fields, expected 5".format(len(fields)))
+        profname, name, email, signkey = (unescape_field(field)
+                                          for field in fields[:4])
+        if not profname or not name or not email:
+            raise ValueError("empty profname, name or email")
+        if fields[4] not in ['true', 'false']:
+            raise ValueError("autosign preference '{0}' is not true or "
+                             "false".format(fields[4]))
+        return Prof(profname, name, email, signkey or None,
+                    fields[4] == 'true')
+
+    @staticmethod
+    def parse_legacy_prof(line: str) -> Prof:
+        """Function that builds a gitcher profile from a legacy CHERFILE
+        line.
+
+        :raise ValueError: If the line is malformed
+        """
+        fields = line.split(',')
+        if len(fields) < 5:
+            raise ValueError("{0} fields, expected 5".format(len(fields)))
+        profname, name, email, signkey, signpref = fields[:5]
+
+        # Type conversions
+        if signkey == "None":
+            signkey = None
+        signpref = (signpref == "True")
+
+        return Prof(profname, name, email, signkey, signpref)
+
+    def create(self) -> None:
+        with open(self.path, 'w') as f:
+            print(self.HEADER, file=f)
+
+    def _read_version(self) -> (int, int):
+        """Function that looks for the version header among the comment
+        lines before the first profile.
+
+        :return: The CHERFILE version and the header line number, or None
+            and 0 if there is no header
+        :rtype: (int, int)
+        """
+        with open(self.path, 'r') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.rstrip('\n')
+                match = self.HEADER_REGEX.match(line)
+                if match is not None:
+                    return int(match.group(1)), lineno
+                if line.strip() and not line.startswith('#'):  # A profile
+                    break
+        return None, 0
+
+    def _open(self):
+        """Function that opens the CHERFILE to read it, migrating it first
+        if it is a legacy one. If it can not be migrated (e.g.: a read only
+        one), it is read as it is.
+
+        :return: The CHERFILE, after its header, its first line number and
+            its line parser
+        :rtype: (file, int, function)
+        :raise StoreFormatError: If the CHERFILE version is not supported
+        """
+        version, header_lineno = self._read_version()
+        if version is None:
+            try:
+                self.migrate()
+            except OSError:
+                return open(self.path, 'r'), 1, self.parse_legacy_prof
+            version, header_lineno = self._read_version()
+        if version != self.VERSION:
+            raise StoreFormatError("CHERFILE {0} version {1} is not "
+                                   "supported, expected {2}".format(
+                                       self.path, version, self.VERSION))
+        f = open(self.path, 'r')
+        for _ in range(header_lineno):
+            f.readline()
+        return f, header_lineno + 1, self.parse_prof
+
+    def iter_profs(self):
+        f, first_lineno, parse = self._open()
+        with f:
+            for lineno, line in enumerate(f, first_lineno):
+                line = line.rstrip('\n')
+                if not line or line.startswith('#'):  # Empty or comment
+                    continue
+                try:
+                    yield parse(line)
+                except ValueError as e:
+                    warnings.warn("CHERFILE {0} line {1} skipped: {2}".format(
+                        self.path, lineno, e), MalformedLineWarning)
+
+    def migrate(self) -> int:
+        """Function that migrates a legacy CHERFILE to the current format,
+        in a single streaming pass, replacing it atomically. Only the lines
+        which parse as legacy profiles are rewritten. Comments, tab
+        separated lines, which are yet on the current format, and malformed
+        lines are kept as they are, so the malformed ones are reported on
+        each read, to fix them by hand.
+
+        :return: Number of migrated profiles
+        :rtype: int
+        """
+        count = 0
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+        with os.fdopen(fd, 'w') as dst, open(self.path, 'r') as src:
+            print(self.HEADER, file=dst)
+            for lineno, line in enumerate(src, 1):
+                line = line.rstrip('\n')
+                if not line.strip() or line in self.LEGACY_HEADER:
+                    continue
+                if line.startswith('#') or '\t' in line:  # Not legacy
+                    print(line, file=dst)
+                    continue
+                try:
+                    print(self.format_prof(self.parse_legacy_prof(line)),
+                          file=dst)
+                    count += 1
+                except ValueError as e:
+                    print(line, file=dst)
+                    warnings.warn("CHERFILE {0} legacy line {1} kept as it "
+                                  "is: {2}".format(self.path, lineno, e),
+                                  MalformedLineWarning)
+        os.replace(tmp_path, self.path)
+        return count
+
+    def save_profile(self, prof: Prof) -> None:
+        self._open()[0].close()  # Migrated before appending
+        with open(self.path, 'a') as f:
+            print(self.format_prof(prof), file=f)
+
+    def save_profiles(self, profs: [Prof]) -> None:
+        self._open()[0].close()  # Migrated before copying
+        # A copy with the new lines appended replaces the CHERFILE, so
+        # 	its lines, even comments and malformed ones, are kept
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+        with os.fdopen(fd, 'w') as dst, open(self.path, 'r') as src:
+            shutil.copyfileobj(src, dst)
+            if dst.tell() and not self._ends_with_newline():
+                print(file=dst)
+            for prof in profs:
+                print(self.format_prof(prof), file=dst)
+        shutil.copymode(self.path, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def _ends_with_newline(self) -> bool:
+        """Function that checks if the CHERFILE ends with a line break."""
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def update_profile(self, profname: str, prof: Prof) -> None:
+        self._rewrite(profname, self.format_prof(prof))
+
+    def delete_profile(self, profname: str) -> None:
+        self._rewrite(profname, None)
+
+    def _rewrite(self, profname: str, new_line: str) -> None:
+        """Function that rewrites the CHERFILE lines of a profile, replacing
+        them by a new line or removing them if it is None."""
+        self._open()[0].close()  # Migrated before rewriting
+        prefix = escape_field(profname) + '\t'
+        f = open(self.path, 'r+')  # Read and write mode
+        lines = f.readlines()
+        lines = [line.strip('\n') for line in lines]
+        f.seek(0)  # Return to the start of the file
+        for line in lines:
+            if not line.startswith(prefix):
+                print(line, file=f)
+            elif new_line is not None:
+                print(new_line, file=f)
+                new_line = None  # Only once
+        f.truncate()  # Delete possible dirty lines below
+        f.close()
+
+    def delete_profiles(self, profnames: [str]) -> None:
+        self._open()[0].close()  # Migrated before copying
+        # A copy without the profile lines replaces the CHERFILE, so the
+        # 	rest of its lines, even comments and malformed ones, are kept
+        prefixes = tuple(escape_field(profname) + '\t'
+                         for profname in profnames)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+        with os.fdopen(fd, 'w') as dst, open(self.path, 'r') as src:
+            for line in src:
+                if not prefixes or not line.startswith(prefixes):
+                    dst.write(line)
+        shutil.copymode(self.path, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def replace_profiles(self, profs: [Prof]) -> None:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            print(self.HEADER, file=f)
+            for prof in sorted(profs, key=operator.attrgetter('profname')):
+                print(self.format_prof(prof), file=f)
+        os.replace(tmp_path, self.path)
+
+
+class SqliteStore(ProfStore):
+    """Class that represents the SQLite database gitcher profiles store.
+
+    The database runs in WAL mode, so readers do not block writers, and
+    every change runs in a transaction."""
+
+    SCHEMA = ["CREATE TABLE IF NOT EXISTS profs ("
+              "profname TEXT PRIMARY KEY, name TEXT NOT NULL, "
+              "email TEXT NOT NULL, signkey TEXT, "
+              "signpref INTEGER NOT NULL)",
+              "CREATE INDEX IF NOT EXISTS profs_email ON profs (email)",
+              "CREATE INDEX IF NOT EXISTS profs_signkey ON profs (signkey)"]
+
+    def _connect(self) -> sqlite3.Connection:
+        """Function that opens a connection to the database."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _row(prof: Prof) -> tuple:
+        return (prof.profname, prof.name, prof.email, prof.signkey,
+                int(bool(prof.signpref)))
+
+    @staticmethod
+    def _prof(row: tuple) -> Prof:
+        return Prof(row[0], row[1], row[2], row[3], bool(row[4]))
+
+    def create(self) -> None:
+        conn = self._connect()
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        conn.close()
+
+    def iter_profs(self):
+        conn = self._connect()
+        try:
+            for row in conn.execute("SELECT profname, name, email, signkey, "
+                                    "signpref FROM profs"):
+                yield self._prof(row)
+        finally:
+            conn.close()
+
+    def recuperate_profs(self) -> [Prof]:
+        conn = self._connect()
+        rows = conn.execute("SELECT profname, name, email, signkey, signpref "
+                            "FROM profs ORDER BY profname").fetchall()
+        conn.close()
+        return [self._prof(row) for row in rows]
+
+    def recuperate_prof(self, profname: str) -> Prof:
+        conn = self._connect()
+        row = conn.execute("SELECT profname, name, email, signkey, signpref "
+                           "FROM profs WHERE profname = ?",
+                           (profname,)).fetchone()
+        conn.close()
+        if row is None:
+            raise NotFoundProfError
+        return self._prof(row)
+
+    def save_profile(self, prof: Prof) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT INTO profs VALUES (?, ?, ?, ?, ?)",
+                         self._row(prof))
+        conn.close()
+
+    def save_profiles(self, profs: [Prof]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT INTO profs VALUES (?, ?, ?, ?, ?)",
+                             (self._row(prof) for prof in profs))
+        conn.close()
+
+    def update_profile(self, profname: str, prof: Prof) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE profs SET profname = ?, name = ?, "
+                         "email = ?, signkey = ?, signpref = ? "
+                         "WHERE profname = ?", self._row(prof) + (profname,))
+        conn.close()
+
+    def delete_profile(self, profname: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM profs WHERE profname = ?", (profname,))
+        conn.close()
+
+    def delete_profiles(self, profnames: [str]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM profs WHERE profname = ?",
+                             ((profname,) for profname in profnames))
+        conn.close()
+
+    def replace_profiles(self, profs: [Prof]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM profs")
+            conn.executemany("INSERT INTO profs VALUES (?, ?, ?, ?, ?)",
+                             (self._row(prof) for prof in profs))
+        conn.close()
+
+
+class ShardedStore(ProfStore):
+    """Class that represents the sharded gitcher profiles store.
+
+    The namespace of a profile is the part of its profname before the last
+    '/' (e.g.: 'infra' for 'infra/deploy-bot'), or empty if there is none.
+    The store is a directory with a CHERFILE per namespace, the shards, and
+    a manifest which maps each namespace to its shard. So a lookup only
+    reads the manifest and the shard of its namespace, whatever the number
+    of saved profiles is, and a listing streams the shards in namespace
+    order.
+
+    Every change rewrites the manifest atomically, and an emptied shard is
+    removed. Profile replacements write new shards and switch to them by
+    the manifest replacement, so they are atomic too.
+    """
+
+    MANIFEST_NAME = 'manifest'
+    MANIFEST_HEADER = "# gitcher shards 1"
+
+    @staticmethod
+    def namespace(profname: str) -> str:
+        """Function that returns the namespace of a profile name.
+
+        :param profname: Name of the gitcher profile
+        :type profname: str
+        :return: Profile namespace, empty if there is none
+        :rtype: str
+        """
+        return profname.rpartition('/')[0]
+
+    def manifest_path(self) -> str:
+        """Function that returns the path of the shards manifest.
+
+        :return: Manifest path
+        :rtype: str
+        """
+        return os.path.join(self.path, self.MANIFEST_NAME)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path())
+
+    def create(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self._write_manifest(dict())
+
+    def read_manifest(self) -> dict:
+        """Function that reads the shards manifest.
+
+        :return: Namespace to shard file name
+        :rtype: dict
+        :raise StoreFormatError: If the manifest format is unknown
+        """
+        shards = dict()
+        with open(self.manifest_path(), 'r') as f:
+            if f.readline().rstrip('\n') != self.MANIFEST_HEADER:
+                raise StoreFormatError("Unknown shards manifest format: " +
+                                       self.manifest_path())
+            for line in f:
+                namespace, shard = line.rstrip('\n').split('\t')
+                shards[unescape_field(namespace)] = shard
+        return shards
+
+    def _write_manifest(self, shards: dict) -> None:
+        """Function that replaces atomically the shards manifest."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            print(self.MANIFEST_HEADER, file=f)
+            for namespace in sorted(shards):
+                print(escape_field(namespace) + '\t' + shards[namespace],
+                      file=f)
+        os.replace(tmp_path, self.manifest_path())
+
+    def shard(self, shard: str) -> CherfileStore:
+        """Function that returns the store of a shard.
+
+        :param shard: Shard file name, as saved on the manifest
+        :type shard: str
+        :return: Shard store
+        :rtype: CherfileStore
+        """
+        return CherfileStore(os.path.join(self.path, shard),
+                             self.fragments_dir)
+
+    def _new_shard(self, namespace: str) -> str:
+        """Function that creates an empty shard for a namespace, with a new
+        file name, and returns it."""
+        fd, path = tempfile.mkstemp(
+            dir=self.path, prefix=(quote(namespace, safe='') or '_') + '.',
+            suffix='.cherfile')
+        with os.fdopen(fd, 'w') as f:
+            print(CherfileStore.HEADER, file=f)
+        return os.path.basename(path)
+
+    def iter_profs(self):
+        shards = self.read_manifest()
+        for namespace in sorted(shards):
+            yield from self.shard(shards[namespace]).iter_profs()
+
+    def recuperate_prof(self, profname: str) -> Prof:
+        shard = self.read_manifest().get(self.namespace(profname))
+        if shard is None:
+            raise NotFoundProfError
+        return self.shard(shard).recuperate_prof(profname)
+
+    def _add(self, shards: dict, prof: Prof) -> None:
+        """Function that saves a profile to the shard of its namespace,
+        creating it and adding it to the passed manifest if it is new."""
+        namespace = self.namespace(prof.profname)
+        if namespace not in shards:
+            shards[namespace] = self._new_shard(namespace)
+        self.shard(shards[namespace]).save_profile(prof)
+
+    def _remove(self, shards: dict, profname: str) -> str:
+        """Function that deletes a profile from the shard of its namespace.
+        If the shard gets empty, it is dropped from the passed manifest and
+        its file name is returned, to remove it after the manifest
+        replacement."""
+        namespace = self.namespace(profname)
+        if namespace not in shards:
+            return None
+        shard = self.shard(shards[namespace])
+        shard.delete_profile(profname)
+        if next(shard.iter_profs(), None) is not None:
+            return None
+        return shards.pop(namespace)
+
+    def _commit(self, shards: dict, dropped: [str]) -> None:
+        """Function that replaces the manifest and then removes the dropped
+        shards."""
+        self._write_manifest(shards)
+        for shard in dropped:
+            if shard is not None:
+                os.remove(os.path.join(self.path, shard))
+
+    def save_profile(self, prof: Prof) -> None:
+        shards = self.read_manifest()
+        self._add(shards, prof)
+        self._commit(shards, [])
+
+    def save_profiles(self, profs: [Prof]) -> None:
+        shards = self.read_manifest()
+        groups = dict()  # Namespace to profiles
+        for prof in profs:
+            groups.setdefault(self.namespace(prof.profname), []).append(prof)
+        # The profiles are appended to copies of the shards, which replace
+        # 	them with the manifest replacement, so the batch is atomic
+        dropped = []
+        for namespace, group in groups.items():
+            shard = self._new_shard(namespace)
+            if namespace in shards:
+                shutil.copyfile(os.path.join(self.path, shards[namespace]),
+                                os.path.join(self.path, shard))
+                dropped.append(shards[namespace])
+            self.shard(shard).save_profiles(group)
+            shards[namespace] = shard
+        self._commit(shards, dropped)
+
+    def update_profile(self, profname: str, prof: Prof) -> None:
+        shards = self.read_manifest()
+        namespace = self.namespace(profname)
+        if namespace not in shards:
+            return
+        if namespace == self.namespace(prof.profname):
+            self.shard(shards[namespace]).update_profile(profname, prof)
+            self._commit(shards, [])  # Also marks the store change
+        else:
+            dropped = self._remove(shards, profname)
+            self._add(shards, prof)
+            self._commit(shards, [dropped])
+
+    def delete_profile(self, profname: str) -> None:
+        shards = self.read_manifest()
+        dropped = self._remove(shards, profname)
+        self._commit(shards, [dropped])
+
+    def delete_profiles(self, profnames: [str]) -> None:
+        shards = self.read_manifest()
+        groups = dict()  # Namespace to profile names
+        for profname in profnames:
+            namespace = self.namespace(profname)
+            if namespace in shards:
+                groups.setdefault(namespace, []).append(profname)
+        # The profiles are deleted from copies of the shards, which replace
+        # 	them with the manifest replacement, so the batch is atomic
+        dropped = []
+        for namespace, group in groups.items():
+            shard = self._new_shard(namespace)
+            shutil.copyfile(os.path.join(self.path, shards[namespace]),
+                            os.path.join(self.path, shard))
+            dropped.append(shards[namespace])
+            self.shard(shard).delete_profiles(group)
+            if next(self.shard(shard).iter_profs(), None) is None:
+                dropped.append(shard)  # Emptied
+                del shards[namespace]
+            else:
+                shards[namespace] = shard
+        self._commit(shards, dropped)
+
+    def replace_profiles(self, profs: [Prof]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            old_shards = self.read_manifest()
+        except FileNotFoundError:
+            old_shards = dict()
+        groups = dict()  # Namespace to profiles
+        for prof in profs:
+            groups.setdefault(self.namespace(prof.profname), []).append(prof)
+        shards = dict()
+        for namespace, group in groups.items():
+            shards[namespace] = self._new_shard(namespace)
+            self.shard(shards[namespace]).replace_profiles(group)
+        self._commit(shards, list(old_shards.values()))
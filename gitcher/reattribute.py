@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's reattribute module
+
+This module rewrites the authorship of the commits made with a wrong
+profile. The history is streamed from 'git fast-export' to 'git
+fast-import', with no file contents ('--no-data', blobs are reused by
+their hashes), rewriting only the author and committer lines which match
+the wrong profile identity. Neither the history nor the commit contents
+are loaded in memory.
+
+Only the commits which need it are exported: the ones of the wrong profile
+and their descendants. A first pass over the range finds them, and the
+rest is excluded, so the older commits keep their hashes.
+
+Signatures can not survive a rewrite, so the signed commits which are
+rewritten are reported. The previous tips of the rewritten refs are saved
+below ORIGINAL_REFS, as 'git filter-branch' does.
+"""
+
+import re
+import subprocess
+import tempfile
+
+from gitcher import metrics
+from gitcher.git_command_error import GitCommandError
+from gitcher.prof import Prof
+
+# Namespace of the previous tips of the rewritten refs
+ORIGINAL_REFS = 'refs/gitcher/original/'
+
+# Identity line of a fast-import stream commit
+IDENT_LINE = re.compile(rb'^(author|committer) (.*?) <([^<>]*)> (.*)\n$')
+
+
+def same_identity(prof: Prof, name: str, email: str) -> bool:
+    """Function that checks if a commit identity is the one of a gitcher
+    profile, ignoring surrounding whitespace and the email case.
+
+    :param prof: Gitcher profile
+    :type prof: Prof
+    :param name: Commit identity name
+    :type name: str
+    :param email: Commit identity email
+    :type email: str
+    :return: Confirmation about the identity being the profile one
+    :rtype: bool
+    """
+    return (name.strip(), email.strip().lower()) == prof.identity()[:2]
+
+
+def _run(path: str, args: [str]) -> str:
+    """Function that runs a git command in a repository and returns its
+    output."""
+    argv = ['git', '-C', path] + args
+    metrics.count_spawn()
+    p = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    if p.returncode != 0:
+        raise GitCommandError(argv, p.returncode, p.stderr)
+    return p.stdout
+
+
+def iter_commits(path: str, revs: [str]):
+    """Generator that streams the commits of a revisions range, parents
+    before children, from 'git rev-list --header'.
+
+    :param path: Repository path
+    :type path: str
+    :param revs: Revisions range, as 'git rev-list' arguments
+    :type revs: [str]
+    :return: Commit hash, parent hashes, author and committer identities,
+        as (name, email), and signature presence, per commit
+    :rtype: Iterator[(str, [str], [(str, str)], bool)]
+    :raise GitCommandError: If the range can not be listed
+    """
+    argv = ['git', '-C', path, 'rev-list', '--header', '--reverse',
+            '--topo-order'] + revs + ['--']
+    metrics.count_spawn()
+    with tempfile.TemporaryFile() as stderr, \
+            subprocess.Popen(argv, stdout=subprocess.PIPE,
+                             stderr=stderr) as p:
+        pending = b''
+        for chunk in iter(lambda: p.stdout.read(65536), b''):
+            records = (pending + chunk).split(b'\0')
+            pending = records.pop()  # Incomplete
+            for record in records:
+                headers = record.split(b'\n\n', 1)[0].decode(
+                    'utf-8', 'replace').split('\n')
+                parents = []
+                idents = []
+                signed = False
+                for header in headers[1:]:
+                    key, _, value = header.partition(' ')
+                    if key == 'parent':
+                        parents.append(value)
+                    elif key in ['author', 'committer']:
+                        name, _, rest = value.partition(' <')
+                        idents.append((name, rest.partition('>')[0]))
+                    elif key.startswith('gpgsig'):
+                        signed = True
+                yield headers[0], parents, idents, signed
+        p.wait()
+        if p.returncode != 0:
+            stderr.seek(0)
+            raise GitCommandError(argv, p.returncode,
+                                  stderr.read().decode('utf-8', 'replace'))
+
+
+def plan_rewrite(path: str, prof: Prof, revs: [str]) -> dict:
+    """Function that finds the commits to rewrite to reattribute the
+    commits of a gitcher profile: the ones with its identity, as author or
+    committer, and every descendant of them.
+
+    :param path: Repository path
+    :type path: str
+    :param prof: Gitcher profile whose commits are reattributed
+    :type prof: Prof
+    :param revs: Revisions range, as 'git rev-list' arguments
+    :type revs: [str]
+    :return: Plan with the number of commits of the profile ('matched') and
+        of commits to rewrite ('rewritten'), the hashes of the signed
+        commits to rewrite ('signed') and the parents to exclude from the
+        export ('boundary')
+    :rtype: dict
+    :raise GitCommandError: If the range can not be listed
+    """
+    dirty = set()  # Commits to rewrite
+    boundary = set()
+    signed_dirty = []
+    matched = 0
+    for sha, parents, idents, signed in iter_commits(path, revs):
+        match = any(same_identity(prof, name, email)
+                    for name, email in idents)
+        matched += match
+        if match or any(parent in dirty for parent in parents):
+            dirty.add(sha)
+            boundary.update(parent for parent in parents
+                            if parent not in dirty)
+            if signed:
+                signed_dirty.append(sha)
+    return {'matched': matched, 'rewritten': len(dirty),
+            'signed': signed_dirty, 'boundary': sorted(boundary)}
+
+
+def _copy(src, dst, size: int) -> None:
+    """Function that copies some bytes between two streams."""
+    while size > 0:
+        chunk = src.read(min(size, 65536))
+        if not chunk:
+            raise EOFError("Truncated fast-export stream")
+        dst.write(chunk)
+        size -= len(chunk)
+
+
+def filter_stream(src, dst, from_prof: Prof, to_prof: Prof) -> set:
+    """Function that copies a fast-export stream, replacing the author and
+    committer identities of a gitcher profile by the ones of another.
+
+    :param src: Binary fast-export stream
+    :type src: file
+    :param dst: Binary fast-import stream
+    :type dst: file
+    :param from_prof: Gitcher profile whose identity is replaced
+    :type from_prof: Prof
+    :param to_prof: Gitcher profile of the new identity
+    :type to_prof: Prof
+    :return: Names of the refs of the stream
+    :rtype: set
+    """
+    to_ident = '{0} <{1}>'.format(to_prof.name, to_prof.email).encode()
+    refs = set()
+    for line in iter(src.readline, b''):
+        if line.startswith(b'data '):  # Raw bytes, maybe not lines
+            dst.write(line)
+            _copy(src, dst, int(line[len(b'data '):]))
+            continue
+        match = IDENT_LINE.match(line)
+        if match is not None:
+            if same_identity(from_prof,
+                             match.group(2).decode('utf-8', 'replace'),
+                             match.group(3).decode('utf-8', 'replace')):
+                line = match.group(1) + b' ' + to_ident + b' ' + \
+                    match.group(4) + b'\n'
+        elif line.startswith((b'commit ', b'reset ')):
+            refs.add(line.split(b' ', 1)[1].rstrip(b'\n').decode())
+        dst.write(line)
+    return refs
+
+
+def reattribute(path: str, from_prof: Prof, to_prof: Prof,
+                rev_range: str = None, dry_run: bool = False) -> dict:
+    """Function that reattributes to a gitcher profile the commits made
+    with another one, rewriting them and their descendants.
+
+    :param path: Repository path
+    :type path: str
+    :param from_prof: Gitcher profile whose commits are reattributed
+    :type from_prof: Prof
+    :param to_prof: Gitcher profile to reattribute them to
+    :type to_prof: Prof
+    :param rev_range: Revisions range (e.g.: 'main~10..main'). None to use
+        the current branch
+    :type rev_range: str
+    :param dry_run: Only plan the rewrite, with no write
+    :type dry_run: bool
+    :return: The plan, as returned by 'plan_rewrite', with the previous
+        tips of the rewritten refs ('refs'), empty on dry run
+    :rtype: dict
+    :raise GitCommandError: If a git command fails
+    """
+    revs = [rev_range or _run(path, ['symbolic-ref', '-q', 'HEAD']).strip()]
+    plan = plan_rewrite(path, from_prof, revs)
+    plan['refs'] = dict()
+    if dry_run or not plan['matched']:
+        return plan
+
+    tips = dict(line.split(' ', 1)[::-1] for line in _run(
+        path, ['for-each-ref', '--format=%(objectname) %(refname)'])
+        .splitlines())
+
+    export_argv = ['git', '-C', path, 'fast-export', '--no-data',
+                   '--reference-excluded-parents', '--use-done-feature',
+                   '--reencode=yes'] + revs + \
+        ['^' + sha for sha in plan['boundary']] + ['--']
+    import_argv = ['git', '-C', path, 'fast-import', '--quiet', '--force']
+    metrics.count_spawn()
+    metrics.count_spawn()
+    with tempfile.TemporaryFile() as export_err, \
+            tempfile.TemporaryFile() as import_err, \
+            subprocess.Popen(export_argv, stdout=subprocess.PIPE,
+                             stderr=export_err) as exporter, \
+            subprocess.Popen(import_argv, stdin=subprocess.PIPE,
+                             stderr=import_err) as importer:
+        failures = [(export_argv, exporter, export_err),
+                    (import_argv, importer, import_err)]
+        try:
+            refs = filter_stream(exporter.stdout, importer.stdin, from_prof,
+                                 to_prof)
+        except EOFError:  # Exporter failure
+            refs = set()
+        except BrokenPipeError:  # Importer failure
+            refs = set()
+            exporter.kill()
+            failures.reverse()
+        try:
+            importer.stdin.close()  # 'done' is missing if truncated
+        except BrokenPipeError:
+            pass
+        exporter.wait()
+        importer.wait()
+        for argv, p, err in failures:
+            if p.returncode != 0:
+                err.seek(0)
+                raise GitCommandError(argv, p.returncode,
+                                      err.read().decode('utf-8', 'replace'))
+
+    for ref in sorted(refs):
+        if ref in tips:
+            _run(path, ['update-ref', ORIGINAL_REFS + ref, tips[ref]])
+            plan['refs'][ref] = tips[ref]
+    return plan
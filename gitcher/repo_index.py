@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's repositories index module
+
+This module keeps a persistent index of the git repositories found below
+some root directories, so the orders over every repository do not walk the
+whole tree each time.
+
+The walk lists the directories of each depth level in parallel, does not
+follow symlinks nor go inside git directories, and prunes the directories
+whose name matches IGNORE and the ones deeper than MAX_DEPTH. The index
+keeps the modification time of every walked directory, so a rescan only
+lists again the directories which changed.
+
+The last profile applied to each repository is appended to a side file,
+with no need to rewrite the index, and merged into it on rescans.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+from gitcher import model_layer
+
+# Index file name, inside the cache directory. The last applied profiles
+# 	side file has the same name, ended in '.profs'
+INDEX_NAME = 'repos.idx'
+INDEX_HEADER = '# gitcher repos index 1'
+
+# Walk pruning rules
+IGNORE = ['node_modules', '__pycache__', '.cache', '.venv', 'venv', '.tox',
+          'build', 'dist', 'target']
+MAX_DEPTH = 8
+
+
+def index_path() -> str:
+    """Function that returns the repositories index path.
+
+    :return: Index path
+    :rtype: str
+    """
+    return os.path.join(model_layer.CACHE_DIR, INDEX_NAME)
+
+
+def _scan_dir(path: str, ignore: [str]) -> tuple:
+    """Function that lists a directory.
+
+    :return: Its modification time, if it contains a repository and its
+        subdirectories to walk, or None if it can not be listed
+    :rtype: (int, bool, [str])
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        is_repo = False
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name == '.git':
+                    is_repo = True
+                elif entry.is_dir(follow_symlinks=False) and \
+                        not any(fnmatchcase(entry.name, pattern)
+                                for pattern in ignore):
+                    subdirs.append(entry.path)
+        return mtime, is_repo, subdirs
+    except OSError:
+        return None
+
+
+def _stat_mtime(path: str) -> int:
+    """Function that returns the modification time of a directory, or None
+    if it does not exist anymore."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class RepoIndex(object):
+    """Class that represents the repositories index."""
+
+    def __init__(self, roots: [str], ignore: [str] = None,
+                 max_depth: int = MAX_DEPTH):
+        """Repositories index constructor.
+
+        :param roots: Root directories to walk
+        :type roots: [str]
+        :param ignore: Name globs of the directories to prune. None to use
+            IGNORE
+        :type ignore: [str]
+        :param max_depth: Maximum depth to walk below the roots
+        :type max_depth: int
+        """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.ignore = IGNORE if ignore is None else ignore
+        self.max_depth = max_depth
+        self.dirs = dict()  # Path to [mtime, depth, is_repo]
+        self.profs = dict()  # Repository path to last applied profname
+
+    def repos(self) -> [str]:
+        """Function that returns the indexed repositories, sorted.
+
+        :return: Repository paths
+        :rtype: [str]
+        """
+        return sorted(path for path, (_, _, is_repo) in self.dirs.items()
+                      if is_repo)
+
+    def _walk(self, frontier: [(str, int)], workers: int) -> None:
+        """Function that walks and indexes some directories and every
+        subdirectory below them, one depth level at a time."""
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while frontier:
+                results = pool.map(lambda path: _scan_dir(path, self.ignore),
+                                   [path for path, _ in frontier])
+                next_frontier = []
+                for (path, depth), result in zip(frontier, results):
+                    if result is None:
+                        self.dirs.pop(path, None)
+                        continue
+                    mtime, is_repo, subdirs = result
+                    self.dirs[path] = [mtime, depth, is_repo]
+                    if depth < self.max_depth:
+                        next_frontier += [(subdir, depth + 1)
+                                          for subdir in subdirs
+                                          if subdir not in self.dirs]
+                frontier = next_frontier
+
+    def scan(self, workers: int = 8) -> None:
+        """Function that updates the index. Known directories are only
+        listed again if their modification time changed, and new ones are
+        walked whole.
+
+        :param workers: Number of directories listed at the same time
+        :type workers: int
+        :return: None
+        """
+        known = list(self.dirs)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            mtimes = list(pool.map(_stat_mtime, known))
+
+        changed = []
+        for path, mtime in zip(known, mtimes):
+            if mtime is None:  # Removed
+                del self.dirs[path]
+            elif mtime != self.dirs[path][0]:
+                changed.append((path, self.dirs[path][1]))
+        for root in self.roots:
+            if root not in self.dirs:
+                changed.append((root, 0))
+        self._walk(changed, workers)
+
+        # Forget the removed repositories
+        self.profs = {path: profname for path, profname in self.profs.items()
+                      if self.dirs.get(path, [0, 0, False])[2]}
+
+    def save(self, path: str = None) -> None:
+        """Function that writes the index atomically, merging into it the
+        last applied profiles side file.
+
+        The side file is moved aside before it is read, so the profiles
+        recorded meanwhile go to a new one, and it is only removed once the
+        index is replaced. Each save writes its own temporary file, so
+        concurrent saves do not mix.
+
+        :param path: Index path. None to use the default
+        :type path: str
+        :return: None
+        """
+        path = path or index_path()
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, taken_path = tempfile.mkstemp(dir=directory, prefix='.tmp',
+                                          suffix='.profs')
+        os.close(fd)
+        try:
+            os.replace(path + '.profs', taken_path)
+        except FileNotFoundError:
+            pass  # Nothing recorded, so the empty file is merged
+        taken = list(read_profs(taken_path))
+        try:
+            for repo_path, profname in taken:
+                if self.dirs.get(repo_path, [0, 0, False])[2]:
+                    self.profs[repo_path] = profname
+            self._write(path)
+        except BaseException:
+            _append_profs(path + '.profs', taken)  # Back, not to lose them
+            raise
+        finally:
+            os.remove(taken_path)
+
+    def _write(self, path: str) -> None:
+        """Function that replaces atomically the index file."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            print(INDEX_HEADER, file=f)
+            print('M\t{0}\t{1}'.format(self.max_depth,
+                                       '\t'.join(self.ignore)), file=f)
+            for root in self.roots:
+                print('T\t' + root, file=f)
+            for dir_path, (mtime, depth, is_repo) in self.dirs.items():
+                print('D\t{0}\t{1}\t{2}\t{3}'.format(
+                    mtime, depth, int(is_repo), dir_path), file=f)
+            for repo_path, profname in self.profs.items():
+                print('P\t{0}\t{1}'.format(profname, repo_path), file=f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = None):
+        """Function that reads the index, with the last applied profiles.
+
+        :param path: Index path. None to use the default
+        :type path: str
+        :return: The index, or None if it does not exist or is not valid
+        :rtype: RepoIndex
+        """
+        path = path or index_path()
+        index = cls([])
+        try:
+            with open(path, 'r') as f:
+                if f.readline().rstrip('\n') != INDEX_HEADER:
+                    return None
+                for line in f:
+                    kind, _, rest = line.rstrip('\n').partition('\t')
+                    if kind == 'D':
+                        mtime, depth, is_repo, dir_path = rest.split('\t', 3)
+                        index.dirs[dir_path] = [int(mtime), int(depth),
+                                                is_repo == '1']
+                    elif kind == 'P':
+                        profname, repo_path = rest.split('\t', 1)
+                        index.profs[repo_path] = profname
+                    elif kind == 'T':
+                        index.roots.append(rest)
+                    elif kind == 'M':
+                        max_depth, _, ignore = rest.partition('\t')
+                        index.max_depth = int(max_depth)
+                        index.ignore = ignore.split('\t') if ignore else []
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return None  # Truncated or corrupted, to rebuild
+        for repo_path, profname in read_profs(path + '.profs'):
+            index.profs[repo_path] = profname
+        return index
+
+
+def read_profs(path: str):
+    """Generator that reads the last applied profiles side file.
+
+    :param path: Side file path
+    :type path: str
+    :return: Pairs of repository path and profname, oldest first
+    :rtype: Iterator[(str, str)]
+    """
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            profname, tab, repo_path = line.rstrip('\n').partition('\t')
+            if tab:
+                yield repo_path, profname
+
+
+def record_prof(repo_paths: [str], profname: str) -> None:
+    """Function that records the profile applied to some repositories, if
+    the repositories index exists. It only appends lines to a side file.
+
+    :param repo_paths: Repository paths, or paths inside them
+    :type repo_paths: [str]
+    :param profname: Name of the applied gitcher profile
+    :type profname: str
+    :return: None
+    """
+    path = index_path()
+    if not os.path.exists(path):
+        return
+    _append_profs(path + '.profs',
+                  [(model_layer.find_repo_root(repo_path) or
+                    os.path.abspath(repo_path), profname)
+                   for repo_path in repo_paths])
+
+
+def _append_profs(path: str, profs: [(str, str)]) -> None:
+    """Function that appends pairs of repository path and profname to a
+    last applied profiles side file."""
+    if not profs:
+        return
+    lines = ['{0}\t{1}\n'.format(profname, repo_path)
+             for repo_path, profname in profs]
+    # A single append write, so concurrent orders do not mix lines
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, ''.join(lines).encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def indexed_repos(rescan: bool = True) -> [str]:
+    """Function that returns the indexed repositories, rescanning the
+    index first.
+
+    :param rescan: Update the index before
+    :type rescan: bool
+    :return: Repository paths, or an empty list if there is no index
+    :rtype: [str]
+    """
+    index = RepoIndex.load()
+    if index is None:
+        return []
+    if rescan:
+        index.scan()
+        index.save()
+    return index.repos()
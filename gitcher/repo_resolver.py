@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's repository resolver module
+
+This module finds the repository which contains a path in process, as git
+does, with no 'git rev-parse' spawn: it walks up from the path looking for
+a '.git' directory, a '.git' file (linked worktrees and submodules) or a
+bare repository, stopping at the GIT_CEILING_DIRECTORIES. If GIT_DIR is
+set, it is used with no walk.
+
+Found repositories are cached for the life of the process, for the walked
+directory and every directory walked through, so later calls from any of
+them cost a dict lookup. Misses are not cached, so a repository created
+later is found.
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+
+class RepoLocation(namedtuple('RepoLocation', ['worktree', 'git_dir',
+                                               'common_dir'])):
+    """Class that represents the location of a repository: its working
+    tree root (None for bare repositories), its git directory and its
+    common directory, which differ on linked worktrees."""
+
+    __slots__ = ()
+
+    @property
+    def bare(self) -> bool:
+        return self.worktree is None
+
+    @property
+    def config_path(self) -> str:
+        """Repository config file path."""
+        return os.path.join(self.common_dir, 'config')
+
+
+_cache = dict()  # (Directory, ceilings) to RepoLocation
+_lock = threading.Lock()
+
+
+def is_git_dir(path: str) -> bool:
+    """Function that checks if a directory is a git directory.
+
+    :param path: Directory path
+    :type path: str
+    :return: Confirmation about the directory being a git directory
+    :rtype: bool
+    """
+    return os.path.isfile(os.path.join(path, 'HEAD')) and \
+        (os.path.isdir(os.path.join(path, 'objects')) or
+         os.path.isfile(os.path.join(path, 'commondir')))
+
+
+def read_gitfile(path: str) -> str:
+    """Function that reads the git directory pointed by a '.git' file.
+
+    :param path: '.git' file path
+    :type path: str
+    :return: The absolute git directory path, or None if the file is not
+        valid
+    :rtype: str
+    """
+    try:
+        with open(path, 'r') as f:
+            line = f.readline().strip()
+    except OSError:
+        return None
+    if not line.startswith('gitdir:'):
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(path),
+                                         line[len('gitdir:'):].strip()))
+
+
+def _location(worktree: str, git_dir: str) -> RepoLocation:
+    """Function that builds the location of a git directory, reading its
+    common directory."""
+    try:
+        with open(os.path.join(git_dir, 'commondir'), 'r') as f:
+            common_dir = os.path.normpath(os.path.join(git_dir,
+                                                       f.read().strip()))
+    except OSError:
+        common_dir = git_dir
+    return RepoLocation(worktree, git_dir, common_dir)
+
+
+def ceiling_dirs() -> tuple:
+    """Function that returns the GIT_CEILING_DIRECTORIES, as git reads
+    them: absolute paths separated by the path separator.
+
+    :return: Ceiling directories
+    :rtype: tuple
+    """
+    return tuple(os.path.normpath(path) for path in
+                 os.environ.get('GIT_CEILING_DIRECTORIES', '')
+                 .split(os.pathsep) if os.path.isabs(path))
+
+
+def resolve(path: str = None) -> RepoLocation:
+    """Function that finds the repository which contains a path.
+
+    :param path: Path to look from. None to use the current working
+        directory
+    :type path: str
+    :return: The repository location, or None if the path is not inside a
+        repository
+    :rtype: RepoLocation
+    """
+    path = os.path.abspath(path or os.getcwd())
+
+    git_dir = os.environ.get('GIT_DIR')
+    if git_dir:  # No discovery, as for git
+        git_dir = os.path.abspath(git_dir)
+        if os.path.isfile(git_dir):
+            git_dir = read_gitfile(git_dir)
+        if git_dir is None or not is_git_dir(git_dir):
+            return None
+        worktree = os.environ.get('GIT_WORK_TREE')
+        return _location(os.path.abspath(worktree) if worktree else path,
+                         git_dir)
+
+    ceilings = ceiling_dirs()
+    walked = []
+    current = path
+    location = None
+    while True:
+        location = _cache.get((current, ceilings))
+        if location is not None:
+            break
+        walked.append(current)
+        dot_git = os.path.join(current, '.git')
+        if os.path.isdir(dot_git):
+            if is_git_dir(dot_git):
+                location = _location(current, dot_git)
+                break
+        elif os.path.isfile(dot_git):  # Linked worktree or submodule
+            git_dir = read_gitfile(dot_git)
+            if git_dir is not None and is_git_dir(git_dir):
+                location = _location(current, git_dir)
+                break
+        elif is_git_dir(current):  # Bare repository
+            location = _location(None, current)
+            break
+        parent = os.path.dirname(current)
+        if parent == current or parent in ceilings:
+            return None
+        current = parent
+
+    with _lock:
+        for walked_path in walked:
+            _cache[(walked_path, ceilings)] = location
+    return location
+
+
+def clear_cache() -> None:
+    """Function that forgets every found repository, for long running
+    processes which see repositories removed."""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's switch journal module
+
+This module switches many repositories to a profile as a single
+transaction. Before writing a repository, its previous profile keys are
+appended to a journal, so if some repository fails, every journaled one is
+restored. A journal can also be replayed later to roll back the switch.
+
+Journals are streamed: one JSON line per repository, after a header line
+with the journal format version, the switched profile, the configuration
+scope and the keys order. E.g.:
+
+    {"version": 1, "profname": "work", "flag": "", "keys": [...]}
+    ["/path/to/repo", ["Jane Doe", "janedoe@home", null, "false"]]
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from gitcher import model_layer
+from gitcher.git_backend import GitBackend, PROF_GIT_KEYS
+from gitcher.prof import Prof
+
+# Journal format version
+JOURNAL_VERSION = 1
+
+# Journals directory name, inside the cache directory
+JOURNALS_DIR = 'journals'
+
+
+def new_journal_path(profname: str) -> str:
+    """Function that creates a new empty journal inside the cache directory
+    and returns its path. Journals of switches started in the same second
+    get a counter, so they never collide.
+
+    :param profname: Name of the gitcher profile to switch to
+    :type profname: str
+    :return: Journal path
+    :rtype: str
+    """
+    journals_dir = os.path.join(model_layer.CACHE_DIR, JOURNALS_DIR)
+    os.makedirs(journals_dir, exist_ok=True)
+    stamp = time.strftime('%Y%m%dT%H%M%S')
+    counter = 0
+    while True:
+        path = os.path.join(journals_dir, '{0}{1}-{2}.ndjson'.format(
+            stamp, '.{0}'.format(counter) if counter else '', profname))
+        try:
+            # Exclusive creation, as other gitcher runs can race for it
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            return path
+        except FileExistsError:
+            counter += 1
+
+
+def plan_restore(before: list, config: dict) -> [(str, str)]:
+    """Function that computes the minimal git configuration changes to
+    restore a journaled configuration.
+
+    :param before: Journaled values, in 'PROF_GIT_KEYS' order, with None
+        for the unset keys
+    :type before: list
+    :param config: Current git configuration, as returned by
+        'model_layer.read_git_config'
+    :type config: dict
+    :return: Changes, as returned by 'model_layer.plan_switch'
+    :rtype: [(str, str)]
+    """
+    return [(key, value) for key, value in zip(PROF_GIT_KEYS, before)
+            if config.get(key) != value]
+
+
+def read_journal(path: str):
+    """Generator that reads a journal, without loading it whole.
+
+    :param path: Journal path
+    :type path: str
+    :return: First the header dict, then a pair of repository path and
+        journaled values per entry
+    :rtype: Iterator
+    :raise ValueError: If the journal is not valid
+    """
+    with open(path, 'r') as f:
+        header = json.loads(f.readline() or 'null')
+        if not isinstance(header, dict) or \
+                header.get('version') != JOURNAL_VERSION or \
+                header.get('keys') != PROF_GIT_KEYS:
+            raise ValueError("Not a valid switch journal: " + path)
+        yield header
+        for line in f:
+            try:
+                repo_path, before = json.loads(line)
+            except ValueError:
+                continue  # Truncated by a crash, never written
+            yield repo_path, before
+
+
+def _bounded_map(fn, iterable, workers: int):
+    """Generator that calls a function with each item of an iterable in a
+    thread pool, keeping a bounded number of pending calls, so huge
+    iterables are not loaded whole.
+
+    :return: Pairs of item and raised exception, or None
+    :rtype: Iterator[(object, Exception)]
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in iterable:
+            pending.append((item, pool.submit(fn, item)))
+            if len(pending) >= workers * 4:
+                item, future = pending.popleft()
+                yield item, future.exception()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.exception()
+
+
+def switch_repos(prof: Prof, paths, journal_path: str, flag: str = '',
+                 workers: int = 8,
+                 backend: GitBackend = None) -> [(str, Exception)]:
+    """Function that switches many repositories to a gitcher profile as a
+    single transaction. If some repository fails, the pending ones are not
+    switched and every journaled one is rolled back.
+
+    :param prof: Gitcher profile to apply
+    :type prof: Prof
+    :param paths: Repository paths
+    :type paths: Iterable[str]
+    :param journal_path: Path of the journal to create
+    :type journal_path: str
+    :param flag: Scope of the configuration to write. Empty for the
+        repository one
+    :type flag: str
+    :param workers: Number of repositories switched at the same time
+    :type workers: int
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: Pairs of repository path and raised exception of the failed
+        repositories. Empty if the switch is committed
+    :rtype: [(str, Exception)]
+    """
+    backend = backend or model_layer.GIT_BACKEND
+    failed = threading.Event()
+    lock = threading.Lock()  # Journal writes
+
+    os.makedirs(os.path.dirname(os.path.abspath(journal_path)),
+                exist_ok=True)
+    with open(journal_path, 'w') as journal:
+        print(json.dumps({'version': JOURNAL_VERSION,
+                          'profname': prof.profname, 'flag': flag,
+                          'keys': PROF_GIT_KEYS}), file=journal)
+        journal.flush()
+
+        def switch(repo_path: str) -> None:
+            if failed.is_set():
+                return  # Aborted transaction
+            config = backend.read_config(repo_path, flag or '--local')
+            changes = model_layer.plan_switch(prof, config)
+            if not changes:
+                return
+            with lock:  # Journaled before any write
+                print(json.dumps([repo_path, [config.get(key) for key in
+                                              PROF_GIT_KEYS]]),
+                      file=journal)
+                journal.flush()
+            model_layer.write_changes(repo_path, flag, changes, backend)
+
+        errors = []
+        for repo_path, e in _bounded_map(switch, paths, workers):
+            if e is not None:
+                failed.set()
+                errors.append((repo_path, e))
+
+    if errors:
+        rollback(journal_path, workers, backend)
+    return errors
+
+
+def rollback(journal_path: str, workers: int = 8,
+             backend: GitBackend = None) -> [(str, Exception)]:
+    """Function that restores the repositories of a journal to their
+    journaled configuration.
+
+    :param journal_path: Journal path
+    :type journal_path: str
+    :param workers: Number of repositories restored at the same time
+    :type workers: int
+    :param backend: Git backend to operate with. None to use the default
+    :type backend: GitBackend
+    :return: Pairs of repository path and raised exception of the
+        repositories which could not be restored
+    :rtype: [(str, Exception)]
+    :raise ValueError: If the journal is not valid
+    """
+    backend = backend or model_layer.GIT_BACKEND
+    entries = read_journal(journal_path)
+    flag = next(entries)['flag']
+
+    def restore(entry: (str, list)) -> None:
+        repo_path, before = entry
+        config = backend.read_config(repo_path, flag or '--local')
+        model_layer.write_changes(repo_path, flag,
+                                  plan_restore(before, config), backend)
+
+    return [(entry[0], e) for entry, e in _bounded_map(restore, entries,
+                                                       workers)
+            if e is not None]
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+###########################################################
+# Gitcher 3.2
+#
+# The git profile switcher
+#
+# Copyright 2019-2020 Borja González Seoane
+#
+# Contact: garaje@glezseoane.es
+###########################################################
+
+"""Gitcher's watcher module
+
+This module watches directory trees to detect new git repositories (e.g.:
+fresh clones) as soon as they are created, and chooses their profile
+following the user rules.
+
+On Linux, the kernel inotify interface is used through ctypes, so new
+repositories are noticed with no tree rescans. Elsewhere, a polling watcher
+stats the known directories and only lists again the ones whose
+modification time changed.
+
+Rules are read from the RULES file, one per line, in the form
+'<dir|remote> <pattern> <profname>'. Patterns use shell wildcards and are
+matched against the repository path or its remote URLs. The first matching
+rule wins, and lines started with '#' are comments. E.g.:
+
+    dir ~/work/* work
+    remote *github.com:janedoe/* home
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import subprocess
+import time
+from fnmatch import fnmatchcase
+
+from gitcher import metrics, model_layer
+from gitcher.git_command_error import GitCommandError
+
+# Paths
+RULES = model_layer.HOME + '/.cherrules'
+
+# inotify constants, from <sys/inotify.h>
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+# ===============================================
+# =                    Rules                    =
+# ===============================================
+
+def load_rules(path: str = None) -> [(str, str, str)]:
+    """Function that reads the watch rules file. If it does not exist,
+    returns an empty list.
+
+    :param path: Rules file path. None to use RULES
+    :type path: str
+    :return: Rules as (kind, pattern, profname) tuples
+    :rtype: [(str, str, str)]
+    :raise ValueError: If some rule is malformed
+    """
+    rules = []
+    try:
+        f = open(path or RULES, 'r')
+    except FileNotFoundError:
+        return rules
+    with f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 2)
+            if len(fields) != 3 or fields[0] not in ['dir', 'remote']:
+                raise ValueError("Invalid rule at line {0}: '{1}'".format(
+                    n, line))
+            kind, pattern, profname = fields
+            if kind == 'dir':
+                pattern = os.path.expanduser(pattern)
+            rules.append((kind, pattern, profname))
+    return rules
+
+
+def remote_urls(repo_path: str) -> [str]:
+    """Function that returns the remote URLs of a repository.
+
+    :param repo_path: Repository path
+    :type repo_path: str
+    :return: Remote URLs
+    :rtype: [str]
+    """
+    metrics.count_spawn()
+    with subprocess.Popen(['git', '-C', repo_path, 'config', '--local', '-z',
+                           '--get-regexp', r'^remote\..*\.url$'],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE) as p:
+        output, errors = p.communicate()
+    return [entry.partition('\n')[2]
+            for entry in filter(None, output.decode('utf-8').split('\0'))]
+
+
+def choose_prof(repo_path: str, rules: [(str, str, str)],
+                deadline: float = None) -> str:
+    """Function that chooses the profile of a repository following the
+    rules. Remote URLs are only read if some remote rule is reached.
+
+    :param repo_path: Repository path
+    :type repo_path: str
+    :param rules: Rules, as returned by 'load_rules'
+    :type rules: [(str, str, str)]
+    :param deadline: Monotonic time until which to wait for some remote
+        URL when the first remote rule is reached. None to not wait
+    :type deadline: float
+    :return: Name of the profile to apply, or None if no rule matches
+    :rtype: str
+    """
+    repo_path = os.path.abspath(repo_path)
+    urls = None
+    for kind, pattern, profname in rules:
+        if kind == 'dir':
+            if fnmatchcase(repo_path, pattern):
+                return profname
+        else:
+            if urls is None:
+                urls = remote_urls(repo_path)
+                # Clones write the remote a bit after the configuration
+                while not urls and deadline is not None and \
+                        time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    urls = remote_urls(repo_path)
+            if any(fnmatchcase(url, pattern) for url in urls):
+                return profname
+    return None
+
+
+# ===============================================
+# =                  Watchers                   =
+# ===============================================
+
+def _is_repo(path: str) -> bool:
+    """Function that checks if a directory contains a git repository."""
+    return os.path.lexists(os.path.join(path, '.git'))
+
+
+def _walk_dirs(root: str):
+    """Generator that yields a directory and every subdirectory below it,
+    without going inside git directories nor following symlinks."""
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        yield path
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name != '.git' and \
+                            entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+        except OSError:
+            pass  # Vanished or not readable directory
+
+
+class InotifyWatcher(object):
+    """Class that represents a new repositories watcher based on Linux
+    inotify."""
+
+    MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+
+    def __init__(self, roots: [str]):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.paths = dict()  # Watch descriptor to directory path
+        self.repos = set()  # Known repositories
+        for root in self.roots:
+            self._add_tree(root)
+
+    def _add_watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                          self.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached; raise "
+                                   "fs.inotify.max_user_watches")
+            return  # Vanished or not readable directory
+        self.paths[wd] = path
+
+    def _add_tree(self, root: str) -> [str]:
+        """Function that watches a directory tree and returns the
+        repositories found in it."""
+        repos = []
+        for path in _walk_dirs(root):
+            self._add_watch(path)
+            if _is_repo(path) and path not in self.repos:
+                self.repos.add(path)
+                repos.append(path)
+        return repos
+
+    def rescan(self) -> [str]:
+        """Function that walks again the watched roots, and returns the
+        repositories not known yet. It recovers the events lost when the
+        inotify queue overflows.
+
+        :return: Repository paths
+        :rtype: [str]
+        """
+        repos = []
+        for root in self.roots:
+            repos.extend(self._add_tree(root))
+        return repos
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def events(self, timeout: float = None):
+        """Generator that yields the paths of the repositories which appear
+        below the watched roots.
+
+        :param timeout: Seconds to wait for new events before stopping. None
+            to wait forever
+        :type timeout: float
+        :return: Repository paths
+        :rtype: Iterator[str]
+        """
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        while True:
+            if not poller.poll(None if timeout is None else timeout * 1000):
+                return
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length]
+                                   .rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Some events were dropped, so their repositories
+                    # 	are only found walking the whole trees
+                    for repo in self.rescan():
+                        yield repo
+                    continue
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+                parent = self.paths.get(wd)
+                if parent is None:
+                    continue
+                if name == '.git':  # Directory, or gitfile of a worktree
+                    if parent not in self.repos:
+                        self.repos.add(parent)
+                        yield parent
+                elif mask & IN_ISDIR:
+                    # Contents created before the watch are caught walking
+                    for repo in self._add_tree(os.path.join(parent, name)):
+                        yield repo
+
+
+class PollingWatcher(object):
+    """Class that represents a new repositories watcher based on polling
+    the modification time of the known directories."""
+
+    def __init__(self, roots: [str], interval: float = 2.0):
+        self.interval = interval
+        self.mtimes = dict()  # Directory path to modification time
+        self.repos = set()  # Known repositories
+        for root in roots:
+            self._add_tree(os.path.abspath(root))
+
+    def _add_tree(self, root: str) -> [str]:
+        repos = []
+        for path in _walk_dirs(root):
+            try:
+                self.mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if _is_repo(path):
+                self.repos.add(path)
+                repos.append(path)
+        return repos
+
+    def close(self) -> None:
+        pass
+
+    def scan(self) -> [str]:
+        """Function that checks the known directories once, and returns the
+        new repositories found.
+
+        :return: Repository paths
+        :rtype: [str]
+        """
+        repos = []
+        for path, mtime in list(self.mtimes.items()):
+            try:
+                new_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                del self.mtimes[path]  # Removed directory
+                continue
+            if new_mtime == mtime:
+                continue
+            self.mtimes[path] = new_mtime
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name == '.git':
+                    if path not in self.repos:
+                        self.repos.add(path)
+                        repos.append(path)
+                elif entry.path not in self.mtimes and \
+                        entry.is_dir(follow_symlinks=False):
+                    repos.extend(self._add_tree(entry.path))
+        return repos
+
+    def events(self, timeout: float = None):
+        """Generator that yields the paths of the repositories which appear
+        below the watched roots.
+
+        :param timeout: Seconds to wait for new events before stopping. None
+            to wait forever
+        :type timeout: float
+        :return: Repository paths
+        :rtype: Iterator[str]
+        """
+        waited = 0.0
+        while timeout is None or waited < timeout:
+            repos = self.scan()
+            if repos:
+                waited = 0.0
+            for repo in repos:
+                yield repo
+            time.sleep(self.interval)
+            waited += self.interval
+
+
+def create_watcher(roots: [str], poll: float = None):
+    """Function that creates the best available watcher.
+
+    :param roots: Directories to watch
+    :type roots: [str]
+    :param poll: Force the polling watcher with this interval, in seconds.
+        None to use inotify when available
+    :type poll: float
+    :return: The watcher
+    :rtype: InotifyWatcher or PollingWatcher
+    """
+    if poll is None:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            poll = 2.0  # Not Linux, or inotify not reachable
+    return PollingWatcher(roots, poll)
+
+
+def apply_rules(repo_path: str, rules: [(str, str, str)],
+                wait: float = 2.0) -> str:
+    """Function that applies to a new repository the profile chosen by the
+    rules. As the repository can be still in creation (e.g.: cloning), it
+    waits for its configuration and retries while it is locked.
+
+    :param repo_path: Repository path
+    :type repo_path: str
+    :param rules: Rules, as returned by 'load_rules'
+    :type rules: [(str, str, str)]
+    :param wait: Maximum seconds to wait for the repository
+    :type wait: float
+    :return: Name of the applied profile, or None if no rule matches
+    :rtype: str
+    :raise: NotFoundProfError
+    :raise GitCommandError: If the configuration can not be written
+    """
+    deadline = time.monotonic() + wait
+    config = os.path.join(repo_path, '.git', 'config')
+    while not os.path.isfile(os.path.join(repo_path, '.git')) and \
+            not os.path.exists(config) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    profname = choose_prof(repo_path, rules, deadline)
+    if profname is None:
+        return None
+    while True:
+        try:
+            model_layer.switch_prof(profname, path=repo_path)
+            return profname
+        except GitCommandError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)  # The config is locked by the creator
@@ -12,18 +12,44 @@
 
 """Gitcher's test suite."""
 
+import io
+import json
 import os
+import pickle
 import shutil
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase, mock
 
 import git
 
 import gitcher.__main__ as gitcher
+import gitcher.api as api
+import gitcher.async_git as async_git
+import gitcher.completions as completions
+import gitcher.git_backend as git_backend
+import gitcher.gpg_keyring as gpg_keyring
+import gitcher.harvest as harvest
+import gitcher.history_audit as history_audit
+import gitcher.mailmap as mailmap
+import gitcher.metrics as metrics
 import gitcher.model_layer as model_layer
+import gitcher.output as output
 import gitcher.prof as prof
+import gitcher.prof_index as prof_index
+import gitcher.prof_store as prof_store
+import gitcher.reattribute as reattribute
+import gitcher.repo_index as repo_index
+import gitcher.repo_resolver as repo_resolver
+import gitcher.switch_journal as switch_journal
+import gitcher.watcher as watcher
+from gitcher.git_command_error import GitCommandError
+from gitcher.not_found_prof_error import NotFoundProfError
 
 
 # noinspection DuplicatedCode
@@ -33,6 +59,20 @@ class UnitTestSuite(TestCase):
     Checks the model operative from the most superficial layer available.
     """
 
+    def setUp(self):
+        """Isolates every test from the user profiles stores and cache,
+        placing them on a temporary directory."""
+        tmp_home = tempfile.mkdtemp()
+        for name, path in [('CHERFILE', '.cherfile'),
+                           ('CHERDB', '.cherfile.db'),
+                           ('CHERSHARDS', '.cherfile.shards'),
+                           ('CACHE_DIR', '.cache/gitcher')]:
+            patcher = mock.patch.object(model_layer, name,
+                                        os.path.join(tmp_home, path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(remove_tmp_dir, tmp_home)
+
     def test_set_prof(self):
         """Simulates the set order to check the correct operative effect."""
         warnings.simplefilter("ignore",
@@ -204,6 +244,1397 @@ class UnitTestSuite(TestCase):
         os.remove(cherfile_path[1])
         remove_tmp_dir(repo_path)
 
+    def test_include_prof(self):
+        """Simulates the set order through the profile fragment include, and
+        checks that a later profile update reaches the repository."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+
+        # Create a mock repo
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey="1234567A",
+                          signpref=True)
+        model_layer.save_profile(prof1)
+
+        model_layer.include_prof(prof1.profname, path=str(repo_path))
+        current_prof = model_layer.recuperate_git_current_prof(str(repo_path))
+        self.assertEqual(prof1, current_prof)
+
+        # Update the profile, without switching the repository again
+        prof1_updated = prof.Prof(profname="sample1", name='Jane Doe',
+                                  email='janedoe@work', signkey=None,
+                                  signpref=False)
+        model_layer.delete_profile(prof1.profname)
+        model_layer.save_profile(prof1_updated)
+        current_prof = model_layer.recuperate_git_current_prof(str(repo_path))
+        self.assertEqual(prof1_updated, current_prof)
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+
+    def test_switch_include_switch(self):
+        """Alternates the plain and the include profile switches, which
+        must not override each other."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        store = prof_store.CherfileStore(os.path.join(tmp_dir, 'cherfile'))
+        store.create()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey="1234567A",
+                          signpref=True)
+        prof2 = prof.Prof(profname="sample2", name='Jane Doe',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1, store)
+        model_layer.save_profile(prof2, store)
+
+        for backend in [git_backend.SubprocessGitBackend(),
+                        git_backend.ConfigFileGitBackend()]:
+            repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+            model_layer.switch_prof(prof1.profname, repo_path, store=store,
+                                    backend=backend)
+            model_layer.include_prof(prof2.profname, repo_path, store=store,
+                                     backend=backend)
+            self.assertEqual(prof2, model_layer.recuperate_git_current_prof(
+                repo_path))
+            self.assertEqual({}, backend.read_scope(repo_path, '--local')[0])
+
+            changes = model_layer.switch_prof(prof1.profname, repo_path,
+                                              store=store, backend=backend)
+            self.assertIn(('include.path', None), changes)
+            self.assertEqual(prof1, model_layer.recuperate_git_current_prof(
+                repo_path))
+            self.assertEqual([], backend.read_scope(repo_path, '--local')[1])
+            self.assertEqual([], model_layer.switch_prof(
+                prof1.profname, repo_path, store=store, backend=backend))
+            remove_tmp_dir(repo_path)
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_async_switch_prof(self):
+        """Switches several repositories at the same time with the
+        asynchronous git layer."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1)
+
+        prof2 = prof.Prof(profname="sample2", name='John',
+                          email='johndoe@work', signkey="1234567A",
+                          signpref=True)
+        model_layer.save_profile(prof2)
+
+        repo_paths = [create_tmp_dir_with_repo('jane <janedoe@home>')
+                      for _ in range(3)]
+        # One repository points to a fragment and has a repeated key, as
+        # 	the synchronous switch leaves them
+        model_layer.include_prof(prof2.profname, repo_paths[0])
+        subprocess.run(['git', '-C', repo_paths[0], 'config', '--add',
+                        'user.signingkey', '7654321B'], check=True)
+        expected_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        model_layer.include_prof(prof2.profname, expected_path)
+        subprocess.run(['git', '-C', expected_path, 'config', '--add',
+                        'user.signingkey', '7654321B'], check=True)
+        expected_changes = model_layer.switch_prof(prof1.profname,
+                                                   expected_path)
+
+        executor = async_git.AsyncGitExecutor(concurrency=2)
+        results = async_git.run(async_git.switch_prof_repos(
+            prof1.profname, repo_paths, executor=executor))
+        for result in results:
+            self.assertNotIsInstance(result, Exception)
+        self.assertEqual(expected_changes, results[0])
+
+        expected_config = subprocess.run(
+            ['git', '-C', expected_path, 'config', '--local', '--list'],
+            stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(expected_config, subprocess.run(
+            ['git', '-C', repo_paths[0], 'config', '--local', '--list'],
+            stdout=subprocess.PIPE, check=True).stdout)
+        remove_tmp_dir(expected_path)
+
+        for repo_path in repo_paths:
+            current_prof = async_git.run(
+                async_git.recuperate_git_current_prof(repo_path, executor))
+            self.assertEqual(prof1, current_prof)
+            remove_tmp_dir(repo_path)  # Clean environment
+
+    def test_git_command_error(self):
+        """Rebuilds a failed git command error with its fields when it is
+        pickled, as it crosses the process pools."""
+        for error in [GitCommandError(['git', 'config', 'user.name'], 128,
+                                      'fatal: not a git repository\n'),
+                      GitCommandError(['git', 'status'])]:
+            copy = pickle.loads(pickle.dumps(error))
+            self.assertEqual(error.argv, copy.argv)
+            self.assertEqual(error.returncode, copy.returncode)
+            self.assertEqual(error.stderr, copy.stderr)
+            self.assertEqual(str(error), str(copy))
+        self.assertEqual("'git status' timed out",
+                         str(GitCommandError(['git', 'status'])))
+
+    def test_check_history(self):
+        """Audits the commits authorship of a repository against the saved
+        profiles."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        prof2 = prof.Prof(profname="sample2", name='jane',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1)
+        model_layer.save_profile(prof2)
+
+        # One commit of each saved profile and one of an unknown identity
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        repo = git.Repo(repo_path)
+        repo.git.commit('--allow-empty', '-m', 'Commit test effects #2',
+                        author='jane <janedoe@work>')
+        repo.git.commit('--allow-empty', '-m', 'Commit test effects #3',
+                        author='john <john@none.aq>')
+        model_layer.switch_prof(prof1.profname, path=repo_path)
+
+        missing_path = os.path.join(repo_path, 'missing')
+        reports = {report['path']: report for report in
+                   history_audit.audit_repos([repo_path, missing_path],
+                                             workers=1)}
+        self.assertIsNotNone(reports[missing_path]['error'])
+        self.assertEqual(0, sum(reports[missing_path]['counts'].values()))
+        report = reports[repo_path]
+        self.assertIsNone(report['error'])
+        self.assertEqual(1, report['counts'][history_audit.MATCH])
+        self.assertEqual(1, report['counts'][history_audit.WRONG])
+        self.assertEqual(1, report['counts'][history_audit.UNKNOWN])
+
+        # The signing key picks its owner among the profiles of the same
+        # 	identity, as a fingerprint, a long or a short key ID
+        fingerprint = '0123456789ABCDEF0123456789ABCDEF01234567'
+        index = history_audit.build_index([
+            prof.Prof('fpr', 'jane', 'janedoe@home', fingerprint, True),
+            prof.Prof('short', 'jane', 'janedoe@home', '0xab12cd34!', True),
+            prof.Prof('nokey', 'jane', 'janedoe@home', None, False)])
+        for signkey, owner in [(fingerprint[-16:], 'fpr'),
+                               (fingerprint.lower(), 'fpr'),
+                               ('FFFFFFFFAB12CD34', 'short')]:
+            self.assertEqual(
+                (history_audit.MATCH, [owner]),
+                history_audit.classify_commit(index, {owner}, 'jane',
+                                              'janedoe@home', signkey))
+        self.assertEqual(3, len(history_audit.classify_commit(
+            index, set(), 'jane', 'janedoe@home', 'AAAA1111')[1]))
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+
+    def test_switch_prof_minimal_changes(self):
+        """Checks that switching to the profile in use changes nothing, and
+        that a dry run does not write the planned changes."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        prof2 = prof.Prof(profname="sample2", name='jane',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1)
+        model_layer.save_profile(prof2)
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+
+        changes = model_layer.switch_prof(prof1.profname, path=repo_path)
+        self.assertEqual([('user.name', 'jane'),
+                          ('user.email', 'janedoe@home'),
+                          ('commit.gpgsign', 'false')], changes)
+        self.assertEqual([], model_layer.switch_prof(prof1.profname,
+                                                     path=repo_path))
+
+        changes = model_layer.switch_prof(prof2.profname, path=repo_path,
+                                          dry_run=True)
+        self.assertEqual([('user.email', 'janedoe@work')], changes)
+        current_prof = model_layer.recuperate_git_current_prof(repo_path)
+        self.assertEqual(prof1, current_prof)
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+
+    def test_migrate_store(self):
+        """Migrates the profiles to the SQLite store and back, operating
+        with both of them."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        with mock.patch.object(model_layer, 'CHERFILE',
+                               os.path.join(tmp_dir, 'cherfile')), \
+                mock.patch.object(model_layer, 'CHERDB',
+                                  os.path.join(tmp_dir, 'cherfile.db')):
+            model_layer.create_cherfile()
+            prof1 = prof.Prof(profname="sample1", name='jane',
+                              email='janedoe@home', signkey="1234567A",
+                              signpref=True)
+            prof2 = prof.Prof(profname="sample2", name='Pepe García',
+                              email='pepe@none.aq', signkey=None,
+                              signpref=False)
+            model_layer.save_profile(prof1)
+            model_layer.save_profile(prof2)
+
+            self.assertEqual(2, model_layer.migrate_store('sqlite'))
+            self.assertIsInstance(model_layer.get_store(),
+                                  prof_store.SqliteStore)
+            self.assertEqual(prof2, model_layer.recuperate_prof('sample2'))
+            prof4 = prof.Prof(profname="sample4", name='jane',
+                              email='janedoe@work', signkey=None,
+                              signpref=False)
+            model_layer.get_store().save_profiles([prof4])
+            self.assertEqual(prof4, model_layer.recuperate_prof('sample4'))
+            model_layer.get_store().delete_profiles(['sample4'])
+            self.assertRaises(NotFoundProfError, model_layer.recuperate_prof,
+                              'sample4')
+
+            prof2_updated = prof.Prof(profname="sample3", name='Pepe García',
+                                      email='pepe@none.aq', signkey=None,
+                                      signpref=True)
+            model_layer.update_profile(prof2.profname, prof2_updated)
+            model_layer.delete_profile(prof1.profname)
+
+            self.assertEqual(1, model_layer.migrate_store('cherfile'))
+            self.assertIsInstance(model_layer.get_store(),
+                                  prof_store.CherfileStore)
+            profs = model_layer.recuperate_profs()
+            self.assertEqual(['sample3'], [x.profname for x in profs])
+            self.assertEqual(prof2_updated, profs[0])
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_cherfile_format(self):
+        """Migrates a legacy CHERFILE, skipping its malformed lines, and
+        operates profiles with commas and tabs."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'cherfile')
+        with open(path, 'w') as f:
+            f.write("####################\n# GITCHER CHERFILE #\n"
+                    "####################\n\n"
+                    "sample1,jane,janedoe@home,1234567A,True\n"
+                    "broken,line\n"
+                    "sample2,Pepe García,pepe@none.aq,None,False\n")
+        store = prof_store.CherfileStore(path)
+        with self.assertWarns(prof_store.MalformedLineWarning):
+            profs = list(store.iter_profs())
+        self.assertEqual(
+            [prof.Prof(profname="sample1", name='jane', email='janedoe@home',
+                       signkey="1234567A", signpref=True),
+             prof.Prof(profname="sample2", name='Pepe García',
+                       email='pepe@none.aq', signkey=None, signpref=False)],
+            profs)
+        with open(path, 'r') as f:
+            self.assertEqual(
+                "# gitcher cherfile 2\n"
+                "sample1\tjane\tjanedoe@home\t1234567A\ttrue\n"
+                "broken,line\n"
+                "sample2\tPepe García\tpepe@none.aq\t\tfalse\n", f.read())
+
+        prof3 = prof.Prof(profname="sample3", name='Doe, Jane\tJr.',
+                          email='jane@doe\\home', signkey=None,
+                          signpref=True)
+        store.save_profile(prof3)
+        with open(path, 'a') as f:
+            f.write("sample4\tjohn\tjohndoe@home\t\tmaybe\n")
+        with self.assertWarnsRegex(prof_store.MalformedLineWarning,
+                                   'line 6 skipped'):
+            self.assertEqual(prof3, store.recuperate_profs()[-1])
+        warnings.simplefilter("ignore", prof_store.MalformedLineWarning)
+        store.update_profile('sample3', prof.Prof(
+            profname="sample3", name='Doe, Jane', email='jane@doe',
+            signkey=None, signpref=False))
+        store.delete_profile('sample1')
+        self.assertEqual(['sample2', 'sample3'],
+                         [x.profname for x in store.iter_profs()])
+        self.assertEqual('Doe, Jane', store.recuperate_prof('sample3').name)
+
+        # A comment above the header, and an unknown version
+        with open(path, 'r') as f:
+            content = f.read()
+        with open(path, 'w') as f:
+            f.write("# My profiles\n" + content)
+        self.assertEqual(['sample2', 'sample3'],
+                         [x.profname for x in store.iter_profs()])
+        with open(path, 'w') as f:
+            f.write("# gitcher cherfile 3\nsample5\tjane\tj@h\t\tfalse\n")
+        with self.assertRaises(prof_store.StoreFormatError):
+            store.save_profile(prof3)
+        with open(path, 'r') as f:
+            self.assertEqual("# gitcher cherfile 3\nsample5\tjane\tj@h\t\t"
+                             "false\n", f.read())
+
+        # The command line reports it, with no traceback
+        shutil.copyfile(path, model_layer.CHERFILE)
+        stdout = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['gitcher', '-l']), \
+                mock.patch.object(warnings, 'showwarning'), \
+                mock.patch('sys.stdout', stdout), \
+                self.assertRaises(SystemExit) as cm:
+            gitcher.main()
+        self.assertEqual(1, cm.exception.code)
+        self.assertIn("version 3 is not supported", stdout.getvalue())
+
+        # Headerless, with a line yet on the current format
+        with open(path, 'w') as f:
+            f.write("sample5\tja,ne\tj@h\t\tfalse\nsample6,jo,j@h,None,"
+                    "False\n")
+        self.assertEqual(1, store.migrate())
+        with open(path, 'r') as f:
+            self.assertEqual("# gitcher cherfile 2\n"
+                             "sample5\tja,ne\tj@h\t\tfalse\n"
+                             "sample6\tjo\tj@h\t\tfalse\n", f.read())
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_sharded_store(self):
+        """Operates profiles of several namespaces in a sharded store,
+        which only reads the shard of each lookup, and migrates to it."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        store = prof_store.ShardedStore(os.path.join(tmp_dir, 'shards'))
+        store.create()
+        profs = [prof.Prof(profname=profname, name='jane',
+                           email='janedoe@home', signkey=None,
+                           signpref=False)
+                 for profname in ["infra/deploy-bot", "web/jane", "root",
+                                  "infra/ci"]]
+        for x in profs:
+            store.save_profile(x)
+        shards = store.read_manifest()
+        self.assertEqual(['', 'infra', 'web'], sorted(shards))
+        self.assertEqual(["root", "infra/deploy-bot", "infra/ci", "web/jane"],
+                         [x.profname for x in store.iter_profs()])
+
+        web_path = os.path.join(store.path, shards['web'])
+        os.rename(web_path, web_path + '.off')  # Not read by the lookup
+        self.assertEqual(profs[0], store.recuperate_prof("infra/deploy-bot"))
+        os.rename(web_path + '.off', web_path)
+        with self.assertRaises(NotFoundProfError):
+            store.recuperate_prof("ops/jane")
+        store.delete_profile("web/jane")
+        self.assertEqual(['', 'infra'], sorted(store.read_manifest()))
+
+        store.update_profile("root", prof.Prof(
+            profname="ops/root", name='jane', email='janedoe@home',
+            signkey=None, signpref=True))
+        shards = store.read_manifest()
+        self.assertEqual(['infra', 'ops'], sorted(shards))
+        self.assertEqual(sorted(list(shards.values()) + ['manifest']),
+                         sorted(os.listdir(store.path)))
+        self.assertTrue(store.recuperate_prof("ops/root").signpref)
+
+        store.save_profiles([prof.Prof(profname=profname, name='jane',
+                                       email='janedoe@home', signkey=None,
+                                       signpref=False)
+                             for profname in ["infra/db", "qa/jane"]])
+        self.assertEqual(["infra/ci", "infra/db", "infra/deploy-bot",
+                          "ops/root", "qa/jane"],
+                         [x.profname for x in store.recuperate_profs()])
+        store.delete_profiles(["infra/db", "qa/jane", "none/jane"])
+        shards = store.read_manifest()
+        self.assertEqual(['infra', 'ops'], sorted(shards))
+        self.assertEqual(sorted(list(shards.values()) + ['manifest']),
+                         sorted(os.listdir(store.path)))
+
+        with mock.patch.object(model_layer, 'CHERFILE',
+                               os.path.join(tmp_dir, 'cherfile')), \
+                mock.patch.object(model_layer, 'CHERDB',
+                                  os.path.join(tmp_dir, 'cherfile.db')), \
+                mock.patch.object(model_layer, 'CHERSHARDS', store.path):
+            self.assertIsInstance(model_layer.get_store(),
+                                  prof_store.ShardedStore)
+            self.assertEqual(3, model_layer.migrate_store('cherfile'))
+            self.assertFalse(os.path.exists(store.path))
+            self.assertEqual(3, model_layer.migrate_store('shards'))
+            self.assertEqual(['infra', 'ops'], sorted(store.read_manifest()))
+            self.assertEqual(["infra/ci", "infra/deploy-bot", "ops/root"],
+                             [x.profname
+                              for x in model_layer.recuperate_profs()])
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_prof_index_search(self):
+        """Searches profiles through the secondary indexes."""
+        profs = [prof.Prof('home', 'Jane Doe', 'janedoe@home', 'BBBB5678',
+                           False),
+                 prof.Prof('work', 'Jane Doe', 'janedoe@corp.com',
+                           'AAAA1234', True),
+                 prof.Prof('work not sign', 'Jane Doe', 'janedoe@corp.com',
+                           None, False),
+                 prof.Prof('pepe', 'Pepe García', 'pepe@corp.com',
+                           'AAAB0000', True)]
+        index = prof_index.ProfIndex(profs)
+
+        def search(query):
+            return [x.profname for x in index.search(query)]
+
+        self.assertEqual(['pepe', 'work', 'work not sign'],
+                         search('email:*@corp.com'))
+        self.assertEqual(['pepe', 'work'], search('key:AAA*'))
+        self.assertEqual(['work'], search('key:aaaa1234'))
+        self.assertEqual(['home', 'work', 'work not sign'],
+                         search('name~jane'))
+        self.assertEqual(['pepe'], search('name:pepe*'))
+        self.assertEqual(['work'],
+                         search('email:*@corp.com name~jane signpref:true'))
+        self.assertEqual([], search('email:*@none.aq'))
+        self.assertEqual(['work', 'work not sign'], search('profname:w*'))
+        self.assertEqual(['home', 'pepe'], search('profname~E email~E'))
+        self.assertRaises(ValueError, search, 'color:red')
+        index.close()
+
+        # Persisted index, only built again when the store changes
+        tmp_dir = tempfile.mkdtemp()
+        store = prof_store.CherfileStore(os.path.join(tmp_dir, 'cherfile'))
+        store.create()
+        store.save_profiles(profs)
+        with mock.patch.object(model_layer, 'CACHE_DIR', tmp_dir):
+            index = prof_index.load_index(store)
+            self.assertEqual(['pepe', 'work'],
+                             [x.profname for x in index.search('key:AAA*')])
+            index.close()
+            with mock.patch.object(prof_store.CherfileStore, 'iter_profs',
+                                   side_effect=AssertionError):
+                index = prof_index.load_index(store)
+                self.assertEqual(['home'], [x.profname for x in
+                                            index.search('email:*@home')])
+                index.close()
+            store.delete_profile('home')
+            index = prof_index.load_index(store)
+            self.assertEqual([], list(index.search('email:*@home')))
+            index.close()
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_api(self):
+        """Operates with a cherfile through the public API, with no use of
+        the default one."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        gitcher_api = api.Gitcher(cherfile_path=os.path.join(tmp_dir,
+                                                             'cherfile'))
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey="1234567A",
+                          signpref=True)
+        prof2 = prof.Prof(profname="sample2", name='Pepe García',
+                          email='pepe@none.aq', signkey=None,
+                          signpref=False)
+        gitcher_api.add(prof1)
+        gitcher_api.add(prof2)
+        self.assertRaises(ValueError, gitcher_api.add, prof1)
+        self.assertEqual(['sample1', 'sample2'],
+                         [x.profname for x in gitcher_api.list()])
+
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        gitcher_api.switch(prof2.profname, path=repo_path)
+        self.assertEqual('sample2', gitcher_api.current(repo_path).profname)
+
+        gitcher_api.delete(prof2.profname)
+        self.assertRaises(NotFoundProfError, gitcher_api.lookup,
+                          prof2.profname)
+        self.assertEqual('tmp', gitcher_api.current(repo_path).profname)
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+        remove_tmp_dir(tmp_dir)
+
+    def test_watch(self):
+        """Detects new repositories below a watched tree, and applies them
+        the profile chosen by the rules."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1)
+
+        root = tempfile.mkdtemp()
+        rules_path = os.path.join(root, 'cherrules')
+        with open(rules_path, 'w') as f:
+            print("# Work repositories", file=f)
+            print("dir {0}/work/* sample1".format(root), file=f)
+        rules = watcher.load_rules(rules_path)
+        self.assertEqual([('dir', root + '/work/*', 'sample1')], rules)
+
+        w = watcher.PollingWatcher([root], interval=0.01)
+        self.assertEqual([], w.scan())
+        os.makedirs(os.path.join(root, 'work'))
+        self.assertEqual([], w.scan())
+        repo_path = os.path.join(root, 'work', 'repo')
+        git.Repo.init(repo_path)
+        self.assertEqual([repo_path], w.scan())
+        self.assertEqual([], w.scan())  # Only once
+
+        self.assertEqual('sample1', watcher.apply_rules(repo_path, rules))
+        current_prof = model_layer.recuperate_git_current_prof(repo_path)
+        self.assertEqual(prof1, current_prof)
+        self.assertIsNone(watcher.choose_prof(root, rules))
+
+        # A directory rule before the remote ones does not wait for remotes
+        remote_rules = rules + [('remote', '*github.com*', 'sample1')]
+        start = time.monotonic()
+        self.assertEqual('sample1',
+                         watcher.apply_rules(repo_path, remote_rules))
+        self.assertLess(time.monotonic() - start, 1.0)
+
+        # Clean environment
+        remove_tmp_dir(root)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'),
+                         "inotify is only available on Linux")
+    def test_inotify_watch(self):
+        """Detects new repositories below a watched tree through inotify,
+        once each, including the ones created inside new directories."""
+        root = tempfile.mkdtemp()
+        git.Repo.init(os.path.join(root, 'old'))
+        w = watcher.InotifyWatcher([root])
+        self.assertEqual({os.path.join(root, 'old')}, w.repos)
+        self.assertEqual([], list(w.events(timeout=0.1)))
+
+        repo_path = os.path.join(root, 'work', 'deep', 'repo')
+        git.Repo.init(repo_path)  # Inside directories yet to be watched
+        wt_path = os.path.join(root, 'wt')
+        os.makedirs(wt_path)
+        with open(os.path.join(wt_path, '.git'), 'w') as f:
+            f.write("gitdir: {0}\n".format(os.path.join(repo_path, '.git')))
+        self.assertEqual(sorted([repo_path, wt_path]),
+                         sorted(w.events(timeout=0.5)))
+        git.Repo.init(os.path.join(root, 'work', 'other'))
+        self.assertEqual([os.path.join(root, 'work', 'other')],
+                         list(w.events(timeout=0.5)))
+
+        # Lost events are recovered walking the trees after an overflow
+        lost_path = os.path.join(root, 'lost', 'repo')
+        git.Repo.init(lost_path)
+        os.read(w.fd, 64 * 1024)  # Drop the queued events
+        os.makedirs(os.path.join(root, 'empty'))  # Wakes up the watcher
+        read = os.read
+        overflows = [watcher.EVENT_HEADER.pack(-1, watcher.IN_Q_OVERFLOW,
+                                               0, 0)]
+        with mock.patch.object(
+                watcher.os, 'read',
+                side_effect=lambda fd, n: overflows.pop() if overflows
+                else read(fd, n)):
+            self.assertEqual([lost_path], list(w.events(timeout=0.1)))
+        w.close()
+
+        # Clean environment
+        remove_tmp_dir(root)
+
+    def test_metrics(self):
+        """Records invocations in a rotating ledger, counting the spawned
+        git subprocesses, and summarizes them per command."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1)
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+
+        tmp_dir = tempfile.mkdtemp()
+        ledger = os.path.join(tmp_dir, 'metrics.log')
+        with mock.patch.dict(metrics.counters, {'spawns': 0, 'parse': 0.0}), \
+                mock.patch.object(metrics, 'MAX_LEDGER_SIZE', 60):
+            model_layer.switch_prof(prof1.profname, path=repo_path)
+            self.assertEqual(4, metrics.counters['spawns'])  # Read, 3 sets
+            self.assertGreater(metrics.counters['parse'], 0)
+            for wall in [0.001, 0.002, 0.003, 0.004]:
+                metrics.record(ledger, 's', wall, 42)
+            metrics.record(ledger, 'l', 0.010, 42)
+        self.assertTrue(os.path.exists(ledger + '.1'))  # Rotated
+
+        records = list(metrics.read_records(ledger))
+        self.assertEqual(['s', 's', 's', 's', 'l'],
+                         [rec['cmd'] for rec in records])
+        self.assertEqual(4, records[0]['spawns'])
+        summary = metrics.summarize(records)
+        self.assertEqual(4, summary['s']['count'])
+        self.assertEqual(2.0, summary['s']['p50'])
+        self.assertEqual(4.0, summary['s']['p99'])
+        self.assertEqual(2.0, summary['s']['trend'])  # Median 1 to 3 ms
+        self.assertIsNone(summary['l']['trend'])
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+        remove_tmp_dir(tmp_dir)
+
+    def test_git_backends(self):
+        """Runs switch and current cycles on the in-memory fake backend, in
+        parallel, and checks that the config files backend edits a
+        repository as git does."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey="1234567A",
+                          signpref=True)
+        prof2 = prof.Prof(profname="sample2", name=' Jane; "Doe" ',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+
+        # In-memory fake, isolated from the user configuration
+        backend = git_backend.MemoryGitBackend()
+        backend.set_config(None, '--global', 'user.name', 'global')
+
+        def cycles(path):
+            for i in range(500):
+                x = [prof1, prof2][i % 2]
+                model_layer.apply_prof(x, path=path, backend=backend)
+                self.assertEqual(x, model_layer.recuperate_git_current_prof(
+                    path, backend=backend))
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for result in pool.map(cycles, ['/repo{0}'.format(i)
+                                            for i in range(4)]):
+                self.assertIsNone(result)
+        self.assertEqual({'user.name': 'global'},
+                         backend.read_config('/repo5'))
+
+        # Config files backend, checked against git
+        model_layer.create_cherfile()
+        model_layer.save_profile(prof1)
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        tmp_dir = tempfile.mkdtemp()
+        backend = git_backend.ConfigFileGitBackend(
+            global_path=os.path.join(tmp_dir, 'gitconfig'))
+        git_cmd = git_backend.SubprocessGitBackend()
+        for x in [prof2, prof1, prof2]:
+            model_layer.apply_prof(x, path=repo_path, backend=backend)
+            self.assertEqual(x, model_layer.prof_from_git_config(
+                git_cmd.read_config(repo_path, '--local')))
+        self.assertEqual(git_cmd.read_config(repo_path, '--local'),
+                         backend.read_config(repo_path, '--local'))
+
+        # Included fragments are followed on reads
+        for key in git_backend.PROF_GIT_KEYS:
+            backend.unset_config(repo_path, '', key)
+        model_layer.include_prof(prof1.profname, path=repo_path,
+                                 backend=backend)
+        self.assertEqual(prof1, model_layer.recuperate_git_current_prof(
+            repo_path, backend=backend))
+        self.assertEqual(prof1, model_layer.recuperate_git_current_prof(
+            repo_path))
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+        remove_tmp_dir(tmp_dir)
+
+    def test_switch_prof_recursive(self):
+        """Switches a superproject with nested submodules and a linked
+        worktree with its own configuration."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        model_layer.create_cherfile()
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+        model_layer.save_profile(prof1)
+
+        leaf_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        mid_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        top_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        wt_path = tempfile.mkdtemp()
+        os.rmdir(wt_path)
+
+        def run_git(path, *args):
+            subprocess.run(['git', '-c', 'protocol.file.allow=always',
+                            '-C', path] + list(args),
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+
+        run_git(mid_path, 'submodule', 'add', leaf_path, 'libs/leaf')
+        run_git(mid_path, 'commit', '-m', 'Add leaf',
+                '--author', 'jane <janedoe@home>')
+        run_git(top_path, 'submodule', 'add', mid_path, 'mid')
+        run_git(top_path, 'submodule', 'update', '--init', '--recursive')
+        run_git(top_path, 'config', 'extensions.worktreeConfig', 'true')
+        run_git(top_path, 'worktree', 'add', '--detach', wt_path)
+
+        leaf_sub_path = os.path.join(top_path, 'mid', 'libs', 'leaf')
+        self.assertEqual(os.path.join(top_path, 'mid'),
+                         model_layer.find_repo_root(
+                             os.path.join(leaf_sub_path, '..')))
+
+        results = model_layer.switch_prof_recursive(prof1.profname,
+                                                    path=top_path)
+        self.assertEqual(['.', 'worktree ' + top_path, 'worktree ' + wt_path,
+                          'submodule mid', 'submodule mid/libs/leaf'],
+                         [label for label, result in results])
+        self.assertTrue(all(result for label, result in results))
+        for path in [top_path, wt_path, leaf_sub_path]:
+            current_prof = model_layer.recuperate_git_current_prof(path)
+            self.assertEqual(prof1, current_prof)
+        results = model_layer.switch_prof_recursive(prof1.profname,
+                                                    path=leaf_sub_path)
+        self.assertEqual([('.', [])], results)
+
+        # Clean environment
+        for path in [leaf_path, mid_path, top_path, wt_path]:
+            remove_tmp_dir(path)
+
+    def test_repo_index(self):
+        """Indexes the repositories below a tree, pruning the ignored
+        directories, and rescans only the changed directories."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        root = tempfile.mkdtemp()
+        for path in ['work/a', 'work/node_modules/b', 'home/deep/c']:
+            git.Repo.init(os.path.join(root, path))
+        tmp_dir = tempfile.mkdtemp()
+        index_path = os.path.join(tmp_dir, 'repos.idx')
+
+        index = repo_index.RepoIndex([root])
+        index.scan()
+        self.assertEqual([os.path.join(root, 'home/deep/c'),
+                          os.path.join(root, 'work/a')], index.repos())
+        index.save(index_path)
+
+        # Only the parent of the new repository is listed again
+        git.Repo.init(os.path.join(root, 'work/d'))
+        shutil.rmtree(os.path.join(root, 'home/deep/c'))
+        index = repo_index.RepoIndex.load(index_path)
+        with mock.patch.object(repo_index, '_scan_dir',
+                               wraps=repo_index._scan_dir) as scan_dir:
+            index.scan()
+        self.assertEqual({os.path.join(root, 'work'),
+                          os.path.join(root, 'work/d'),
+                          os.path.join(root, 'home/deep')},
+                         {call[0][0] for call in scan_dir.call_args_list})
+        self.assertEqual([os.path.join(root, 'work/a'),
+                          os.path.join(root, 'work/d')], index.repos())
+
+        # Last applied profiles, from the side file
+        index.save(index_path)
+        with mock.patch.object(repo_index, 'index_path',
+                               return_value=index_path):
+            repo_index.record_prof([os.path.join(root, 'work/a/sub')],
+                                   'sample1')
+        self.assertEqual({os.path.join(root, 'work/a'): 'sample1'},
+                         repo_index.RepoIndex.load(index_path).profs)
+
+        # Profiles recorded between a load and its save are merged, and
+        # 	the ones recorded during a failed save are kept
+        index = repo_index.RepoIndex.load(index_path)
+        with mock.patch.object(repo_index, 'index_path',
+                               return_value=index_path):
+            repo_index.record_prof([os.path.join(root, 'work/d')],
+                                   'sample2')
+            with mock.patch.object(repo_index.RepoIndex, '_write',
+                                   side_effect=OSError):
+                self.assertRaises(OSError, index.save, index_path)
+            index.save(index_path)
+            repo_index.record_prof([os.path.join(root, 'work/a')],
+                                   'sample3')
+        self.assertEqual({os.path.join(root, 'work/a'): 'sample3',
+                          os.path.join(root, 'work/d'): 'sample2'},
+                         repo_index.RepoIndex.load(index_path).profs)
+        self.assertEqual(['repos.idx', 'repos.idx.profs'],
+                         sorted(os.listdir(tmp_dir)))
+
+        # Clean environment
+        remove_tmp_dir(root)
+        remove_tmp_dir(tmp_dir)
+
+    def test_repo_resolver(self):
+        """Finds repositories from their subdirectories, linked worktrees
+        and bare repositories in process, respecting the git environment
+        variables, and caches them."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        repo_path = create_tmp_dir_with_repo('jane <janedoe@home>')
+        deep_path = os.path.join(repo_path, 'a', 'b', 'c')
+        os.makedirs(deep_path)
+        wt_path = tempfile.mkdtemp()
+        os.rmdir(wt_path)
+        git.Repo(repo_path).git.worktree('add', '--detach', wt_path)
+        bare_path = tempfile.mkdtemp()
+        git.Repo.init(bare_path, bare=True)
+        git_dir = os.path.join(repo_path, '.git')
+
+        repo_resolver.clear_cache()
+        with mock.patch.dict(os.environ, {}):
+            for var in ['GIT_DIR', 'GIT_WORK_TREE', 'GIT_CEILING_DIRECTORIES']:
+                os.environ.pop(var, None)
+            location = repo_resolver.resolve(deep_path)
+            self.assertEqual(repo_resolver.RepoLocation(repo_path, git_dir,
+                                                        git_dir), location)
+            self.assertEqual(os.path.join(git_dir, 'config'),
+                             location.config_path)
+            # Cached for every walked directory
+            with mock.patch('os.path.isdir') as isdir:
+                self.assertEqual(location, repo_resolver.resolve(
+                    os.path.join(repo_path, 'a')))
+                isdir.assert_not_called()
+
+            location = repo_resolver.resolve(wt_path)
+            self.assertEqual(wt_path, location.worktree)
+            self.assertEqual(git_dir, location.common_dir)
+            self.assertTrue(repo_resolver.resolve(
+                os.path.join(bare_path, 'refs')).bare)
+            self.assertEqual(repo_path, model_layer.find_repo_root(deep_path))
+
+            os.environ['GIT_CEILING_DIRECTORIES'] = repo_path
+            self.assertIsNone(repo_resolver.resolve(deep_path))
+            del os.environ['GIT_CEILING_DIRECTORIES']
+
+            os.environ['GIT_DIR'] = git_dir
+            self.assertEqual(git_dir, repo_resolver.resolve(
+                bare_path).git_dir)
+
+        # Clean environment
+        repo_resolver.clear_cache()
+        for path in [repo_path, wt_path, bare_path]:
+            remove_tmp_dir(path)
+
+    def test_completions(self):
+        """Keeps the profile names cache up to date with the saved profiles
+        and renders the completion scripts which read it."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        with mock.patch.object(model_layer, 'CHERFILE',
+                               os.path.join(tmp_dir, 'cherfile')), \
+                mock.patch.object(model_layer, 'CHERDB',
+                                  os.path.join(tmp_dir, 'cherfile.db')), \
+                mock.patch.object(model_layer, 'CACHE_DIR',
+                                  os.path.join(tmp_dir, 'cache')):
+            cache_path = model_layer.profnames_cache_path()
+
+            def cached() -> [str]:
+                with open(cache_path, 'r') as f:
+                    return sorted(f.read().splitlines())
+
+            model_layer.create_cherfile()
+            profs = [prof.Prof(profname=profname, name='jane',
+                               email='janedoe@home', signkey=None,
+                               signpref=False)
+                     for profname in ["sample2", "sample1", "sample3"]]
+            model_layer.save_profile(profs[0])  # Built whole
+            # Then updated incrementally, with no store read
+            with mock.patch.object(prof_store.CherfileStore, 'iter_profs',
+                                   side_effect=AssertionError):
+                model_layer.save_profile(profs[1])
+                self.assertEqual(['sample1', 'sample2'], cached())
+                model_layer.update_profile("sample2", profs[2])
+                self.assertEqual(['sample1', 'sample3'], cached())
+                model_layer.delete_profile("sample1")
+                self.assertEqual(['sample3'], cached())
+
+            for shell in completions.SHELLS:
+                script = completions.render(shell, ['l', 's'], ['doctor'],
+                                            cache_path)
+                self.assertIn(cache_path, script)
+                self.assertIn('doctor', script)
+            self.assertRaises(ValueError, completions.render, 'csh', [], [],
+                              cache_path)
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_prof_env(self):
+        """Applies a profile to git commands through their environment, with
+        no git configuration write."""
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey="1234567A",
+                          signpref=False)
+        env = model_layer.prof_env(prof1, {'GIT_CONFIG_COUNT': '1'})
+        self.assertEqual('janedoe@home', env['GIT_COMMITTER_EMAIL'])
+        self.assertEqual('5', env['GIT_CONFIG_COUNT'])
+        self.assertEqual('user.name', env['GIT_CONFIG_KEY_1'])
+        self.assertNotIn('GIT_CONFIG_KEY_0', env)
+        self.assertNotIn('user.signingkey', model_layer.prof_env(prof.Prof(
+            profname="sample2", name='jane', email='janedoe@home',
+            signkey=None, signpref=False), {}).values())
+
+        repo_path = create_tmp_dir_with_repo('john <johndoe@home>')
+        env = dict(os.environ, GIT_CONFIG_COUNT='1',
+                   GIT_CONFIG_KEY_0='core.abbrev', GIT_CONFIG_VALUE_0='12')
+        env.update(model_layer.prof_env(prof1, env))
+        read = subprocess.run(['git', 'config', '--get-regexp',
+                               r'^(user\.email|commit\.gpgsign|'
+                               r'core\.abbrev)$'],
+                              cwd=repo_path, env=env, check=True,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout
+        self.assertIn('user.email janedoe@home', read)
+        self.assertIn('commit.gpgsign false', read)
+        self.assertIn('core.abbrev 12', read)
+        self.assertNotIn('user.name',
+                         model_layer.read_git_config(repo_path, '--local'))
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+
+    def test_dedupe_profiles(self):
+        """Merges the profiles with the same identity, keeping the rest of
+        the CHERFILE lines and redirecting the merged profile fragments."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+        warnings.simplefilter("ignore", prof_store.MalformedLineWarning)
+
+        tmp_dir = tempfile.mkdtemp()
+        cherfile_path = os.path.join(tmp_dir, 'cherfile')
+        with open(cherfile_path, 'w') as f:
+            f.write("# Comment\n\n"
+                    "work,jane,janedoe@home,1234567A,True\n"
+                    "\n# Other comment\n"
+                    "home,john,johndoe@home,None,False\n"
+                    "job,jane,JaneDoe@home ,1234567A,True\n"
+                    "work2,jane,janedoe@home,1234567A,False\n"
+                    "broken,line\n")
+        store = prof_store.CherfileStore(cherfile_path,
+                                         os.path.join(tmp_dir, 'fragments'))
+        work = store.recuperate_prof('work')
+        work_fragment = model_layer.save_prof_fragment(work, store)
+
+        groups = model_layer.dedupe_profiles(dry_run=True, store=store)
+        self.assertEqual([['job', 'work']],
+                         [[p.profname for p in group] for group in groups])
+        self.assertEqual(4, len(store.recuperate_profs()))
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            model_layer.dedupe_profiles(store=store)
+        self.assertTrue(any(issubclass(w.category,
+                                       prof_store.MalformedLineWarning)
+                            for w in caught))
+        self.assertEqual(['home', 'job', 'work2'],
+                         sorted(p.profname for p in store.recuperate_profs()))
+        with open(cherfile_path, 'r') as f:
+            content = f.read()
+        self.assertIn('# Other comment', content)
+        self.assertIn('broken,line', content)
+        self.assertEqual([], model_layer.dedupe_profiles(store=store))
+
+        # A repository which includes the merged profile fragment follows
+        # 	the kept profile
+        repo_path = tempfile.mkdtemp()
+        subprocess.run(['git', 'init', '-q', repo_path], check=True)
+        subprocess.run(['git', '-C', repo_path, 'config', 'include.path',
+                        work_fragment], check=True)
+        job = store.recuperate_prof('job')
+        self.assertTrue(os.path.exists(model_layer.fragment_path('job',
+                                                                 store)))
+        for backend in [git_backend.SubprocessGitBackend(),
+                        git_backend.ConfigFileGitBackend()]:
+            config = backend.read_config(repo_path)  # Following includes
+            self.assertEqual(job.email, config['user.email'])
+            self.assertEqual(job.signkey, config['user.signingkey'])
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+        remove_tmp_dir(tmp_dir)
+
+    def test_interactive_prefetch(self):
+        """Prints the interactive menu with no wait for a slow current
+        profile read, and the profiles list later, from the main thread
+        before the next prompt."""
+        def slow_current_git_prof():
+            time.sleep(0.5)
+            return None
+
+        stdout = io.StringIO()
+        with mock.patch.object(gitcher, 'current_git_prof',
+                               slow_current_git_prof), \
+                mock.patch.object(gitcher, 'PREFETCH_DEADLINE', 0.05), \
+                mock.patch.object(gitcher, 'dictionary', mock.Mock(
+                    cmds_interactive_mode=['q'])), \
+                mock.patch.object(gitcher, 'listen', return_value='q'), \
+                mock.patch.object(model_layer, 'recuperate_profs',
+                                  return_value=[]), \
+                mock.patch.object(gitcher, 'late_prof_list', None), \
+                mock.patch('sys.stdout', stdout):
+            start = time.perf_counter()
+            self.assertRaises(SystemExit, gitcher.interactive_main)
+            self.assertLess(time.perf_counter() - start, 0.4)
+            self.assertIn("Options:", stdout.getvalue())
+            self.assertNotIn("No gitcher profiles", stdout.getvalue())
+
+            time.sleep(0.7)  # Ready, but not printed by the loader thread
+            self.assertNotIn("No gitcher profiles", stdout.getvalue())
+            gitcher.print_late_prof_list()  # Before the next prompt
+            self.assertIn("No gitcher profiles", stdout.getvalue())
+            gitcher.print_late_prof_list()  # Only once
+            self.assertEqual(1, stdout.getvalue().count("No gitcher "
+                                                        "profiles"))
+
+    def test_reattribute(self):
+        """Rewrites the commits of a profile, and only them and their
+        descendants, reporting the signed ones."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        prof2 = prof.Prof(profname="sample2", name='jane',
+                          email='janedoe@work', signkey=None,
+                          signpref=False)
+        repo_path = create_tmp_dir_with_repo('john <johndoe@home>')
+        repo = git.Repo(repo_path)
+        first = repo.head.commit.hexsha
+        repo.git.commit('--allow-empty', '-m', 'Commit test effects #2',
+                        author='jane <JaneDoe@home>')
+        # A signed commit, with a fake signature
+        signed = subprocess.run(
+            ['git', '-C', repo_path, 'hash-object', '-t', 'commit', '-w',
+             '--stdin'], stdout=subprocess.PIPE, check=True,
+            universal_newlines=True,
+            input="tree {0}\nparent {1}\n"
+                  "author john <johndoe@home> 1600000000 +0000\n"
+                  "committer john <johndoe@home> 1600000000 +0000\n"
+                  "gpgsig -----BEGIN PGP SIGNATURE-----\n fake\n"
+                  " -----END PGP SIGNATURE-----\n\nCommit test effects "
+                  "#3\n".format(repo.head.commit.tree.hexsha,
+                                  repo.head.commit.hexsha)).stdout.strip()
+        repo.git.update_ref('HEAD', signed)
+        old_tip = repo.head.commit.hexsha
+
+        plan = reattribute.reattribute(repo_path, prof1, prof2,
+                                       dry_run=True)
+        self.assertEqual((1, 2, [signed]), (plan['matched'],
+                                            plan['rewritten'],
+                                            plan['signed']))
+        self.assertEqual(old_tip, repo.head.commit.hexsha)
+
+        plan = reattribute.reattribute(repo_path, prof1, prof2)
+        commits = list(repo.iter_commits())
+        self.assertEqual(['johndoe@home', 'janedoe@work', 'johndoe@home'],
+                         [c.author.email for c in commits])
+        self.assertEqual(first, commits[2].hexsha)  # Not rewritten
+        branch = repo.head.ref.path
+        self.assertEqual({branch: old_tip}, plan['refs'])
+        self.assertEqual(old_tip, repo.git.rev_parse(
+            reattribute.ORIGINAL_REFS + branch))
+        self.assertEqual(0, reattribute.reattribute(repo_path, prof1,
+                                                    prof2)['matched'])
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+
+    def test_mailmap(self):
+        """Merges the saved profiles into a mailmap, which git uses to map
+        every variant of their identities."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        profs = [prof.Prof(profname="sample1", name='Jane Doe',
+                           email='janedoe@work', signkey=None,
+                           signpref=False),
+                 prof.Prof(profname="sample2", name='jane',
+                           email='JaneDoe@Work ', signkey=None,
+                           signpref=False),
+                 prof.Prof(profname="sample3", name='jane',
+                           email='janedoe@home', signkey=None,
+                           signpref=False)]
+        self.assertEqual([('Jane Doe', 'janedoe@work', None,
+                           'janedoe@work'),
+                          ('jane', 'janedoe@home', None, 'janedoe@home')],
+                         mailmap.prof_entries(profs))
+        self.assertEqual(('A', 'a@a', None, 'b@b'),
+                         mailmap.parse_entry('A <a@a> <b@b>  # Comment'))
+        self.assertIsNone(mailmap.parse_entry('# Comment'))
+
+        repo_path = create_tmp_dir_with_repo('john <johndoe@home>')
+        path = os.path.join(repo_path, mailmap.MAILMAP_NAME)
+        with open(path, 'w') as f:
+            f.write("# Team mailmap\n\nJohn <johndoe@home> <jd@home>\n"
+                    "# Former staff\nOld <JANEDOE@home>\n"
+                    "Zed <zed@none.aq>  # Kept as it is\n")
+        os.chmod(path, 0o640)
+        self.assertEqual(2, mailmap.merge_mailmap(
+            path, mailmap.prof_entries(profs)))
+        with open(path, 'r') as f:
+            self.assertEqual("# Team mailmap\n\n"
+                             "jane <janedoe@home> <janedoe@home>\n"
+                             "Jane Doe <janedoe@work> <janedoe@work>\n"
+                             "John <johndoe@home> <jd@home>\n"
+                             "# Former staff\n"
+                             "Zed <zed@none.aq>  # Kept as it is\n",
+                             f.read())
+        self.assertEqual(0o640, os.stat(path).st_mode & 0o777)
+        self.assertEqual(0, mailmap.merge_mailmap(
+            path, mailmap.prof_entries(profs)))
+        new_path = os.path.join(repo_path, 'new.mailmap')
+        self.assertEqual(2, mailmap.merge_mailmap(
+            new_path, mailmap.prof_entries(profs)))
+        self.assertEqual(0o644, os.stat(new_path).st_mode & 0o777)
+        self.assertEqual('Jane Doe <janedoe@work>', git.Repo(
+            repo_path).git.check_mailmap('jane <JaneDoe@Work>'))
+
+        # Clean environment
+        remove_tmp_dir(repo_path)
+
+    def test_harvest(self):
+        """Harvests the identities of the repositories below a root and
+        creates a profile for each one which is not yet saved."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        tmp_dir = tempfile.mkdtemp()
+        identities = [('work/a', 'Jane Doe', 'jane@corp.com', None),
+                      ('work/b', 'Jane Doe', 'Jane@Corp.com', None),
+                      ('home/a', 'jane', 'jane@home.org', '1234567A'),
+                      ('home/b', 'John Doe', 'john@home.org', None),
+                      ('other', None, None, None)]  # Global identity
+        for repo, name, email, signkey in identities:
+            with git.Repo.init(os.path.join(tmp_dir, 'root', repo)) \
+                    .config_writer() as writer:
+                if name is not None:
+                    writer.set_value('user', 'name', name)
+                    writer.set_value('user', 'email', email)
+                if signkey is not None:
+                    writer.set_value('user', 'signingkey', signkey)
+                    writer.set_value('commit', 'gpgsign', 'true')
+
+        store = prof_store.CherfileStore(os.path.join(tmp_dir, 'cherfile'))
+        store.create()
+        john = prof.Prof(profname="john", name='John Doe',
+                         email='john@home.org', signkey=None, signpref=False)
+        store.save_profile(john)
+        with open(store.path, 'a') as f:
+            f.write("# Hand kept\nbroken\tline\n")
+
+        plan = harvest.harvest([os.path.join(tmp_dir, 'root')], dry_run=True,
+                               store=store)
+        self.assertEqual(
+            [(prof.Prof(profname="jane", name='Jane Doe',
+                        email='jane@corp.com', signkey=None,
+                        signpref=False), 2),
+             (prof.Prof(profname="jane-home", name='jane',
+                        email='jane@home.org', signkey='1234567A',
+                        signpref=True), 1)],
+            [(x, len(repo_paths)) for x, repo_paths in plan])
+        self.assertEqual([john], store.recuperate_profs())
+
+        with mock.patch.object(model_layer, 'CACHE_DIR', tmp_dir):
+            harvest.harvest([os.path.join(tmp_dir, 'root')], store=store)
+        self.assertEqual(['jane', 'jane-home', 'john'],
+                         [x.profname for x in store.recuperate_profs()])
+        with open(store.path, 'r') as f:
+            self.assertIn("# Hand kept\nbroken\tline\njane\t", f.read())
+        self.assertTrue(os.path.exists(model_layer.fragment_path(
+            'jane-home', store)))
+        self.assertEqual([], harvest.harvest([os.path.join(tmp_dir, 'root')],
+                                             store=store))
+
+        # Clean environment
+        remove_tmp_dir(tmp_dir)
+
+    def test_machine_output(self):
+        """Writes records as NDJSON, a JSON array and TSV."""
+        prof1 = prof.Prof(profname="sample1", name='jane\tdoe',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        record = output.prof_record(prof1, True)
+        self.assertEqual('sample1', record['profname'])
+        self.assertIsNone(output.prof_record(prof1, True, False)['profname'])
+
+        stream = io.StringIO()
+        with output.RecordWriter('ndjson', output.PROF_FIELDS,
+                                 stream) as writer:
+            writer.write(record)
+            writer.write(record)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(record, json.loads(lines[0]))
+        self.assertEqual(output.PROF_FIELDS, list(json.loads(lines[0])))
+
+        stream = io.StringIO()
+        with output.RecordWriter('json', output.PROF_FIELDS,
+                                 stream) as writer:
+            writer.write(record)
+        self.assertEqual([record], json.loads(stream.getvalue()))
+        stream = io.StringIO()
+        with output.RecordWriter('json', output.PROF_FIELDS, stream):
+            pass
+        self.assertEqual([], json.loads(stream.getvalue()))
+
+        stream = io.StringIO()
+        with output.RecordWriter('tsv', output.REPO_FIELDS,
+                                 stream) as writer:
+            writer.write({'path': '/a\\b', 'profname': None})
+        self.assertEqual('path\tprofname\n/a\\\\b\t\n',
+                         stream.getvalue())
+        stream = io.StringIO()
+        with output.RecordWriter('tsv', output.PROF_FIELDS,
+                                 stream) as writer:
+            writer.write(record)
+        self.assertEqual('sample1\tjane\\tdoe\tjanedoe@home\t\tfalse\t'
+                         'true\ttrue', stream.getvalue().splitlines()[1])
+
+        self.assertRaises(ValueError, output.RecordWriter, 'xml',
+                          output.PROF_FIELDS)
+
+    def test_switch_repos_journal(self):
+        """Switches several repositories as a transaction: a failing one
+        rolls every repository back, and a committed switch can be rolled
+        back later from its journal."""
+        warnings.simplefilter("ignore",
+                              ResourceWarning)  # Working with tmp files
+
+        prof1 = prof.Prof(profname="sample1", name='jane',
+                          email='janedoe@home', signkey=None,
+                          signpref=False)
+        prof2 = prof.Prof(profname="sample2", name='Jane Doe',
+                          email='janedoe@work', signkey="1234567A",
+                          signpref=True)
+        repo_paths = [create_tmp_dir_with_repo('jane <janedoe@home>')
+                      for _ in range(3)]
+        for repo_path in repo_paths:
+            model_layer.apply_prof(prof1, path=repo_path)
+        not_repo_path = tempfile.mkdtemp()
+        tmp_dir = tempfile.mkdtemp()
+        journal_path = os.path.join(tmp_dir, 'journal.ndjson')
+
+        # Failed transaction
+        errors = switch_journal.switch_repos(
+            prof2, repo_paths + [not_repo_path], journal_path, workers=2)
+        self.assertEqual([not_repo_path], [path for path, e in errors])
+        for repo_path in repo_paths:
+            current_prof = model_layer.recuperate_git_current_prof(repo_path)
+            self.assertEqual(prof1, current_prof)
+
+        # Committed transaction, rolled back later
+        errors = switch_journal.switch_repos(prof2, repo_paths,
+                                             journal_path, workers=2)
+        self.assertEqual([], errors)
+        for repo_path in repo_paths:
+            current_prof = model_layer.recuperate_git_current_prof(repo_path)
+            self.assertEqual(prof2, current_prof)
+        entries = switch_journal.read_journal(journal_path)
+        self.assertEqual('sample2', next(entries)['profname'])
+        self.assertEqual(sorted(repo_paths),
+                         sorted(path for path, before in entries))
+        self.assertEqual([], switch_journal.rollback(journal_path))
+        for repo_path in repo_paths:
+            current_prof = model_layer.recuperate_git_current_prof(repo_path)
+            self.assertEqual(prof1, current_prof)
+
+        # Switches started in the same second get their own journals
+        with mock.patch.object(switch_journal.time, 'strftime',
+                               return_value='20200101T000000'):
+            journal_paths = [switch_journal.new_journal_path('sample2')
+                             for _ in range(3)]
+        self.assertEqual(3, len(set(journal_paths)))
+        for path in journal_paths:
+            self.assertTrue(os.path.isfile(path))
+
+        # Clean environment
+        for path in repo_paths + [not_repo_path, tmp_dir]:
+            remove_tmp_dir(path)
+
+    @unittest.skipUnless(gpg_keyring.check_gpg_installed(),
+                         "gpg is not installed")
+    def test_doctor(self):
+        """Validates profile sign keys against a throwaway GPG keyring."""
+        gnupg_home = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'GNUPGHOME': gnupg_home}):
+            subprocess.run(['gpg', '--batch', '--passphrase', '',
+                            '--quick-gen-key', 'Jane Doe <janedoe@home>',
+                            'ed25519', 'sign', '1y'],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+            index = gpg_keyring.load_index(cache=False)
+            keyid = [key_id for key_id in index if len(key_id) == 16][0]
+            fpr = [key_id for key_id in index if len(key_id) == 40][0]
+            subprocess.run(['gpg', '--batch', '--passphrase', '',
+                            '--quick-add-key', fpr, 'cv25519', 'encr',
+                            '1y'],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+            index = gpg_keyring.load_index(cache=False)
+            subkeyid = [key_id for key_id in index
+                        if len(key_id) == 16 and key_id != keyid][0]
+
+            profs = [prof.Prof('home', 'Jane Doe', 'janedoe@home', keyid,
+                               True),
+                     prof.Prof('short', 'Jane Doe', 'janedoe@home',
+                               '0x' + keyid[-8:].lower(), True),
+                     prof.Prof('work', 'Jane Doe', 'janedoe@work', keyid,
+                               True),
+                     prof.Prof('lost', 'Jane Doe', 'janedoe@home',
+                               'AAAA1234', True),
+                     prof.Prof('encr', 'Jane Doe', 'janedoe@home',
+                               subkeyid + '!', True),
+                     prof.Prof('nosign', 'Jane Doe', 'janedoe@home', None,
+                               False)]
+            problems = {x.profname: problems for x, problems in
+                        gpg_keyring.check_profs_keys(profs, cache=False)}
+            self.assertEqual([], problems['home'])
+            self.assertEqual([], problems['short'])
+            self.assertEqual([gpg_keyring.UID_MISMATCH], problems['work'])
+            self.assertEqual([gpg_keyring.MISSING], problems['lost'])
+            self.assertEqual([gpg_keyring.NO_SIGN], problems['encr'])
+            self.assertEqual([], problems['nosign'])
+
+            # A year later, the key is expired
+            later = time.time() + 2 * 365 * 24 * 3600
+            self.assertEqual([gpg_keyring.EXPIRED],
+                             gpg_keyring.check_prof_key(profs[0], index,
+                                                        now=later))
+
+            # A not writable cache is skipped
+            cache_file = os.path.join(gnupg_home, 'cache')
+            open(cache_file, 'w').close()
+            with mock.patch.object(model_layer, 'CACHE_DIR', cache_file):
+                self.assertEqual(index, gpg_keyring.load_index())
+
+            subprocess.run(['gpgconf', '--kill', 'gpg-agent'],
+                           stderr=subprocess.DEVNULL)
+
+        # A failed listing is reported and not cached
+        bad_home = os.path.join(gnupg_home, 'pubring.kbx', 'gnupg')
+        with mock.patch.dict(os.environ, {'GNUPGHOME': bad_home}), \
+                mock.patch.object(model_layer, 'CACHE_DIR', gnupg_home):
+            self.assertRaises(gpg_keyring.KeyringError,
+                              gpg_keyring.load_index)
+            self.assertEqual([], [name for name in os.listdir(gnupg_home)
+                                  if name.startswith('gpg-')])
+
+        # Clean environment
+        remove_tmp_dir(gnupg_home)
+
 
 if __name__ == '__main__':
     unittest.main()